@@ -4,12 +4,14 @@ Admin classes for the  course_planning application
 #######################################################################
 from __future__ import print_function, unicode_literals
 
+from collections import defaultdict
 from functools import partial
 
 from django.conf.urls import url
 from django.contrib import admin
 from django.contrib.auth.decorators import permission_required
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.urls import reverse, reverse_lazy
 from django.utils.html import format_html
@@ -30,12 +32,20 @@ from .models import (
     TeachingSurveyQuestion,
     TimeslotTeachingPreference,
 )
+from .schedule.utils import cache
 from .schedule.views import (
     AdminAutoSchedule,
+    AdminAutoScheduleJobView,
+    AdminAutoSchedulePreviewView,
+    AdminCompactScheduleView,
     AdminCourseDetailView,
     AdminInitializeFromCurrentCourseData,
     AdminInitializeFromPrevCourseData,
     AdminInitializeFromTwoYearsAgoCourseData,
+    AdminInitializePreviewCurrent,
+    AdminInitializePreviewPrev,
+    AdminInitializePreviewTwoYearsAgo,
+    AdminMergeCurrentCourseData,
     AdminScheduleView,
     AdminTeachingProfileDetailView,
     ajax,
@@ -285,16 +295,51 @@ class DraftScheduleSessionAdmin(ClassBasedViewsAdminMixin, admin.ModelAdmin):
                 self.admin_site.admin_view(ajax.save_section),
                 name="draftschedulesession_ajax_save_section",
             ),
+            url(
+                r"^_save_sections/$",
+                self.admin_site.admin_view(ajax.save_sections),
+                name="draftschedulesession_ajax_save_sections",
+            ),
             url(
                 r"^_load_section_extra/$",
                 self.admin_site.admin_view(ajax.load_section_extra),
                 name="draftschedulesession_ajax_load_section_extra",
             ),
+            url(
+                r"^_load_section_extras/$",
+                self.admin_site.admin_view(ajax.load_section_extras),
+                name="draftschedulesession_ajax_load_section_extras",
+            ),
             url(
                 r"^_get_instructor_loads/$",
                 self.admin_site.admin_view(ajax.get_instructor_loads),
                 name="draftschedulesession_ajax_get_instructor_loads",
             ),
+            url(
+                r"^_get_session_instructor_loads/$",
+                self.admin_site.admin_view(ajax.get_session_instructor_loads),
+                name="draftschedulesession_ajax_get_session_instructor_loads",
+            ),
+            url(
+                r"^_load_worksheet/$",
+                self.admin_site.admin_view(ajax.load_worksheet),
+                name="draftschedulesession_ajax_load_worksheet",
+            ),
+            url(
+                r"^_get_section_changes/$",
+                self.admin_site.admin_view(ajax.get_section_changes),
+                name="draftschedulesession_ajax_get_section_changes",
+            ),
+            url(
+                r"^_options/(?P<name>\w+)/$",
+                self.admin_site.admin_view(ajax.search_options),
+                name="draftschedulesession_ajax_search_options",
+            ),
+            url(
+                r"^_auto_schedule_status/$",
+                self.admin_site.admin_view(ajax.auto_schedule_status),
+                name="draftschedulesession_ajax_auto_schedule_status",
+            ),
             url(
                 r"^course-info/(?P<slug>.+)/$",
                 self.admin_site.admin_view(AdminCourseDetailView.as_view()),
@@ -329,18 +374,60 @@ class DraftScheduleSessionAdmin(ClassBasedViewsAdminMixin, admin.ModelAdmin):
                 name="draftschedulesession_init_twoyears",
                 kwargs={"admin_options": self},
             ),
+            url(
+                r"^(?P<pk>.+)/init-current/preview/$",
+                self.admin_site.admin_view(AdminInitializePreviewCurrent.as_view()),
+                name="draftschedulesession_init_current_preview",
+                kwargs={"admin_options": self},
+            ),
+            url(
+                r"^(?P<pk>.+)/init-prev/preview/$",
+                self.admin_site.admin_view(AdminInitializePreviewPrev.as_view()),
+                name="draftschedulesession_init_prev_preview",
+                kwargs={"admin_options": self},
+            ),
+            url(
+                r"^(?P<pk>.+)/init-two-years-ago/preview/$",
+                self.admin_site.admin_view(AdminInitializePreviewTwoYearsAgo.as_view()),
+                name="draftschedulesession_init_twoyears_preview",
+                kwargs={"admin_options": self},
+            ),
+            url(
+                r"^(?P<pk>.+)/merge-current/$",
+                self.admin_site.admin_view(AdminMergeCurrentCourseData.as_view()),
+                name="draftschedulesession_merge_current",
+                kwargs={"admin_options": self},
+            ),
             url(
                 r"^(?P<pk>.+)/auto-schedule/$",
                 self.admin_site.admin_view(AdminAutoSchedule.as_view()),
                 name="draftschedulesession_auto_schedule",
                 kwargs={"admin_options": self},
             ),
+            url(
+                r"^auto-schedule/job/(?P<pk>.+)/$",
+                self.admin_site.admin_view(AdminAutoScheduleJobView.as_view()),
+                name="draftschedulesession_auto_schedule_job",
+                kwargs={"admin_options": self},
+            ),
+            url(
+                r"^auto-schedule/preview/(?P<pk>.+)/$",
+                self.admin_site.admin_view(AdminAutoSchedulePreviewView.as_view()),
+                name="draftschedulesession_auto_schedule_preview",
+                kwargs={"admin_options": self},
+            ),
             url(
                 r"^(?P<pk>.+)/schedule-worksheet/$",
                 self.admin_site.admin_view(AdminScheduleView.as_view()),
                 name="draftschedulesession_worksheet",
                 kwargs={"admin_options": self},
             ),
+            url(
+                r"^(?P<pk>.+)/schedule-worksheet/compact/$",
+                self.admin_site.admin_view(AdminCompactScheduleView.as_view()),
+                name="draftschedulesession_worksheet_compact",
+                kwargs={"admin_options": self},
+            ),
             url(
                 r"^(?P<pk>.+)/export/spreadsheet/$",
                 self.admin_site.admin_view(self.export_view),
@@ -408,15 +495,53 @@ class DraftSectionAdmin(admin.ModelAdmin):
     list_filter = ["session", "semester"]
     ordering = ["session", "-semester", "course", "verbose_name"]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).worksheet().select_related("session")
+
+    def _update(self, queryset, **kwargs):
+        """
+        ``queryset.update(**kwargs)``, a session at a time, so the
+        changes get the session's next revision.
+        """
+        by_session = defaultdict(list)
+        for session_id, pk in queryset.values_list("session_id", "pk"):
+            by_session[session_id].append(pk)
+        with transaction.atomic():
+            for session in DraftScheduleSession.objects.filter(pk__in=by_session):
+                pks = by_session[session.pk]
+                DraftSection.objects.filter(pk__in=pks).update(
+                    revision=session.next_revision(), **kwargs
+                )
+                cache.sections_changed(session.pk, pks)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            obj.revision = obj.session.next_revision()
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        # a new revision, so the worksheets' change feeds report it.
+        with transaction.atomic():
+            obj.session.next_revision()
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for session in DraftScheduleSession.objects.filter(
+                pk__in=queryset.values("session_id")
+            ):
+                session.next_revision()
+            super().delete_queryset(request, queryset)
+
     def clear_instructor(self, request, queryset):
-        queryset.update(instructor=None)
+        self._update(queryset, instructor=None)
 
     clear_instructor.short_description = (
         "Clear the instructor from the selected section(s)"
     )
 
     def move_semester(self, request, queryset, value):
-        queryset.update(semester=value)
+        self._update(queryset, semester=value)
 
 
 # A bit of dynamic method generation and class manipulation.
@@ -19,6 +19,9 @@ class CoursePlanningConfig(AppConfig):
         Any app specific startup code, e.g., registering signals,
         should go here.
         """
+        from . import signals
+
+        signals.connect()
 
 
 #########################################################################
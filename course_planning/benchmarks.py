@@ -0,0 +1,51 @@
+"""
+Benchmarks for the course_planning application: the database loads
+of the auto-scheduler and the worksheet, on synthetic departments of
+increasing size.
+
+These are not run with the tests; run them with::
+
+    ./manage.py test course_planning.benchmarks
+"""
+#######################################################################
+
+import sys
+
+from django.db import transaction
+from django.test import TestCase
+
+from .schedule.utils.benchmark import benchmark_load
+from .schedule.utils.synthetic import create_department
+
+#######################################################################
+
+
+class LoadBenchmarks(TestCase):
+    """
+    Each load uses the same number of queries, whatever the size.
+    """
+
+    sizes = [50, 500, 5000]
+
+    def test_loads(self):
+        query_counts = {}
+        for size in self.sizes:
+            with self.subTest(size=size):
+                with transaction.atomic():
+                    session = create_department(size, seed=0)
+                    state, scores, results = benchmark_load(session)
+                    transaction.set_rollback(True)
+                self.assertEqual(len(state.section_pk), size)
+                for name, result in results.items():
+                    query_counts.setdefault(name, set()).add(result["queries"])
+                    sys.stderr.write(
+                        "\n{:>6} sections: {:<8} {:>3} queries {:>8.3f}s".format(
+                            size, name, result["queries"], result["seconds"]
+                        )
+                    )
+        sys.stderr.write("\n")
+        for name, counts in query_counts.items():
+            self.assertEqual(len(counts), 1, name)
+
+
+#######################################################################
@@ -28,6 +28,53 @@ DEFAULT = {
     "program:description:help_text": """About the program. This will be processed as
 <a href="http://docutils.sourceforge.net/docs/user/rst/quickref.html" target="_blank">
 ReStructuredText</a>.""",
+    # The singular value decomposition used by the "imsvm" auto-scheduler:
+    # "exact" (full) or "randomized" (leading singular triplets only).
+    # Both give the same matches: "randomized" falls back to "exact"
+    # unless a few singular values stand out (then it is much faster
+    # for large sessions; otherwise it is a little slower).
+    "auto_schedule:svd_method": "exact",
+    # The number of auto-schedule jobs that may run at once (per process).
+    "auto_schedule:workers": 1,
+    # The number of independently seeded attempts made by each
+    # auto-schedule run; the best result is kept.
+    "auto_schedule:attempts": 1,
+    # The size of the process pool for those attempts
+    # (None: one per CPU; 1: run them in the calling process).
+    "auto_schedule:processes": None,
+    # Seconds without progress after which a queued or running
+    # auto-schedule job is taken to be abandoned (e.g., by a server
+    # restart), and marked failed so the session can be scheduled again.
+    "auto_schedule:stale_seconds": 3600,
+    # Seconds of local search improvement after each auto-schedule run
+    # (0 to skip it).
+    "auto_schedule:improve_seconds": 0,
+    # The cache (alias) that holds the scheduling worksheet data of each
+    # session; None to always compute it.  With several server processes
+    # this must be a shared cache (e.g., memcached), not local memory.
+    "worksheet_cache:alias": "default",
+    # Seconds to keep each session's worksheet data.
+    "worksheet_cache:timeout": 600,
+    # Seconds between the scheduling worksheet's checks for changes made
+    # by others (0 to never check), when it is not long-polling.
+    "worksheet:poll_seconds": 30,
+    # The most sections the worksheet may change in one bulk edit.
+    "worksheet:bulk_max": 500,
+    # Seconds to keep the worksheet's (cached) instructor and timeslot
+    # option lists.
+    "select2_options:timeout": 3600,
+    # The number of options per page of the worksheet's option search.
+    "select2_options:page_size": 25,
+    # The longest a worksheet's check for changes waits for one (0 to
+    # answer right away, i.e., to poll every "worksheet:poll_seconds").
+    # Each open worksheet then holds a server thread, so use a threaded
+    # server with enough threads.  With several server processes, this
+    # needs the CacheBroker (below): otherwise a change made through
+    # another process only shows up when the wait times out.
+    "worksheet:long_poll_seconds": 0,
+    # Wakes up the waiting checks; "...broker.CacheBroker" (through the
+    # worksheet cache) with several server processes.
+    "worksheet:broker": "course_planning.schedule.utils.broker.LocalBroker",
 }
 
 #########################################################################
@@ -0,0 +1,221 @@
+"""
+Benchmark the auto-scheduler engines.
+"""
+#######################################################################
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from ...models import DraftScheduleSession, TeachingProfile
+from ...schedule.utils import auto, cache
+from ...schedule.utils.benchmark import benchmark_load, benchmark_schedule
+from ...schedule.utils.synthetic import create_department, synthetic_department
+from ...schedule.views import ajax
+
+#######################################################################
+
+COLUMNS = (
+    ("size", "{:>6}", "{:>6}"),
+    ("engine", "{:<12}", "{:<12}"),
+    ("seconds", "{:>9}", "{:>9.3f}"),
+    ("ranking_seconds", "{:>9}", "{:>9.4f}"),
+    ("peak_memory", "{:>10}", "{:>10.1f}"),
+    ("queries", "{:>8}", "{:>8}"),
+    ("score", "{:>12}", "{:>12.1f}"),
+    ("matches", "{:>8}", "{:>8}"),
+    ("unfilled", "{:>8}", "{:>8}"),
+    ("load_violations", "{:>10}", "{:>10}"),
+)
+
+HEADINGS = {
+    "ranking_seconds": "ranking",
+    "peak_memory": "peak MiB",
+    "load_violations": "violations",
+}
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the auto-scheduler engines (wall time, queries, peak memory "
+        "and schedule quality) on synthetic departments of the given sizes, "
+        "or on an existing session.  Synthetic departments are written to "
+        "the database to time their loads, then rolled back: nothing is saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sizes",
+            nargs="*",
+            type=int,
+            default=[50, 500],
+            help="Numbers of sections for the synthetic departments "
+            "(default: 50 500; 5000 is a large department)",
+        )
+        parser.add_argument(
+            "--session",
+            type=int,
+            help="Benchmark the existing session with this pk instead",
+        )
+        parser.add_argument(
+            "--engine",
+            action="append",
+            choices=sorted(auto.ENGINES),
+            help="Only this engine (may be repeated)",
+        )
+        parser.add_argument(
+            "--in-memory",
+            action="store_true",
+            help="Build the synthetic departments in memory only, without "
+            "the database (and so without the load timings)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--save-samples",
+            type=int,
+            default=0,
+            help="Also time this many worksheet saves "
+            "(random instructor changes, rolled back)",
+        )
+        parser.add_argument(
+            "--improve",
+            type=float,
+            default=0,
+            help="Seconds of local search improvement after each engine",
+        )
+
+    def handle(self, *args, **options):
+        runs = []
+        if options["session"] is not None:
+            try:
+                session = DraftScheduleSession.objects.get(pk=options["session"])
+            except DraftScheduleSession.DoesNotExist:
+                raise CommandError("no such session: {}".format(options["session"]))
+            runs.append(self.load(session))
+            if options["save_samples"]:
+                self.benchmark_save(session, options["save_samples"], options["seed"])
+        elif options["in_memory"]:
+            for size in options["sizes"]:
+                state, scores = synthetic_department(size, seed=options["seed"])
+                # no database involved.
+                runs.append((size, state, scores, None))
+        else:
+            for size in options["sizes"]:
+                with transaction.atomic():
+                    session = create_department(size, seed=options["seed"])
+                    runs.append(self.load(session))
+                    if options["save_samples"]:
+                        self.benchmark_save(
+                            session, options["save_samples"], options["seed"]
+                        )
+                    transaction.set_rollback(True)
+
+        self.stdout.write(
+            " ".join(
+                heading.format(HEADINGS.get(key, key)) for key, heading, _ in COLUMNS
+            )
+        )
+        for size, state, scores, queries in runs:
+            results = benchmark_schedule(
+                state,
+                scores,
+                engines=options["engine"],
+                seed=options["seed"],
+                improve_seconds=options["improve"],
+            )
+            for engine, result in results.items():
+                row = dict(
+                    result,
+                    size=size,
+                    engine=engine,
+                    queries=queries,
+                    peak_memory=result["peak_memory"] / 2.0**20,
+                )
+                self.stdout.write(
+                    " ".join(
+                        (
+                            value.format(row[key])
+                            if row[key] is not None
+                            else heading.format("-")
+                        )
+                        for key, heading, value in COLUMNS
+                    )
+                )
+
+    def load(self, session):
+        """
+        Time the loads of ``session``; returns a run: ``(size, state,
+        scores, queries)``, with the queries of the auto-scheduler's
+        loads.
+        """
+        state, scores, results = benchmark_load(session)
+        self.stdout.write(
+            "Loaded {} sections: {}".format(
+                len(state.section_pk),
+                ", ".join(
+                    "{} {} queries in {:.3f}s".format(
+                        name, result["queries"], result["seconds"]
+                    )
+                    for name, result in results.items()
+                ),
+            )
+        )
+        queries = results["state"]["queries"] + results["scores"]["queries"]
+        return (len(state.section_pk), state, scores, queries)
+
+    def benchmark_save(self, session, samples, seed):
+        """
+        Time ``ajax.save_section`` (the worksheet's save) for random
+        changes of instructor; everything is rolled back.
+        """
+        rng = random.Random(seed)
+        factory = RequestFactory()
+        section_list = list(session.draftsection_set.filter(active=True))
+        profile_ids = list(
+            TeachingProfile.objects.filter(active=True).values_list("pk", flat=True)
+        )
+        if not section_list or not profile_ids:
+            return
+        timings = []
+        query_counts = []
+        try:
+            with transaction.atomic():
+                for _ in range(samples):
+                    section = rng.choice(section_list)
+                    request = factory.post(
+                        "/",
+                        {
+                            "section_pk": section.pk,
+                            "instructor_pk": rng.choice(profile_ids),
+                            "timeslot_pk": section.timeslot_id or "",
+                        },
+                    )
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.time()
+                        ajax.save_section(request)
+                        timings.append(time.time() - start)
+                    query_counts.append(len(ctx))
+                transaction.set_rollback(True)
+        finally:
+            # the saves may have cached a snapshot of the rolled back
+            #   sections.
+            cache.discard_snapshot(session.pk)
+        timings.sort()
+        self.stdout.write(
+            "save_section: {} samples, median {:.1f}ms, max {:.1f}ms, "
+            "{:.1f} queries on average".format(
+                samples,
+                1000 * timings[len(timings) // 2],
+                1000 * timings[-1],
+                sum(query_counts) / float(len(query_counts)),
+            )
+        )
+
+
+#######################################################################
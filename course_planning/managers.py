@@ -6,7 +6,13 @@ from __future__ import print_function, unicode_literals
 
 from django.db import models
 
-from .querysets import CourseInfoQuerySet, CourseProgramInfoQuerySet, ProgramQuerySet
+from .querysets import (
+    CourseInfoQuerySet,
+    CourseProgramInfoQuerySet,
+    DraftSectionQuerySet,
+    ProgramQuerySet,
+    TeachingProfileQuerySet,
+)
 
 #######################
 #######################################################################
@@ -72,3 +78,11 @@ CourseProgramInfoManager = CourseProgramInfoManagerOnly.from_queryset(
 )
 
 #######################################################################
+
+TeachingProfileManager = TeachingProfileQuerySet.as_manager
+
+#######################################################################
+
+DraftSectionManager = DraftSectionQuerySet.as_manager
+
+#######################################################################
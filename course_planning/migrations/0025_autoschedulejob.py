@@ -0,0 +1,68 @@
+# Generated by Django 2.2.1 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("course_planning", "0024_auto_20190502_0921")]
+
+    operations = [
+        migrations.CreateModel(
+            name="AutoScheduleJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("active", models.BooleanField(default=True)),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="creation time"
+                    ),
+                ),
+                (
+                    "modified",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="last modification time"
+                    ),
+                ),
+                ("engine", models.CharField(default="imsvm", max_length=32)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("q", "Queued"),
+                            ("r", "Running"),
+                            ("d", "Done"),
+                            ("f", "Failed"),
+                        ],
+                        default="q",
+                        max_length=1,
+                    ),
+                ),
+                ("iterations", models.PositiveIntegerField(default=0)),
+                ("matches", models.PositiveIntegerField(default=0)),
+                (
+                    "elapsed",
+                    models.FloatField(default=0, help_text="Elapsed time in seconds"),
+                ),
+                ("message", models.TextField(blank=True)),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="course_planning.DraftScheduleSession",
+                    ),
+                ),
+            ],
+            options={"ordering": ("-created",)},
+        )
+    ]
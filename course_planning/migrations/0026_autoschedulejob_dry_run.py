@@ -0,0 +1,25 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("course_planning", "0025_autoschedulejob")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoschedulejob",
+            name="dry_run",
+            field=models.BooleanField(
+                default=False, help_text="Only propose changes; do not save them"
+            ),
+        ),
+        migrations.AddField(
+            model_name="autoschedulejob",
+            name="result",
+            field=models.TextField(
+                blank=True, help_text="The proposed changes of a dry run (JSON)"
+            ),
+        ),
+    ]
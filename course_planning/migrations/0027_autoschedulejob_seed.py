@@ -0,0 +1,32 @@
+# Generated by Django 2.2.1 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("course_planning", "0026_autoschedulejob_dry_run")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoschedulejob",
+            name="attempts",
+            field=models.PositiveIntegerField(
+                default=1, help_text="The number of seeded attempts made"
+            ),
+        ),
+        migrations.AddField(
+            model_name="autoschedulejob",
+            name="seed",
+            field=models.BigIntegerField(
+                blank=True, help_text="The seed of the attempt that was kept", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="autoschedulejob",
+            name="attempt_log",
+            field=models.TextField(
+                blank=True, help_text="The evaluation of each attempt (JSON)"
+            ),
+        ),
+    ]
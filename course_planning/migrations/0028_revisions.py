@@ -0,0 +1,29 @@
+# Generated by Django 2.2.1 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("course_planning", "0027_autoschedulejob_seed")]
+
+    operations = [
+        migrations.AddField(
+            model_name="draftschedulesession",
+            name="revision",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Incremented for every change to its sections",
+            ),
+        ),
+        migrations.AddField(
+            model_name="draftsection",
+            name="revision",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="The session revision of its last change",
+            ),
+        ),
+    ]
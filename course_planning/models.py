@@ -4,6 +4,9 @@ Models for the course_planning application.
 #######################
 from __future__ import print_function, unicode_literals
 
+import json
+from collections import Counter, defaultdict
+
 from autoslug import AutoSlugField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
@@ -11,8 +14,14 @@ from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 
 from . import conf
-from .managers import CourseInfoManager, CourseProgramInfoManager, ProgramManager
-from .utils import has_adjacent_timeslots
+from .managers import (
+    CourseInfoManager,
+    CourseProgramInfoManager,
+    DraftSectionManager,
+    ProgramManager,
+    TeachingProfileManager,
+)
+from .utils.timeslots import TimeslotIndex
 
 #######################################################################
 #######################################################################
@@ -188,6 +197,8 @@ class TeachingProfile(CoursePlanningBaseModel):
     )
     last_reviewed = models.DateTimeField(null=True, blank=True)
 
+    objects = TeachingProfileManager()
+
     def __str__(self):
         return "{}".format(self.person)
 
@@ -217,6 +228,7 @@ class TeachingProfile(CoursePlanningBaseModel):
     def get_score(self, course_id, timeslot_id, jitter=0):
         """
         See also .schedule.utils.auto:_build_ranking_matrix(...)
+        and .schedule.utils.scores:combine_scores(...)
         The score calculations should always align.
         """
         try:
@@ -232,20 +244,121 @@ class TeachingProfile(CoursePlanningBaseModel):
         score = c_score * (t_score * c_score + jitter)
         return score
 
-    def get_remaining_loads(self, session):
+    def session_summary(self, session, timeslot_index=None):
         """
-        Return the **remaining** loads as a pair:
-        ``total_remaining, semester_remaining``
+        The instructor's loads and timeslot checks for a session, from
+        one query for their sections (and one for the semester
+        preferences, unless prefetched):
+
+        ``remaining_load``, ``remaining_term_loads``
+            as for ``get_remaining_loads()``;
+        ``semesters``
+            by semester code (only those taught), a dict of
+            ``timeslot_ids``, ``timeslot_conflicts``, ``back_to_back``
+            and ``different_days``, as for the methods of those names.
+
+        ``timeslot_index`` is as for ``has_back_to_back()``; it is only
+        loaded when a preference needs it.
         """
-        session_qs = self.draftsection_set.filter(active=True, session=session)
-        total_load = self.agreed_load - session_qs.count()
-        semesterprefs_qs = self.semesterteachingpreference_set.filter(active=True)
+        section_rows = self.draftsection_set.filter(
+            active=True, session=session
+        ).values_list("semester", "timeslot_id")
+        counts = Counter()
+        timeslot_ids = defaultdict(list)
+        for semester, timeslot_id in section_rows:
+            counts[semester] += 1
+            if timeslot_id is not None:
+                timeslot_ids[semester].append(timeslot_id)
+
+        # by hand, so a prefetched semesterteachingpreference_set is used.
+        term_prefs = sorted(
+            [p for p in self.semesterteachingpreference_set.all() if p.active],
+            key=lambda p: p.semester,
+            reverse=True,
+        )
         term_data = {
-            v["semester"]: v["preferred_load"]
-            for v in semesterprefs_qs.values("semester", "preferred_load")
+            p.semester: p.preferred_load - counts[p.semester] for p in term_prefs
         }
-        for code in term_data:
-            term_data[code] -= session_qs.filter(semester=code).count()
+        code_display = dict(SemesterTeachingPreference.SEMESTER_CHOICES)
+        term_data["display"] = " / ".join(
+            [
+                "{}:{:.1f}".format(code_display[p.semester][0], term_data[p.semester])
+                for p in term_prefs
+            ]
+        )
+
+        if timeslot_index is None and (
+            self.preference_no_back_to_back or self.preference_same_day
+        ):
+            timeslot_index = TimeslotIndex.load()
+        # Online does not conflict; only looked up when there are repeats.
+        online = [timeslot_index.online_pk] if timeslot_index is not None else None
+        semesters = {}
+        for semester in counts:
+            id_list = timeslot_ids[semester]
+            repeated = [t for t, n in Counter(id_list).items() if n > 1]
+            if repeated and online is None:
+                from classes.models import Timeslot
+
+                online = [Timeslot.objects.Online().pk]
+            semesters[semester] = {
+                "timeslot_ids": id_list,
+                "timeslot_conflicts": sorted(t for t in repeated if t not in online),
+                "back_to_back": bool(
+                    self.preference_no_back_to_back
+                    and timeslot_index.has_adjacent(id_list)
+                ),
+                "different_days": bool(
+                    self.preference_same_day
+                    and timeslot_index.has_different_days(id_list)
+                ),
+            }
+
+        return {
+            "remaining_load": self.agreed_load - sum(counts.values()),
+            "remaining_term_loads": term_data,
+            "semesters": semesters,
+        }
+
+    def _semester_summary(self, session, semester_code, timeslot_index, summary):
+        if summary is None:
+            summary = self.session_summary(session, timeslot_index=timeslot_index)
+        return summary["semesters"].get(
+            semester_code,
+            {
+                "timeslot_ids": [],
+                "timeslot_conflicts": [],
+                "back_to_back": False,
+                "different_days": False,
+            },
+        )
+
+    def get_remaining_loads(self, session, summary=None):
+        """
+        Return the **remaining** loads as a pair:
+        ``total_remaining, semester_remaining``
+        ``summary`` is from ``session_summary()``; pass one in to avoid
+        recomputing it when checking several things.
+        """
+        if summary is None:
+            summary = self.session_summary(session)
+        return summary["remaining_load"], summary["remaining_term_loads"]
+
+    def get_annotated_remaining_loads(self):
+        """
+        As for ``get_remaining_loads()``, for a profile from
+        ``TeachingProfile.objects.with_session_loads(session)``;
+        no queries are made.
+        """
+        total_load = self.agreed_load - self.session_load
+        term_data = {}
+        # the same order as the semesterteachingpreference_set.
+        for code, label in sorted(
+            SemesterTeachingPreference.SEMESTER_CHOICES, reverse=True
+        ):
+            preferred_load = getattr(self, "preferred_load_" + code)
+            if preferred_load is not None:
+                term_data[code] = preferred_load - getattr(self, "session_load_" + code)
         code_display = dict(SemesterTeachingPreference.SEMESTER_CHOICES)
         display = " / ".join(
             ["{}:{:.1f}".format(code_display[c][0], term_data[c]) for c in term_data]
@@ -254,88 +367,42 @@ class TeachingProfile(CoursePlanningBaseModel):
 
         return total_load, term_data
 
-    def has_back_to_back(self, session, semester_code):
+    def has_back_to_back(
+        self, session, semester_code, timeslot_index=None, summary=None
+    ):
         """
         Return ``True`` only when the preference is NOT for back to back
         teaching.
+        ``timeslot_index`` is a ``TimeslotIndex``; pass one in to avoid
+        reloading it when checking several things.
+        ``summary`` is as for ``get_remaining_loads()``.
         """
-        result = False
-        if self.preference_no_back_to_back:
-            from classes.models import Timeslot
-
-            timeslot_id_list = (
-                self.draftsection_set.filter(
-                    active=True, session=session, semester=semester_code
-                )
-                .exclude(timeslot__isnull=True)
-                .values_list("timeslot_id", flat=True)
-            )
-            online = Timeslot.objects.Online()
-            timeslot_qs = Timeslot.objects.filter(pk__in=timeslot_id_list).exclude(
-                pk=online.pk
-            )
-            if timeslot_qs.exists():
-                result = has_adjacent_timeslots(timeslot_qs)
-        return result
-
-    def has_different_days(self, session, semester_code):
+        return self._semester_summary(session, semester_code, timeslot_index, summary)[
+            "back_to_back"
+        ]
+
+    def has_different_days(
+        self, session, semester_code, timeslot_index=None, summary=None
+    ):
         """
         Return ``True`` only when the preference is for same day teaching.
+        ``timeslot_index`` and ``summary`` are as for ``has_back_to_back()``.
         """
-        result = False
-        if self.preference_same_day:
-            from classes.models import Timeslot
-
-            timeslot_id_list = (
-                self.draftsection_set.filter(
-                    active=True, session=session, semester=semester_code
-                )
-                .exclude(timeslot__isnull=True)
-                .values_list("timeslot_id", flat=True)
-            )
-            online = Timeslot.objects.Online()
-            timeslot_qs = Timeslot.objects.filter(pk__in=timeslot_id_list).exclude(
-                pk=online.pk
-            )
-            if timeslot_qs.exists():
-                ref_day = timeslot_qs[0].day
-                for timeslot in timeslot_qs:
-                    if timeslot.day != ref_day:
-                        if (
-                            timeslot.day in ref_day
-                        ):  # timeslot is substring of reference
-                            pass
-                        elif (
-                            ref_day in timeslot.day
-                        ):  # reference is substring of timeslot
-                            ref_day = timeslot.day
-                        else:  # different!
-                            result = True
-                            break
-        return result
-
-    def get_timeslot_conflicts(self, session, semester_code):
+        return self._semester_summary(session, semester_code, timeslot_index, summary)[
+            "different_days"
+        ]
+
+    def get_timeslot_conflicts(
+        self, session, semester_code, timeslot_index=None, summary=None
+    ):
         """
         Returns a list of any duplicate timeslot id's that have been assigned.
         Note: Online does not count.
+        ``timeslot_index`` and ``summary`` are as for ``has_back_to_back()``.
         """
-        from classes.models import Timeslot
-
-        timeslot_id_list = list(
-            self.draftsection_set.filter(
-                active=True, session=session, semester=semester_code
-            )
-            .exclude(timeslot__isnull=True)
-            .values_list("timeslot_id", flat=True)
-        )
-        timeslot_id_set = set(timeslot_id_list)
-        online = Timeslot.objects.Online()
-        result = []
-        if len(timeslot_id_set) != len(timeslot_id_list):
-            for tid in timeslot_id_set:
-                if tid != online.pk and timeslot_id_list.count(tid) > 1:
-                    result.append(tid)
-        return result
+        return self._semester_summary(session, semester_code, timeslot_index, summary)[
+            "timeslot_conflicts"
+        ]
 
 
 #######################################################################
@@ -482,10 +549,49 @@ class DraftScheduleSession(CoursePlanningBaseModel):
     start_date = models.DateField()
     end_date = models.DateField()
     initialized = models.BooleanField(default=False)
+    revision = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented for every change to its sections",
+    )
 
     def __str__(self):
         return self.verbose_name
 
+    def save(self, *args, **kwargs):
+        # ``revision`` is only ever changed by ``next_revision()``, so
+        #   saving a stale copy never sets it back.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != "revision"
+            ]
+        super().save(*args, **kwargs)
+
+    def next_revision(self):
+        """
+        Increment ``revision``, and return the new value; sections
+        changed with this value are then reported as changed since
+        any earlier revision.
+        Call this inside the transaction that changes the sections:
+        the session stays locked until it commits, so revisions are
+        committed in order.
+        """
+        qs = DraftScheduleSession.objects.filter(pk=self.pk)
+        qs.update(revision=models.F("revision") + 1)
+        self.revision = qs.values_list("revision", flat=True).get()
+        return self.revision
+
+    def run_code(self, semester):
+        """
+        The ``RUN_CHOICES`` code (as for ``CourseInfo.runs``) of the
+        year in which the given semester of this session falls.
+        """
+        # as for ``DraftSection.real_section()``.
+        year = self.start_date.year if semester != "1" else self.end_date.year
+        return "e" if year % 2 == 0 else "o"
+
     def admin_change_link(self):
         return reverse(
             "admin:{}_{}_change".format(self._meta.app_label, self._meta.model_name),
@@ -563,6 +669,13 @@ class DraftSection(CoursePlanningBaseModel):
     instructor = models.ForeignKey(
         TeachingProfile, on_delete=models.CASCADE, null=True, blank=True
     )
+    revision = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="The session revision of its last change",
+    )
+
+    objects = DraftSectionManager()
 
     class Meta:
         unique_together = (("course", "verbose_name", "session", "semester"),)
@@ -594,6 +707,73 @@ class DraftSection(CoursePlanningBaseModel):
             return qs.first()
 
 
+#######################################################################
+
+
+@python_2_unicode_compatible
+class AutoScheduleJob(CoursePlanningBaseModel):
+    """
+    A (background) run of the auto-scheduler for a session.
+    """
+
+    STATUS_CHOICES = (
+        ("q", "Queued"),
+        ("r", "Running"),
+        ("d", "Done"),
+        ("f", "Failed"),
+    )
+
+    session = models.ForeignKey(DraftScheduleSession, on_delete=models.CASCADE)
+    engine = models.CharField(max_length=32, default="imsvm")
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="q")
+    iterations = models.PositiveIntegerField(default=0)
+    matches = models.PositiveIntegerField(default=0)
+    elapsed = models.FloatField(default=0, help_text="Elapsed time in seconds")
+    message = models.TextField(blank=True)
+    dry_run = models.BooleanField(
+        default=False, help_text="Only propose changes; do not save them"
+    )
+    result = models.TextField(
+        blank=True, help_text="The proposed changes of a dry run (JSON)"
+    )
+    attempts = models.PositiveIntegerField(
+        default=1, help_text="The number of seeded attempts made"
+    )
+    seed = models.BigIntegerField(
+        blank=True, null=True, help_text="The seed of the attempt that was kept"
+    )
+    attempt_log = models.TextField(
+        blank=True, help_text="The evaluation of each attempt (JSON)"
+    )
+
+    class Meta:
+        ordering = ("-created",)
+
+    def __str__(self):
+        return "{} ({})".format(self.session, self.get_status_display())
+
+    def is_finished(self):
+        return self.status in ("d", "f")
+
+    def get_changes(self):
+        """
+        The proposed changes of a (finished) dry run;
+        see ``schedule.utils.auto:preview``.
+        """
+        if not self.result:
+            return []
+        return json.loads(self.result)
+
+    def get_attempts(self):
+        """
+        The evaluation (and seed) of each attempt, in seed order;
+        see ``ScheduleState.evaluate``.
+        """
+        if not self.attempt_log:
+            return []
+        return json.loads(self.attempt_log)
+
+
 #######################################################################
 #######################################################################
 #######################################################################
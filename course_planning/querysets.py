@@ -114,3 +114,63 @@ class CourseProgramInfoQuerySet(BaseCustomQuerySet):
 
 
 #######################################################################
+
+
+class TeachingProfileQuerySet(BaseCustomQuerySet):
+    def with_session_loads(self, session):
+        """
+        Annotate each profile with its teaching in ``session``, in a
+        single grouped query:
+        ``session_load`` (active sections), and for each semester code
+        ``session_load_<code>`` and ``preferred_load_<code>`` (the
+        active semester preference, or ``None``).
+        """
+        from .models import SemesterTeachingPreference
+
+        in_session = models.Q(draftsection__active=True, draftsection__session=session)
+        annotations = {
+            "session_load": models.Count(
+                "draftsection", filter=in_session, distinct=True
+            )
+        }
+        for code, label in SemesterTeachingPreference.SEMESTER_CHOICES:
+            annotations["session_load_" + code] = models.Count(
+                "draftsection",
+                filter=in_session & models.Q(draftsection__semester=code),
+                distinct=True,
+            )
+            annotations["preferred_load_" + code] = models.Max(
+                "semesterteachingpreference__preferred_load",
+                filter=models.Q(
+                    semesterteachingpreference__active=True,
+                    semesterteachingpreference__semester=code,
+                ),
+            )
+        return self.annotate(**annotations)
+
+
+#######################################################################
+
+
+class DraftSectionQuerySet(BaseCustomQuerySet):
+    def worksheet(self):
+        """
+        Rows ready for the scheduling worksheet: with their course
+        (and department), instructor (and person) and timeslot, and
+        annotated with ``course_has_preferences`` (whether anyone has
+        a teaching preference for the course).
+        """
+        from .models import CourseTeachingPreference
+
+        return self.select_related(
+            "course", "course__department", "instructor__person", "timeslot"
+        ).annotate(
+            course_has_preferences=models.Exists(
+                CourseTeachingPreference.objects.filter(
+                    course=models.OuterRef("course")
+                )
+            )
+        )
+
+
+#######################################################################
@@ -8,14 +8,57 @@ from __future__ import print_function, unicode_literals
 from classes.models import Timeslot
 from django import forms
 from django.forms.models import inlineformset_factory
+from django.urls import reverse_lazy
 from django_select2.forms import ModelSelect2Widget
 
 from ..models import DraftScheduleSession, DraftSection, TeachingProfile
+from .utils import options
 
 ###############################################################
 
 
-class TeachingProfileWidget(ModelSelect2Widget):
+class CachedOptionsMixin(object):
+    """
+    Search the ``option_list`` index (see ``utils.options``) instead of
+    the queryset, and label the selected options from it as well.
+    """
+
+    option_list = None
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault(
+            "data_url",
+            reverse_lazy(
+                "admin:draftschedulesession_ajax_search_options",
+                kwargs={"name": self.option_list},
+            ),
+        )
+        super().__init__(*args, **kwargs)
+
+    def optgroups(self, name, value, attrs=None):
+        index = options.get_index(self.option_list)
+        selected = []
+        for v in value:
+            if v in (None, ""):
+                continue
+            label = index.label(int(v)) if "{}".format(v).isdigit() else None
+            if label is None:
+                # e.g., an inactive instructor.
+                return super().optgroups(name, value, attrs=attrs)
+            selected.append((v, label))
+        default = (None, [], 0)
+        if not self.is_required and not self.allow_multiple_selected:
+            default[1].append(self.create_option(name, "", "", False, 0))
+        for v, label in selected:
+            default[1].append(self.create_option(name, v, label, True, len(default[1])))
+        return [default]
+
+
+###############################################################
+
+
+class TeachingProfileWidget(CachedOptionsMixin, ModelSelect2Widget):
+    option_list = "instructor"
     model = TeachingProfile
     queryset = TeachingProfile.objects.filter(active=True).order_by("person")
     search_fields = [
@@ -31,7 +74,8 @@ class TeachingProfileWidget(ModelSelect2Widget):
 ###############################################################
 
 
-class TimeslotWidget(ModelSelect2Widget):
+class TimeslotWidget(CachedOptionsMixin, ModelSelect2Widget):
+    option_list = "timeslot"
     model = Timeslot
     queryset = Timeslot.objects.filter(active=True, scheduled=True)
     # NB: using __contains lookup on a date/time makes the lookup "fuzzy"
@@ -58,15 +102,41 @@ class SectionSchedulingForm(forms.ModelForm):
             ),
         }
 
+    # the revision of the section the submitted values are based on;
+    #   kept up to date by the worksheet's scripts.
+    loaded_revision = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
     def __init__(self, *args, **kwargs):
         result = super().__init__(*args, **kwargs)
+        # course choices are labelled with their department.
+        course_field = self.fields["course"]
+        course_field.queryset = course_field.queryset.select_related("department")
         instance = getattr(self, "instance", None)
         if instance and instance.id:
             self.fields["course"].widget.attrs["readonly"] = True
             self.fields["verbose_name"].widget.attrs["readonly"] = True
             self.fields["semester"].widget.attrs["readonly"] = True
+            self.fields["loaded_revision"].initial = instance.revision
         return result
 
+    def has_changed(self):
+        return bool(set(self.changed_data) - {"loaded_revision"})
+
+    def check_revision(self, revision):
+        """
+        Is this (changed) form based on the given current revision of
+        its section?  If not, the form gets an error.
+        """
+        loaded = self.cleaned_data.get("loaded_revision", None)
+        if loaded is None or loaded == revision:
+            return True
+        self.add_error(
+            "instructor",
+            "This section has been changed by someone else since the "
+            "worksheet was loaded; reload it to see their changes.",
+        )
+        return False
+
     def _scrub_input(self, field):
         instance = getattr(self, "instance", None)
         if instance and instance.id:
@@ -0,0 +1,179 @@
+"""
+Capacity aware optimal assignment of instructors to sections.
+
+This is an alternative to the iterative maximal singular value matching
+in ``imsvm``: the whole instructor -> section assignment for a semester
+is solved at once as a (rectangular) linear assignment problem,
+with each instructor expanded into as many "slots" as their remaining
+load allows.
+"""
+################################################################
+
+import numpy as np
+
+################################################################
+
+
+class AssignmentError(Exception):
+    pass
+
+
+################################################################
+
+
+def linear_sum_assignment(cost):
+    """
+    Solve the rectangular linear assignment problem, minimizing the
+    total ``cost``.  Returns the pair ``(row_indices, col_indices)``;
+    every row (or every column, whichever is fewer) is assigned.
+
+    This is the shortest augmenting path variant of the Hungarian
+    algorithm, O(n^2 m), with the inner loop vectorized over columns.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.ndim != 2:
+        raise AssignmentError("cost must be a matrix")
+    if not np.all(np.isfinite(cost)):
+        raise AssignmentError("cost must be finite")
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # 1-based bookkeeping; index 0 is the "virtual" column.
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            update = free & (cur < minv[1:])
+            minv[1:][update] = cur[update]
+            way[1:][update] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(masked.argmin()) + 1
+            delta = masked[j1 - 1]
+            used_idx = np.nonzero(used)[0]
+            u[p[used_idx]] += delta
+            v[used_idx] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    cols = np.nonzero(p[1:])[0]
+    rows = p[cols + 1] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+################################################################
+
+
+def expand_capacity(capacity):
+    """
+    Map a vector of integer capacities to a slot -> row index vector.
+    """
+    capacity = np.maximum(np.asarray(capacity, dtype=int), 0)
+    return np.repeat(np.arange(len(capacity)), capacity)
+
+
+################################################################
+
+
+def capacity_assignment(
+    rankings, capacity, rank_threshold=None, forbidden=None, conflict_groups=None
+):
+    """
+    Given a matrix ``rankings`` of people -> section rankings and a
+    vector of integer ``capacity`` (the number of sections each person
+    may still take), return a list of (i,j) pairs maximizing the total
+    ranking.  Each section is matched at most once.
+
+    Pairs ranked below ``rank_threshold`` are never matched.
+    ``forbidden`` is an optional boolean matrix (same shape as
+    ``rankings``) of pairs that may not be matched.
+    ``conflict_groups`` is an optional vector giving a group label for
+    each section (e.g., its timeslot); no person will be matched to
+    two sections with the same label.  ``None`` labels never conflict.
+    Conflicts are resolved by re-solving with the offending pairs
+    forbidden, keeping the best section of each conflicting group.
+    """
+    rankings = np.array(rankings, dtype=float)
+    if rankings.ndim != 2 or 0 in rankings.shape:
+        return []
+    if forbidden is None:
+        forbidden = np.zeros(rankings.shape, dtype=bool)
+    else:
+        forbidden = np.array(forbidden, dtype=bool)
+    if rank_threshold is None:
+        rank_threshold = 0
+    slot_rows = expand_capacity(capacity)
+    if len(slot_rows) == 0:
+        return []
+    while True:
+        value = np.where(forbidden, 0, rankings)
+        value[value < rank_threshold] = 0
+        value[value < 0] = 0
+        # Maximizing value == minimizing -value; a zero-valued match
+        # is equivalent to no match at all.
+        rows, cols = linear_sum_assignment(-value[slot_rows])
+        results = [
+            (int(slot_rows[r]), int(c))
+            for r, c in zip(rows, cols)
+            if value[slot_rows[r], c] > 0
+        ]
+        if conflict_groups is None:
+            return sorted(results)
+        clashes = _find_conflicts(results, conflict_groups, rankings)
+        if not clashes:
+            return sorted(results)
+        for i, j in clashes:
+            forbidden[i, j] = True
+
+
+def _find_conflicts(results, conflict_groups, rankings):
+    """
+    Return the (i,j) pairs that must be dropped so that no person
+    has two sections in the same conflict group.
+    """
+    seen = {}
+    for i, j in results:
+        label = conflict_groups[j]
+        if label is None:
+            continue
+        seen.setdefault((i, label), []).append(j)
+    clashes = []
+    for (i, label), j_list in seen.items():
+        if len(j_list) > 1:
+            j_list.sort(key=lambda j: rankings[i, j], reverse=True)
+            clashes += [(i, j) for j in j_list[1:]]
+    return clashes
+
+
+################################################################
+
+
+def total_score(rankings, matches):
+    """
+    The sum of the rankings of the given (i,j) pairs.
+    """
+    rankings = np.asarray(rankings, dtype=float)
+    return float(sum(rankings[i, j] for i, j in matches))
+
+
+################################################################
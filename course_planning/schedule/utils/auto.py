@@ -3,206 +3,458 @@ Automated scheduling utilities.
 """
 ################################################################
 
-from random import random
+import copy
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
 
-from classes.models import Timeslot
-from django.db.models import Count
+import django
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
 
-from ...models import (
-    CourseTeachingPreference,
-    SemesterTeachingPreference,
-    TeachingProfile,
-    TimeslotTeachingPreference,
-)
+from ... import conf
+from ...models import DraftScheduleSession, DraftSection
+from . import cache
+from .assign import capacity_assignment
+from .improve import improve
 from .imsvm import ImsvmRefuse, imsvm
+from .scores import PreferenceScores, combine_scores
+from .state import NONE, SEMESTER_LIST, ScheduleState
 
 ################################################################
 
-SEMESTER_LIST = [e[0] for e in SemesterTeachingPreference.SEMESTER_CHOICES]
 
-################################################################
-
-
-def main(session):
+def main(session, engine="imsvm", progress=None, **options):
     """
     Do a schedule.
     - Only attempt to slot instructors into place if the current
         instructor is None (unset)
-    -
+    - ``engine`` selects the matching algorithm; one of ``ENGINES``.
+    - ``progress`` is an optional callable; it is called as
+        ``progress(iterations, matches)`` as the engine proceeds.
+    - Everything is done on an in-memory ``ScheduleState``, which is
+        written back at the end with a single bulk update.
+    - See ``schedule()`` for the other ``options``.
+    Returns the final ``ScheduleState``.
+    """
+    state, scores = schedule(session, engine, progress, **options)
+    flush(session, state)
+    return state
+
+
+################################################################
+
+
+def flush(session, state):
+    """
+    Write the changes in ``state`` back (see ``ScheduleState.flush()``),
+    and update the worksheet cache.
+    Returns the pks of the sections skipped as edited meanwhile.
+    """
+    changed = state.section_pk[state.changed()].tolist()
+    state.flush(session)
+    written = sorted(set(changed) - set(state.skipped))
+    if written:
+        cache.sections_changed(session.pk, written)
+    return state.skipped
+
+
+################################################################
+
+
+def preview(session, engine="imsvm", progress=None, **options):
+    """
+    A dry run of ``main()``: nothing is written to the database.
+    Returns the proposed changes; see ``ScheduleState.diff()``.
+    """
+    state, scores = schedule(session, engine, progress, **options)
+    return state.diff(scores)
+
+
+################################################################
+
+
+def apply_changes(session, changes):
+    """
+    Write (some of) the changes from a ``preview()`` with a single
+    bulk update.
+    Changes are skipped for any section whose instructor is no longer
+    the ``old_instructor_id`` of the change (i.e., edited since).
+    Returns the list of changes that were applied.
+    """
+    changes = list(changes)
+    with transaction.atomic():
+        # lock the session (first, as everything that changes its
+        #   sections does), and the sections, so nobody edits them
+        #   between the check and the update.
+        DraftScheduleSession.objects.select_for_update().get(pk=session.pk)
+        current = dict(
+            session.draftsection_set.select_for_update()
+            .filter(active=True, pk__in=[c["section_id"] for c in changes])
+            .values_list("pk", "instructor_id")
+        )
+        changes = [
+            c
+            for c in changes
+            if c["section_id"] in current
+            and current[c["section_id"]] == c["old_instructor_id"]
+        ]
+        if not changes:
+            return changes
+        now = timezone.now()
+        revision = session.next_revision()
+        objs = [
+            DraftSection(
+                pk=c["section_id"],
+                instructor_id=c["new_instructor_id"],
+                modified=now,
+                revision=revision,
+            )
+            for c in changes
+        ]
+        DraftSection.objects.bulk_update(objs, ["instructor", "modified", "revision"])
+        cache.sections_changed(session.pk, [c["section_id"] for c in changes])
+    return changes
+
+
+################################################################
+
+
+def schedule(
+    session,
+    engine="imsvm",
+    progress=None,
+    attempts=None,
+    seed=None,
+    processes=None,
+    improve_seconds=None,
+    **options
+):
+    """
+    Run the scheduler without writing anything back.
+    Returns the ``(state, scores)`` pair; see ``ScheduleState`` and
+    ``PreferenceScores``.
+
+    - ``attempts`` independent runs are made (the default is the
+        ``auto_schedule:attempts`` setting), seeded with ``seed``,
+        ``seed + 1``, ...; the best is kept (see ``_quality()``).
+        Rerunning with one attempt and the recorded ``state.seed``
+        reproduces the result for the same data.
+    - ``processes`` is the size of the process pool used for the
+        attempts; the default is the ``auto_schedule:processes``
+        setting.  Use ``1`` to run them in this process.
+    - The kept result is then improved by local search for up to
+        ``improve_seconds`` (the default is the
+        ``auto_schedule:improve_seconds`` setting); see
+        ``improve.improve()``.  Being time limited, this part is not
+        exactly reproducible.
+    - ``progress`` is called after each engine iteration for a
+        single attempt; otherwise after each attempt,
+        with the best number of matches so far.
+    - Any other keyword ``options`` are passed to the engine.
+    """
+    if engine not in ENGINES:
+        raise ValueError("unknown scheduling engine {!r}".format(engine))
+    if attempts is None:
+        attempts = conf.get("auto_schedule:attempts")
+    if processes is None:
+        processes = conf.get("auto_schedule:processes")
+    if seed is None:
+        seed = random.randrange(2**31)
+    if progress is None:
+        progress = _no_progress
+    scores = PreferenceScores.load()
+    state = ScheduleState.load(session)
+    # everything the attempts look up must already be in memory.
+    scores.extend_profiles(state.profile_pk.tolist())
+    scores.extend_profiles(
+        state.section_instructor[state.section_instructor != NONE].tolist()
+    )
+
+    seeds = [seed + i for i in range(max(attempts, 1))]
+    if len(seeds) == 1:
+        results = [_attempt(state, scores, engine, seeds[0], options, progress)]
+    else:
+        results = _run_attempts(
+            state, scores, engine, seeds, options, progress, processes
+        )
+
+    best = min(results, key=lambda r: _quality(r[2]))
+    state.section_instructor = best[1]
+    state._recount_loads()
+    state.seed = best[0]
+    state.attempts = [dict(evaluation, seed=s) for s, _, evaluation in results]
+    improve(
+        state,
+        scores,
+        seconds=improve_seconds,
+        random_state=np.random.RandomState(state.seed),
+    )
+    return state, scores
+
+
+def _no_progress(iterations, matches):
+    pass
+
+
+def _quality(evaluation):
+    """
+    Sort key for attempts (smallest is best): the fewest load
+    violations, then the fewest unfilled sections, then the
+    highest total preference score.
+    """
+    return (
+        evaluation["load_violations"],
+        evaluation["unfilled"],
+        -evaluation["score"],
+    )
+
+
+def _attempt(state, scores, engine, seed, options, progress=None):
+    """
+    One seeded run of ``engine`` on a copy of ``state``.
+    Returns the ``(seed, section_instructor, evaluation)`` triple.
+    This is the unit of work sent to the process pool, so it must not
+    touch the database.
+    """
+    if progress is None:
+        progress = _no_progress
+    state = copy.deepcopy(state)
+    ENGINES[engine](
+        state,
+        scores,
+        progress=progress,
+        random_state=np.random.RandomState(seed),
+        **options
+    )
+    return seed, state.section_instructor, state.evaluate(scores)
+
+
+def _run_attempts(state, scores, engine, seeds, options, progress, processes):
+    """
+    Run an attempt for each of the ``seeds``, in a pool of
+    ``processes`` (or in this process, when that is ``1``).
+    The pool's processes are spawned, so they need the
+    ``DJANGO_SETTINGS_MODULE`` environment variable.
+    """
+    results = []
+
+    def _done(result):
+        results.append(result)
+        best = min(results, key=lambda r: _quality(r[2]))
+        progress(len(results), int((best[1] != state.original_instructor).sum()))
+
+    if processes == 1:
+        for seed in seeds:
+            _done(_attempt(state, scores, engine, seed, options))
+    else:
+        # not forked: this may be a thread of the web server process,
+        #   holding locks and database connections a fork would copy.
+        #   The spawned workers start afresh, with no connection, and
+        #   set up Django before unpickling anything of this app.
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_context("spawn"),
+            initializer=django.setup,
+        ) as executor:
+            futures = [
+                executor.submit(_attempt, state, scores, engine, seed, options)
+                for seed in seeds
+            ]
+            for future in as_completed(futures):
+                _done(future.result())
+    # keep the seed order, so ties go to the earliest seed.
+    results.sort(key=lambda r: r[0])
+    return results
+
+
+################################################################
+
+
+def _run_imsvm(state, scores, progress, svd_method=None, random_state=None):
+    """
+    Repeated rounds of iterative maximal singular value matching,
+    until nothing more can be matched.
+    ``svd_method`` is passed to ``imsvm``; the default is the
+    ``auto_schedule:svd_method`` setting.
+    ``random_state`` is as for ``_build_ranking_matrix()``.
     """
-    instructor_data = {}
+    if svd_method is None:
+        svd_method = conf.get("auto_schedule:svd_method")
     imsvm_refusal = {s: False for s in SEMESTER_LIST}
+    # each semester's rounds have similar ranking matrices.
+    svd_states = {s: {} for s in SEMESTER_LIST}
+    iterations = 0
+    match_count = 0
     while True:
-        section_qs, instructor_data = _remove_scheduled(session)
-        if not section_qs.exists():
+        if state.unassigned().size == 0:
             break
-        if not instructor_data:
+        if state.available_profiles().size == 0:
             break
         if all(imsvm_refusal.values()):
             break
         for semester in SEMESTER_LIST:
-            semester_section_qs = section_qs.filter(semester=semester)
-            semester_section_qs = _remove_timeslot_conflicts(semester_section_qs)
-            # TODO: do semester_section_qs in program order groups.
-            ranking_matrix, person_list, section_list = _build_ranking_matrix(
-                semester, semester_section_qs, instructor_data
+            sections = _remove_timeslot_conflicts(state, state.unassigned(semester))
+            profiles = state.available_profiles()
+            if sections.size == 0 or profiles.size == 0:
+                imsvm_refusal[semester] = True
+                continue
+            # TODO: do sections in program order groups.
+            ranking_matrix = _build_ranking_matrix(
+                state, scores, semester, sections, profiles, random_state
             )
             try:
-                matches = imsvm(ranking_matrix, rank_threshold=0.5)
+                matches = imsvm(
+                    ranking_matrix,
+                    rank_threshold=0.5,
+                    method=svd_method,
+                    random_state=random_state,
+                    svd_state=svd_states[semester],
+                )
             except ImsvmRefuse:
                 imsvm_refusal[semester] = True
                 continue
             if not matches:
                 imsvm_refusal[semester] = True
             for person_idx, section_idx in matches:
-                person = person_list[person_idx]
-                section = section_list[section_idx]
-                section.instructor = person
-                section.save()
-    return instructor_data
+                state.assign(sections[section_idx], profiles[person_idx])
+            match_count += len(matches)
+        iterations += 1
+        progress(iterations, match_count)
 
 
 ################################################################
 
 
-def _init_instructor_data():
+def _term_capacity(state, semester, profiles):
     """
-    Construct initial instructor data map
+    The number of sections each profile can still take this semester.
+    Fractional term loads round half up; this matches the worksheet,
+    which only flags a term load as exceeded below -0.5.
     """
-    qs = TeachingProfile.objects.filter(active=True)
-    semesterprefs_qs = SemesterTeachingPreference.objects.filter(active=True)
-    values_qs = qs.values(
-        "pk", "agreed_load", "preference_same_day", "preference_no_back_to_back"
-    )
-    results = {v["pk"]: v for v in values_qs}
-    for pk in results:
-        semesterprefs_local = semesterprefs_qs.filter(profile_id=pk)
-        semesterprefs_list = list(
-            semesterprefs_local.values("semester", "preferred_load")
-        )
-        results[pk]["term_load"] = {
-            v["semester"]: v["preferred_load"] for v in semesterprefs_list
-        }
-        results[pk]["remaining_load"] = results[pk]["agreed_load"]
-        results[pk]["remaining_term_load"] = results[pk]["term_load"].copy()
-        results[pk]["occupied_timeslots"] = {
-            v["semester"]: [] for v in semesterprefs_list
-        }
-    return results
+    term_load = state.remaining_term_load[profiles, state.semester_index(semester)]
+    capacity = np.floor(term_load + 0.5)
+    capacity = np.minimum(capacity, state.remaining_load[profiles])
+    return np.maximum(capacity, 0).astype(int)
 
 
-################################################################
+def _run_assignment(state, scores, progress, random_state=None):
+    """
+    Solve each semester in a single pass as a capacity constrained
+    assignment problem; see ``assign.capacity_assignment``.
+    ``random_state`` is as for ``_build_ranking_matrix()``.
+    """
+    match_count = 0
+    for iterations, semester in enumerate(SEMESTER_LIST, 1):
+        sections = state.unassigned(semester)
+        profiles = state.available_profiles()
+        if sections.size == 0 or profiles.size == 0:
+            continue
+        ranking_matrix = _build_ranking_matrix(
+            state, scores, semester, sections, profiles, random_state
+        )
+        # online sections never clash with each other.
+        timeslot_ids = [
+            t if t not in (NONE, state.online_pk) else None
+            for t in state.section_timeslot[sections].tolist()
+        ]
+        online = np.array([t is None for t in timeslot_ids], dtype=bool)
+        forbidden = state.occupied_mask(semester, profiles, sections) & ~online
+        matches = capacity_assignment(
+            ranking_matrix,
+            _term_capacity(state, semester, profiles),
+            rank_threshold=0.5,
+            forbidden=forbidden,
+            conflict_groups=timeslot_ids,
+        )
+        for person_idx, section_idx in matches:
+            state.assign(sections[section_idx], profiles[person_idx])
+        match_count += len(matches)
+        progress(iterations, match_count)
 
 
-def _remove_scheduled(session):
-    """
-    Remove those sections which already have instructors
-    Do a full count of remaining instructor loads, and return this.
-    If an instructor is at their load, do not include them.
-    """
-    qs = session.draftsection_set.filter(active=True)
-    instructor_data = _init_instructor_data()
-    # update instructor data
-    instr_section_qs = qs.filter(instructor__isnull=False)
-    profile_pks = set(instr_section_qs.values_list("instructor_id", flat=True))
-    for pk in profile_pks:
-        instr_sections = instr_section_qs.filter(instructor_id=pk)
-        # print(instr_sections)
-        instr_data = instructor_data[pk]
-        for section in instr_sections:
-            # print(section)
-            instr_data["remaining_load"] -= 1
-            semester = section.semester
-            if section.timeslot:
-                instr_data["occupied_timeslots"][semester].append(section.timeslot_id)
-            instr_data["remaining_term_load"][semester] -= 1
-        if instr_data["remaining_load"] <= 0:
-            instructor_data.pop(pk)
-    return qs.filter(instructor__isnull=True), instructor_data
+ENGINES = {"imsvm": _run_imsvm, "assignment": _run_assignment}
 
 
 ################################################################
 
 
-def _remove_timeslot_conflicts(section_qs):
+def _remove_timeslot_conflicts(state, sections):
     """
-    From the section_qs only; remove any conflicting timeslots
+    From the given sections only; remove any conflicting timeslots
     - find duplicate timeslots, only keep one section for each.
+    - sections without an active, scheduled timeslot are dropped.
     """
-    used_timeslots = set(section_qs.values_list("timeslot_id", flat=True))
-    qs = Timeslot.objects.filter(
-        active=True, scheduled=True, pk__in=used_timeslots
-    ).annotate(section_count=Count("draftsection"))
-    qs_one = qs.filter(section_count=1)
-    qs_multiple = qs.filter(section_count__gte=2)
-    # The annotations get a bit confused using the indirect backwards relation on the above filtered querysets...
-    sections = list(
-        qs.filter(pk__in=qs_one.values_list("pk", flat=True)).values_list(
-            "draftsection", flat=True
-        )
+    timeslots = state.section_timeslot[sections]
+    sections = sections[np.isin(timeslots, state.timeslot_pk)]
+    # keep the highest course (id) in each timeslot.
+    order = np.lexsort(
+        (-state.section_course[sections], state.section_timeslot[sections])
     )
-    for timeslot_id in qs_multiple.values_list("pk", flat=True):
-        pk = (
-            section_qs.filter(timeslot_id=timeslot_id)
-            .order_by("-course")
-            .values_list("pk", flat=True)[0]
-        )
-        sections.append(pk)
-    return section_qs.filter(pk__in=sections)
+    sections = sections[order]
+    _, first = np.unique(state.section_timeslot[sections], return_index=True)
+    return np.sort(sections[first])
 
 
 ################################################################
 
 
-def _build_ranking_matrix(semester, section_qs, instructor_data):
+def _build_ranking_matrix(
+    state, scores, semester, sections, profiles, random_state=None
+):
     """
-    At this point the section_qs will have only unique timeslots,
-    and instructors that are at their load have been removed
-    from instructor_data.  Their load for the current term
-    may be ≤ 0 however.
+    At this point the ``sections`` (indices into the ``state``) will
+    have only unique timeslots, and the ``profiles`` (indices into the
+    ``state``) that are at their load have been removed.
+    Their load for the current term may be ≤ 0 however.
 
     Each row of the ranking matrix is the instructors preference vector
     for the sections given.
 
     The ``semester`` value is given purely as a shortcut, since it's
     predetermined.
+
+    ``scores`` is a ``PreferenceScores`` instance.
+    ``random_state`` is anything with a numpy style ``random_sample()``
+    method; the default is the global numpy generator.
     """
-    section_list = list(section_qs)
-    course_timeslots = [(s.course_id, s.timeslot_id) for s in section_list]
-    rankings = []
-    profile_list = list(TeachingProfile.objects.filter(pk__in=instructor_data))
+    if random_state is None:
+        random_state = np.random
+    profile_ids = state.profile_pk[profiles].tolist()
+    scores.extend_profiles(profile_ids)
+    c_score, t_score = scores.score_matrix(
+        profile_ids,
+        state.section_course[sections].tolist(),
+        state.section_timeslot[sections].tolist(),
+    )
 
-    for profile in profile_list:
-        course_prefs = dict(
-            CourseTeachingPreference.objects.filter(
-                active=True, profile=profile
-            ).values_list("course_id", "score")
-        )
-        timeslots_prefs = dict(
-            TimeslotTeachingPreference.objects.filter(
-                active=True, profile=profile
-            ).values_list("timeslot_id", "score")
-        )
-        row = []
-        instr_data = instructor_data[profile.pk]
-        t_weight = 1
-        if instr_data["remaining_term_load"][semester] <= 0:
-            t_weight = 0
-        if 0 < instr_data["remaining_term_load"][semester] < 1:
-            t_weight = int(random() > instr_data["remaining_term_load"][semester])
-        for course_id, timeslot_id in course_timeslots:
-            c_score = course_prefs.get(course_id, 0)
-            if timeslot_id in instr_data["occupied_timeslots"][semester]:
-                t_score = 0
-            else:
-                t_score = timeslots_prefs.get(timeslot_id, 0)
-                t_score *= t_weight
-                # TODO: test adjacent timeslots for preference_no_back_to_back
-                # TODO: test days of timeslots for preference_same_day
-            section_score = c_score * (t_score * c_score + random())
-            row.append(section_score)
-        rankings.append(row)
-    return rankings, profile_list, section_list
+    # per-profile timeslot weight, based on the remaining term load.
+    remaining = state.remaining_term_load[
+        profiles, state.semester_index(semester)
+    ].reshape(-1, 1)
+    t_weight = np.ones_like(remaining)
+    t_weight[remaining <= 0] = 0
+    partial = (0 < remaining) & (remaining < 1)
+    t_weight[partial] = random_state.random_sample(np.count_nonzero(partial)) > (
+        remaining[partial]
+    )
+
+    # sections in timeslots the instructor already occupies, or that go
+    #   against their back to back or same day preferences,
+    #   get no timeslot score.
+    occupied = state.occupied_mask(semester, profiles, sections)
+    occupancy = state.timeslot_occupancy(semester, profiles)
+    timeslot_ids = state.section_timeslot[sections].tolist()
+    back_to_back = state.timeslots.adjacent_mask(occupancy, timeslot_ids)
+    back_to_back &= state.preference_no_back_to_back[profiles].reshape(-1, 1)
+    different_days = state.timeslots.different_day_mask(occupancy, timeslot_ids)
+    different_days &= state.preference_same_day[profiles].reshape(-1, 1)
+    t_score = np.where(occupied | back_to_back | different_days, 0, t_score * t_weight)
+
+    jitter = random_state.random_sample(c_score.shape)
+    rankings = combine_scores(c_score, t_score, jitter)
+    return rankings
 
 
 ################################################################
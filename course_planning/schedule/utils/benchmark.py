@@ -0,0 +1,220 @@
+"""
+Compare the scheduling engines on a ranking matrix.
+
+Run directly for a quick comparison on random data::
+
+    python -m course_planning.schedule.utils.benchmark 80 400
+
+For whole (synthetic or real) sessions, see ``benchmark_load()``,
+``benchmark_schedule()`` and the ``auto_schedule_benchmark``
+management command.
+"""
+################################################################
+
+import copy
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .assign import capacity_assignment, total_score
+from .imsvm import ImsvmRefuse, imsvm
+
+################################################################
+
+
+def random_problem(n_people, n_sections, load=3, seed=None):
+    """
+    Return a ``(rankings, capacity)`` pair shaped like a real session:
+    preference scores in 0..9, most of them zero, combined with the
+    usual scoring formula.
+    """
+    rng = np.random.RandomState(seed)
+    c_score = rng.randint(0, 10, (n_people, n_sections))
+    c_score[rng.random_sample(c_score.shape) < 0.8] = 0
+    t_score = rng.randint(0, 10, (n_people, n_sections))
+    rankings = c_score * (t_score * c_score + rng.random_sample(c_score.shape))
+    capacity = np.full(n_people, load, dtype=int)
+    return rankings, capacity
+
+
+################################################################
+
+
+def imsvm_rounds(rankings, capacity, rank_threshold=0.5):
+    """
+    Repeated ``imsvm`` rounds, the way ``auto.main`` drives them:
+    after each round, remove matched sections and people at capacity.
+    """
+    rankings = np.asarray(rankings, dtype=float)
+    remaining = np.array(capacity, dtype=int)
+    open_sections = np.ones(rankings.shape[1], dtype=bool)
+    results = []
+    while True:
+        rows = np.nonzero(remaining > 0)[0]
+        cols = np.nonzero(open_sections)[0]
+        if len(rows) == 0 or len(cols) == 0:
+            break
+        try:
+            matches = imsvm(rankings[np.ix_(rows, cols)], rank_threshold=rank_threshold)
+        except ImsvmRefuse:
+            break
+        if not matches:
+            break
+        for i, j in matches:
+            i, j = rows[i], cols[j]
+            results.append((int(i), int(j)))
+            remaining[i] -= 1
+            open_sections[j] = False
+    return results
+
+
+################################################################
+
+
+ENGINES = {
+    "imsvm": imsvm_rounds,
+    "assignment": lambda r, c: capacity_assignment(r, c, rank_threshold=0.5),
+}
+
+
+def compare_engines(rankings, capacity, engines=None):
+    """
+    Run each engine on the same problem.
+    Returns a dictionary of engine name -> result dictionary with
+    ``score``, ``matches`` and ``seconds`` keys.
+    """
+    if engines is None:
+        engines = ENGINES
+    results = {}
+    for name, engine in engines.items():
+        start = time.time()
+        matches = engine(np.array(rankings, dtype=float), capacity)
+        seconds = time.time() - start
+        results[name] = {
+            "score": total_score(rankings, matches),
+            "matches": len(matches),
+            "seconds": seconds,
+        }
+    return results
+
+
+################################################################
+
+
+def benchmark_load(session):
+    """
+    Load ``session`` the ways the auto-scheduler and the worksheet do:
+    ``ScheduleState.load``, ``PreferenceScores.load`` and a
+    ``WorksheetSnapshot``.
+    Returns ``(state, scores, results)``, where ``results`` is a
+    dictionary of load name -> dictionary with ``queries`` and
+    ``seconds`` keys.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from .scores import PreferenceScores
+    from .state import ScheduleState
+    from .worksheet import WorksheetSnapshot
+
+    loads = [
+        ("state", lambda: ScheduleState.load(session)),
+        ("scores", PreferenceScores.load),
+        ("snapshot", lambda: WorksheetSnapshot(session)),
+    ]
+    loaded = {}
+    results = {}
+    for name, load in loads:
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.time()
+            loaded[name] = load()
+            seconds = time.time() - start
+        results[name] = {"queries": len(ctx), "seconds": seconds}
+    return loaded["state"], loaded["scores"], results
+
+
+def benchmark_schedule(state, scores, engines=None, seed=0, improve_seconds=0):
+    """
+    Run each auto-scheduler engine (default: all of ``auto.ENGINES``)
+    on a copy of the in-memory ``state``.
+    Returns a dictionary of engine name -> result dictionary with
+    ``seconds`` (the whole run), ``ranking_seconds`` (building one
+    ranking matrix of every unassigned section and available profile),
+    ``peak_memory`` (bytes, traced by ``tracemalloc``), ``matches``,
+    and the ``ScheduleState.evaluate()`` keys.
+    """
+    from . import auto
+    from .improve import improve
+
+    if engines is None:
+        engines = list(auto.ENGINES)
+    results = {}
+    for name in engines:
+        tracemalloc.start()
+        try:
+            start = time.time()
+            semester = auto.SEMESTER_LIST[0]
+            auto._build_ranking_matrix(
+                state,
+                scores,
+                semester,
+                state.unassigned(semester),
+                state.available_profiles(),
+                np.random.RandomState(seed),
+            )
+            ranking_seconds = time.time() - start
+
+            start = time.time()
+            seed, section_instructor, evaluation = auto._attempt(
+                state, scores, name, seed, {}
+            )
+            result = copy.deepcopy(state)
+            result.section_instructor = section_instructor
+            result._recount_loads()
+            if improve_seconds:
+                improve(
+                    result,
+                    scores,
+                    seconds=improve_seconds,
+                    random_state=np.random.RandomState(seed),
+                )
+                evaluation = result.evaluate(scores)
+            seconds = time.time() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[name] = dict(
+            evaluation,
+            seconds=seconds,
+            ranking_seconds=ranking_seconds,
+            peak_memory=peak_memory,
+            matches=len(result.changed()),
+        )
+    return results
+
+
+################################################################
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    n_people = int(argv[0]) if len(argv) > 0 else 80
+    n_sections = int(argv[1]) if len(argv) > 1 else 400
+    rankings, capacity = random_problem(n_people, n_sections, seed=0)
+    results = compare_engines(rankings, capacity)
+    print("{:<12} {:>12} {:>8} {:>10}".format("engine", "score", "matches", "seconds"))
+    for name, r in results.items():
+        print(
+            "{:<12} {:>12.1f} {:>8} {:>10.3f}".format(
+                name, r["score"], r["matches"], r["seconds"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
+
+################################################################
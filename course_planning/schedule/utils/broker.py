@@ -0,0 +1,125 @@
+"""
+Change notifications for open scheduling worksheets.
+
+A broker wakes up the long-polling ``get_section_changes`` requests
+of a session when its sections change (see ``cache.sections_changed``).
+Notifications carry no data: the woken request reads the changes
+(by revision) from the database, so a missed notification only
+delays an update until the long-poll times out.
+
+``LocalBroker`` (the default) only reaches the requests in its own
+process: enough for a single server process (auto-schedule jobs run
+in its threads), and for testing.  ``CacheBroker`` goes through the
+worksheet cache, so it reaches every process sharing that cache
+(e.g., redis or memcached), by polling it.
+
+Long-polling is off unless the ``worksheet:long_poll_seconds`` setting
+is set; with several server processes, set ``worksheet:broker`` to
+``CacheBroker`` as well.
+"""
+################################################################
+
+import threading
+import time
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from ... import conf
+
+################################################################
+
+_broker = None
+_broker_lock = threading.Lock()
+
+################################################################
+
+
+class LocalBroker(object):
+    """
+    An in-process broker; channels are, e.g., session pks.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._counters = {}
+
+    def token(self, channel):
+        """
+        The current position of ``channel``, for ``wait()``; take it
+        before checking for changes, so none are missed.
+        """
+        with self._condition:
+            return self._counters.get(channel, 0)
+
+    def publish(self, channel):
+        with self._condition:
+            self._counters[channel] = self._counters.get(channel, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, channel, token, timeout):
+        """
+        Wait up to ``timeout`` seconds for a publication on ``channel``
+        since ``token``.  Returns whether there was one.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._counters.get(channel, 0) != token, timeout
+            )
+
+
+################################################################
+
+
+class CacheBroker(object):
+    """
+    A broker shared through a cache, which waiting requests poll
+    every ``interval`` seconds.
+    """
+
+    KEY = "course_planning:worksheet:{}:changes"
+
+    def __init__(self, alias=None, interval=0.5):
+        if alias is None:
+            alias = conf.get("worksheet_cache:alias") or "default"
+        self.alias = alias
+        self.interval = interval
+
+    def token(self, channel):
+        return caches[self.alias].get(self.KEY.format(channel), 0)
+
+    def publish(self, channel):
+        cache = caches[self.alias]
+        key = self.KEY.format(channel)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+
+    def wait(self, channel, token, timeout):
+        deadline = time.time() + timeout
+        while self.token(channel) == token:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+        return True
+
+
+################################################################
+
+
+def get_broker():
+    """
+    The (lazily created) shared broker; see the ``worksheet:broker``
+    setting.
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(conf.get("worksheet:broker"))()
+        return _broker
+
+
+################################################################
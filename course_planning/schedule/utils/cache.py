@@ -0,0 +1,151 @@
+"""
+A cache of the ``WorksheetSnapshot`` of each session, shared through
+Django's cache framework.
+
+Snapshots are stored under versioned keys: a version per session,
+bumped (atomically, with ``cache.incr``) whenever its sections change,
+and a global version, bumped whenever the profiles, preferences or
+timeslots change.  A stale snapshot is therefore never read, from any
+process, as long as the cache backend is shared between processes
+(e.g., memcached or redis; not the local memory cache).
+
+When the sections of a session change, the previous snapshot is
+updated in place (``WorksheetSnapshot.update_sections``) and stored
+under the new version -- but only when no other change came in
+between; otherwise the next read rebuilds it.
+"""
+################################################################
+
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+from ... import conf
+from .broker import get_broker
+from .worksheet import WorksheetSnapshot
+
+################################################################
+
+GLOBAL_VERSION_KEY = "course_planning:worksheet:version"
+SESSION_VERSION_KEY = "course_planning:worksheet:{}:version"
+SNAPSHOT_KEY = "course_planning:worksheet:{}:{}:{}"
+
+################################################################
+
+
+def _get_cache():
+    alias = conf.get("worksheet_cache:alias")
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _new_version():
+    # never reuse the version numbers of an evicted key.
+    return int(time.time() * 1000)
+
+
+def _get_version(cache, key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(cache, key):
+    """
+    Returns the new version; and the previous one, or ``None`` when
+    the key was missing.
+    """
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), None)
+        return cache.get(key), None
+    return version, version - 1
+
+
+def _snapshot_key(cache, session_pk, version):
+    return SNAPSHOT_KEY.format(
+        session_pk, _get_version(cache, GLOBAL_VERSION_KEY), version
+    )
+
+
+################################################################
+
+
+def get_snapshot(session):
+    """
+    The current ``WorksheetSnapshot`` for ``session``.
+    """
+    cache = _get_cache()
+    if cache is None:
+        return WorksheetSnapshot(session)
+    version = _get_version(cache, SESSION_VERSION_KEY.format(session.pk))
+    key = _snapshot_key(cache, session.pk, version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = WorksheetSnapshot(session)
+        cache.set(key, snapshot, conf.get("worksheet_cache:timeout"))
+    return snapshot
+
+
+def sections_changed(session_pk, section_pks=None):
+    """
+    Record that the given sections of a session have changed
+    (been saved, or deleted); ``None`` means any of them.
+    The worksheets waiting on the session are notified (see ``broker``).
+    This takes effect when the current transaction commits.
+    """
+    if section_pks is not None:
+        section_pks = list(section_pks)
+    transaction.on_commit(lambda: _sections_changed(session_pk, section_pks))
+    transaction.on_commit(lambda: get_broker().publish(session_pk))
+
+
+def _sections_changed(session_pk, section_pks):
+    cache = _get_cache()
+    if cache is None:
+        return
+    version, previous = _bump_version(cache, SESSION_VERSION_KEY.format(session_pk))
+    if section_pks is None or previous is None:
+        return
+    snapshot = cache.get(_snapshot_key(cache, session_pk, previous))
+    if snapshot is None:
+        return
+    if snapshot.update_sections(section_pks):
+        cache.set(
+            _snapshot_key(cache, session_pk, version),
+            snapshot,
+            conf.get("worksheet_cache:timeout"),
+        )
+
+
+def discard_snapshot(session_pk):
+    """
+    Stop using the cached snapshot of a session, now: e.g., one that
+    may have been built from changes that were then rolled back.
+    """
+    cache = _get_cache()
+    if cache is not None:
+        _bump_version(cache, SESSION_VERSION_KEY.format(session_pk))
+
+
+def invalidate_all():
+    """
+    Invalidate the snapshots of every session, e.g., when preferences
+    or timeslots change.
+    This takes effect when the current transaction commits.
+    """
+    transaction.on_commit(_invalidate_all)
+
+
+def _invalidate_all():
+    cache = _get_cache()
+    if cache is not None:
+        _bump_version(cache, GLOBAL_VERSION_KEY)
+
+
+################################################################
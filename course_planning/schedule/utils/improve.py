@@ -0,0 +1,254 @@
+"""
+Local search improvement of an auto-scheduled ``ScheduleState``.
+
+Starting from the engine's assignments, random moves are tried:
+    - fill: give an unassigned section to an instructor;
+    - move: give an assigned section to another instructor;
+    - swap: exchange the instructors of two sections in the same semester.
+Each move is scored by its change in total preference score, which
+only involves the (at most four) entries of a precomputed
+instructor x section score matrix.  Moves are accepted by simulated
+annealing (hill climbing when the temperature is zero).
+
+Only sections without an instructor in the database, in an active,
+scheduled timeslot, are ever changed: as for the engines (see
+``auto._remove_timeslot_conflicts``), Online sections are left alone.
+Moves never exceed an instructor's total or term load
+(as for ``auto._term_capacity``), never double book a timeslot, and
+respect the back to back and same day preferences.
+"""
+################################################################
+
+import math
+import time
+
+import numpy as np
+
+from ... import conf
+from .scores import combine_scores
+from .state import NONE
+
+################################################################
+
+
+class LocalSearch(object):
+    """
+    The incremental search state over the movable sections of a
+    ``ScheduleState``; positions below are into ``self.sections``.
+    """
+
+    def __init__(self, state, scores):
+        self.state = state
+        timeslots = state.timeslots
+        # not Online, as for the engines.
+        schedulable = np.isin(state.section_timeslot, timeslots.pk)
+        self.sections = np.nonzero((state.original_instructor == NONE) & schedulable)[0]
+        profile_ids = state.profile_pk.tolist()
+        scores.extend_profiles(profile_ids)
+        c_score, t_score = scores.score_matrix(
+            profile_ids,
+            state.section_course[self.sections].tolist(),
+            state.section_timeslot[self.sections].tolist(),
+        )
+        self.gain = combine_scores(c_score, t_score)
+        self.owner = state.profile_index(state.section_instructor[self.sections])
+        self.semester = state.section_semester[self.sections]
+        self.remaining_load = state.remaining_load.copy()
+        self.remaining_term_load = state.remaining_term_load.copy()
+
+        # timeslot positions, with one extra "no conflicts" slot
+        #   for the (fixed) online sections.
+        self.free_slot = len(timeslots.pk)
+        self.slot = self._slots(state.section_timeslot[self.sections])
+        all_profiles = state.profile_index(state.section_instructor)
+        all_slots = self._slots(state.section_timeslot)
+        mask = all_profiles != NONE
+        self.occupied = np.zeros(
+            (len(state.profile_pk), state.term_load.shape[1], self.free_slot + 1),
+            dtype=int,
+        )
+        np.add.at(
+            self.occupied,
+            (all_profiles[mask], state.section_semester[mask], all_slots[mask]),
+            1,
+        )
+        # per-slot conflicts, including the slot itself.
+        eye = np.eye(self.free_slot, dtype=bool)
+        self.back_to_back = self._pad(timeslots.adjacent | eye)
+        self.different_days = self._pad(~timeslots.nested_days)
+        self.no_back_to_back = state.preference_no_back_to_back
+        self.same_day = state.preference_same_day
+
+    def _slots(self, timeslot_ids):
+        slots = self.state.timeslots.index(timeslot_ids.tolist())
+        slots[slots < 0] = self.free_slot
+        return slots
+
+    def _pad(self, matrix):
+        # the "no conflicts" slot never conflicts with anything.
+        result = np.zeros((self.free_slot + 1, self.free_slot + 1), dtype=bool)
+        result[: self.free_slot, : self.free_slot] = matrix
+        return result
+
+    ############################################################
+
+    def total(self):
+        owned = self.owner != NONE
+        return float(self.gain[self.owner[owned], np.nonzero(owned)[0]].sum())
+
+    def _has_capacity(self, p, sem):
+        return self.remaining_load[p] >= 1 and self.remaining_term_load[p, sem] >= 0.5
+
+    def _fits(self, p, j, ignore=None):
+        """
+        Can profile ``p`` teach section ``j``, given the timeslots they
+        already teach (not counting section ``ignore``)?
+        """
+        k = self.slot[j]
+        if k == self.free_slot:
+            return True
+        sem = self.semester[j]
+        occupied = self.occupied[p, sem]
+        if ignore is not None:
+            occupied = occupied.copy()
+            occupied[self.slot[ignore]] -= 1
+        if occupied[k]:
+            return False
+        if self.no_back_to_back[p] and occupied[self.back_to_back[k]].any():
+            return False
+        if self.same_day[p] and occupied[self.different_days[k]].any():
+            return False
+        return True
+
+    def _set(self, j, p):
+        old = self.owner[j]
+        sem = self.semester[j]
+        if old != NONE:
+            self.occupied[old, sem, self.slot[j]] -= 1
+            self.remaining_load[old] += 1
+            self.remaining_term_load[old, sem] += 1
+        self.owner[j] = p
+        if p != NONE:
+            self.occupied[p, sem, self.slot[j]] += 1
+            self.remaining_load[p] -= 1
+            self.remaining_term_load[p, sem] -= 1
+
+    ############################################################
+
+    def propose(self, random_state):
+        """
+        A random feasible move as ``(delta, changes)``, where
+        ``changes`` is a list of ``(section, profile)`` positions;
+        or ``None``.
+        """
+        n_profiles, n_sections = self.gain.shape
+        j = random_state.randint(n_sections)
+        p1 = self.owner[j]
+        if p1 == NONE or random_state.random_sample() < 0.5:
+            # fill or move.
+            p = random_state.randint(n_profiles)
+            if p == p1 or not self._has_capacity(p, self.semester[j]):
+                return None
+            if not self._fits(p, j):
+                return None
+            delta = self.gain[p, j]
+            if p1 != NONE:
+                delta -= self.gain[p1, j]
+            elif delta <= 0:
+                return None
+            return delta, [(j, p)]
+        # swap.
+        i = random_state.randint(n_sections)
+        p2 = self.owner[i]
+        if p2 == NONE or p2 == p1 or self.semester[i] != self.semester[j]:
+            return None
+        if not (self._fits(p2, j, ignore=i) and self._fits(p1, i, ignore=j)):
+            return None
+        delta = (
+            self.gain[p2, j] + self.gain[p1, i] - self.gain[p1, j] - self.gain[p2, i]
+        )
+        return delta, [(j, NONE), (i, p1), (j, p2)]
+
+    def apply(self, changes):
+        for j, p in changes:
+            self._set(j, p)
+
+    def write_back(self, owner):
+        """
+        Store the ``owner`` positions in the ``ScheduleState``.
+        """
+        state = self.state
+        state.section_instructor[self.sections] = np.where(
+            owner == NONE, NONE, state.profile_pk[owner]
+        )
+        state._recount_loads()
+
+
+################################################################
+
+
+def improve(
+    state, scores, seconds=None, max_moves=None, temperature=None, random_state=None
+):
+    """
+    Improve the assignments of ``state`` in place, for up to
+    ``seconds`` (the default is the ``auto_schedule:improve_seconds``
+    setting) and/or ``max_moves`` proposed moves.
+    ``temperature`` is the initial simulated annealing temperature,
+    cooled linearly to zero; the default is a tenth of the mean
+    positive score.  Use ``0`` for hill climbing.
+    ``random_state`` is anything with the numpy ``randint()`` and
+    ``random_sample()`` methods.
+    The best schedule seen is kept.
+    Returns a dictionary of ``moves`` (proposed), ``accepted`` and
+    ``gain`` (in total preference score).
+    """
+    if seconds is None:
+        seconds = conf.get("auto_schedule:improve_seconds")
+    if random_state is None:
+        random_state = np.random
+    result = {"moves": 0, "accepted": 0, "gain": 0.0}
+    if not seconds and not max_moves:
+        return result
+    search = LocalSearch(state, scores)
+    if search.gain.size == 0:
+        return result
+    if temperature is None:
+        positive = search.gain[search.gain > 0]
+        temperature = 0.1 * positive.mean() if positive.size else 0
+    start = time.time()
+    current = best = initial = search.total()
+    best_owner = search.owner.copy()
+
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        fraction = moves / float(max_moves) if max_moves else 0
+        if seconds:
+            elapsed = time.time() - start
+            if elapsed >= seconds:
+                break
+            fraction = max(fraction, elapsed / seconds)
+        moves += 1
+        move = search.propose(random_state)
+        if move is None:
+            continue
+        delta, changes = move
+        t = temperature * (1 - fraction)
+        if delta < 0 and (
+            t <= 0 or random_state.random_sample() >= math.exp(delta / t)
+        ):
+            continue
+        search.apply(changes)
+        result["accepted"] += 1
+        current += delta
+        if current > best:
+            best = current
+            best_owner = search.owner.copy()
+
+    search.write_back(best_owner)
+    result["moves"] = moves
+    result["gain"] = float(best - initial)
+    return result
+
+
+################################################################
@@ -9,8 +9,104 @@ class ImsvmRefuse(Exception):
 
 import numpy as np
 
+SVD_METHODS = ("exact", "randomized")
 
-def imsvm(rankings, match_all=False, k_threshold=0.85, rank_threshold=None):
+
+def _iterations_needed(value, smallest, tol):
+    """
+    About how many subspace iterations it takes to pin down a
+    singular ``value`` to within ``tol`` (relative), when the
+    subspace's ``smallest`` value is about the next one past it:
+    the error shrinks by ``(smallest / value) ** 2`` with each.
+    """
+    if smallest <= 0:
+        return 0
+    if smallest >= value:
+        return np.inf
+    return np.log(tol) / (2 * np.log(smallest / value))
+
+
+def _randomized_svd(
+    A, k_threshold, state, random_state=None, oversample=8, tol=1e-6, max_iter=32
+):
+    """
+    The leading singular triplets of ``A``, down to the first one
+    below ``k_threshold`` times the largest, by randomized subspace
+    iteration; as ``U, s, V`` like ``np.linalg.svd(A,
+    full_matrices=False)`` but truncated.
+    Each of those triplets must be accurate to within ``tol`` (of
+    the largest value), so the cutoff falls where it does for the
+    exact decomposition; ``None`` when that takes more than
+    ``max_iter`` iterations (e.g., when many values are close to the
+    largest, as for random noise).
+    ``state`` is as for ``_svd()``.
+    """
+    if random_state is None:
+        random_state = np.random
+    limit = min(A.shape)
+    k = min(state.get("k", 8), limit)
+    while True:
+        size = min(k + oversample, limit)
+        omega = random_state.standard_normal((A.shape[1], size))
+        Q, _ = np.linalg.qr(np.dot(A, omega))
+        iterations = 0
+        check = 4
+        while True:
+            Z, _ = np.linalg.qr(np.dot(A.T, Q))
+            Q, _ = np.linalg.qr(np.dot(A, Z))
+            iterations += 1
+            if iterations < check:
+                continue
+            check *= 2
+            Ub, s, V = np.linalg.svd(np.dot(Q.T, A), full_matrices=False)
+            U = np.dot(Q, Ub)
+            kept = np.count_nonzero(s[:k] >= k_threshold * s[0])
+            n = min(kept + 1, s.size)
+            if size < limit and _iterations_needed(s[n - 1], s[-1], tol) > max_iter:
+                # the values are too close together to separate.
+                return None
+            if kept == k < limit:
+                # more than ``k`` are retained.
+                break
+            residual = np.linalg.norm(np.dot(A, V[:n].T) - U[:, :n] * s[:n], axis=0)
+            if residual.max() <= tol * s[0]:
+                state["k"] = k
+                return U[:, :k], s[:k], V[:k]
+            if iterations >= max_iter:
+                return None
+        k = min(2 * k, limit)
+
+
+def _svd(A, k_threshold, method, state, random_state=None):
+    """
+    Return the singular triplets of ``A`` that are at least
+    ``k_threshold`` times the largest.
+    ``state`` is a dictionary carried between calls: the number of
+    triplets the last one needed is the first guess of the next.
+    The ``"randomized"`` method falls back to the exact one when it
+    cannot be as accurate.
+    """
+    result = None
+    if method == "randomized":
+        result = _randomized_svd(A, k_threshold, state, random_state)
+    if result is None:
+        result = np.linalg.svd(A, full_matrices=False)
+    U, s, V = result
+    m = s.max()
+    s = s.copy()
+    s[s < k_threshold * m] = 0
+    return U, s, V
+
+
+def imsvm(
+    rankings,
+    match_all=False,
+    k_threshold=0.85,
+    rank_threshold=None,
+    method="exact",
+    random_state=None,
+    svd_state=None,
+):
     """
     Given a matrix ``rankings`` of people -> section rankings.
     Return a list of (i,j) pairs which indicate the best
@@ -18,8 +114,20 @@ def imsvm(rankings, match_all=False, k_threshold=0.85, rank_threshold=None):
     Note: This only consitutes a single round, and does
     not handle anything regarding the data; this is strictly
     the numeric calculations.
+
+    ``method`` is ``"exact"`` for a full singular value decomposition,
+    or ``"randomized"`` to compute only the leading singular triplets
+    (to the same accuracy; see ``_randomized_svd()``).
+    ``svd_state`` is an optional dictionary to pass to each of a
+    sequence of calls (e.g., the rounds for one semester): the
+    randomized method then starts with as many singular triplets as
+    the previous call needed, rather than growing to that again.
     """
+    if method not in SVD_METHODS:
+        raise ValueError("unknown svd method {!r}".format(method))
     results = []
+    if svd_state is None:
+        svd_state = {}
     # A is the row normalized rankings matrix.
     A = rankings - np.mean(rankings, axis=1).reshape(-1, 1)
     fill = min((2 * A.min(), 0))
@@ -27,15 +135,11 @@ def imsvm(rankings, match_all=False, k_threshold=0.85, rank_threshold=None):
     while True:
         if len(results) == min(A.shape):
             break
-        U, s, V = np.linalg.svd(A)
-        m = s.max()
-        s[s < k_threshold * m] = 0
+        U, s, V = _svd(A, k_threshold, method, svd_state, random_state)
         count = np.count_nonzero(s)
         if count == 0:
             raise ImsvmRefuse("nothing left; too much noise")
-        S = np.zeros((U.shape[1], V.shape[0]))
-        S[:count, :count] = np.diag(s[:count])
-        B = np.dot(np.dot(U, S), V)
+        B = np.dot(U[:, :count] * s[:count], V[:count])
         for _ in range(count):
             i, j = np.unravel_index(B.argmax(), B.shape)
             if rank_threshold is not None and A[i, j] < rank_threshold:
@@ -4,11 +4,20 @@ Schedule initalization utilities.
 ################################################################
 
 import datetime
+import operator
+from functools import reduce
 
-from classes.models import Section, Semester, Timeslot
+from classes.models import Section, SectionSchedule, Semester, Timeslot
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, OuterRef, Prefetch, Q, Value, When
 
 from ... import conf
-from ...models import DraftSection, SemesterTeachingPreference
+from ...models import (
+    DraftScheduleSession,
+    DraftSection,
+    SemesterTeachingPreference,
+)
+from . import cache
 
 ################################################################
 
@@ -20,77 +29,327 @@ class AlreadyDone(RuntimeError):
 ################################################################
 
 
-def _mirror_section(session, section, debug):
-    if debug:
-        print("considering section:", section)
-    if not section.active:
-        if debug:
-            print("-> section not active")
-        return False
-    if not section.course.active:
-        if debug:
-            print("-> course not active")
-        return False
-    if not section.course.department.active:
-        if debug:
-            print("-> department not active")
-        return False
-    if not section.course.department.advertised:
-        if debug:
-            print("-> department not advertised")
-        return False
-    if section.section_type not in conf.get("valid_section_types"):
-        if debug:
-            print("-> section type", section.section_type, "is not okay")
-        return False
-
-    semester = section.term.term
-    if semester not in [e[0] for e in SemesterTeachingPreference.SEMESTER_CHOICES]:
-        if debug:
-            print(
-                "-> semester",
-                semester,
-                "not a valid choice",
-                SemesterTeachingPreference.SEMESTER_CHOICES,
+def _runs_q(session, offered):
+    """
+    Sections of courses which run only in odd or even years (see
+    ``CourseInfo.runs``), and which are (``offered``) or are not
+    offered in the year of their semester in ``session``.
+    """
+    other = {"e": "o", "o": "e"}
+    query_list = []
+    for code, label in SemesterTeachingPreference.SEMESTER_CHOICES:
+        run = session.run_code(code)
+        query_list.append(
+            Q(
+                term__term=code,
+                course__courseinfo__active=True,
+                course__courseinfo__runs=run if offered else other[run],
             )
-        return False
-    course = section.course
-    instructor = None  # always start with blank instructors
-    timeslot = section.sectionschedule_set.active().timeslot()
-    if section.section_type == "on":
-        timeslot = Timeslot.objects.Online()
-    verbose_name = section.section_name
-
-    obj, created = DraftSection.objects.get_or_create(
+        )
+    return reduce(operator.or_, query_list)
+
+
+def _checks(session=None):
+    """
+    The ``(name, reason, q)`` tests that a ``classes.Section`` must
+    pass to be mirrored into a session, in order.  With a ``session``,
+    courses must also run in the year (even/odd corrections).
+    """
+    result = [
+        ("section_inactive", "section not active", Q(active=True)),
+        ("course_inactive", "course not active", Q(course__active=True)),
+        (
+            "department_inactive",
+            "department not active",
+            Q(course__department__active=True),
+        ),
+        (
+            "department_unadvertised",
+            "department not advertised",
+            Q(course__department__advertised=True),
+        ),
+        (
+            "section_type",
+            "section type is not okay",
+            Q(section_type__in=conf.get("valid_section_types")),
+        ),
+        (
+            "semester",
+            "semester not a valid choice",
+            Q(
+                term__term__in=[
+                    e[0] for e in SemesterTeachingPreference.SEMESTER_CHOICES
+                ]
+            ),
+        ),
+    ]
+    if session is not None:
+        result.append(("runs", "not offered this year", ~_runs_q(session, False)))
+    return result
+
+
+def eligible_sections(semester_list, session=None):
+    """
+    The ``classes.Section`` queryset of ``semester_list`` which is
+    mirrored into a session: active sections of the valid types,
+    in active courses of active, advertised departments, and in
+    semesters with a teaching preference code.  With a ``session``,
+    odd (even) year only courses are left out of its even (odd) years.
+    """
+    return Section.objects.filter(
+        *[q for name, reason, q in _checks(session)], term__in=semester_list
+    )
+
+
+def _fill_in_sections(session, source, semester_list):
+    """
+    The sections of ``semester_list`` (e.g., two years ago) of odd or
+    even year courses which run in their semester's year of
+    ``session``, but are not offered in ``source`` (e.g., from last
+    year), by course and semester; as for ``_source_sections()``.
+    """
+    section_qs = eligible_sections(semester_list, session).filter(
+        _runs_q(session, True)
+    )
+    offered = {(k[0], k[2]) for k in source}
+    return {
+        key: timeslot
+        for key, timeslot in _source_sections(section_qs).items()
+        if (key[0], key[2]) not in offered
+    }
+
+
+def _section_timeslot(section):
+    """
+    As for ``section.sectionschedule_set.active().timeslot()``, from
+    the prefetched ``active_schedules``: the timeslot of the active
+    schedules, when they agree on one.
+    """
+    timeslot_set = {s.timeslot for s in section.active_schedules}
+    if len(timeslot_set) == 1:
+        return timeslot_set.pop()
+    return None
+
+
+def _source_sections(section_qs):
+    """
+    The timeslot (or ``None``) of each section of ``section_qs``, by
+    ``(course_id, section name, semester)``, with a fixed number of
+    queries.
+    """
+    section_qs = section_qs.select_related("term").prefetch_related(
+        Prefetch(
+            "sectionschedule_set",
+            queryset=SectionSchedule.objects.active().select_related("timeslot"),
+            to_attr="active_schedules",
+        )
+    )
+    online = None
+    result = {}
+    for section in section_qs:
+        key = (section.course_id, section.section_name, section.term.term)
+        if key in result:
+            continue
+        if section.section_type == "on":
+            if online is None:
+                online = Timeslot.objects.Online()
+            result[key] = online
+        else:
+            result[key] = _section_timeslot(section)
+    return result
+
+
+def _draft_section(session, key, timeslot, revision):
+    course_id, verbose_name, semester = key
+    return DraftSection(
+        course_id=course_id,
         verbose_name=verbose_name,
-        course=course,
-        session=session,
         semester=semester,
-        defaults={"timeslot": timeslot, "instructor": instructor},
+        session=session,
+        timeslot=timeslot,
+        instructor=None,  # always start with blank instructors
+        revision=revision,
     )
-    return created
 
 
 ################################################################
 
 
-def from_classes_app(session, semester_list, debug):
+def from_classes_app(session, semester_list, debug, corrections_from=None):
     """
     Initalize the given ``session`` from the section data given
     by ``semester_list``.
+    With ``corrections_from``, the semesters two years before
+    ``semester_list``, even/odd corrections are made: odd (even) year
+    only courses are left out of even (odd) years, and filled in from
+    ``corrections_from`` where they should run.
     """
     if session.initialized:
         raise AlreadyDone("session already initialized")
-    count = 0
-    for semester in semester_list:
-        for section in semester.section_set.all():
-            if _mirror_section(session, section, debug):
-                count += 1
-    if count > 0:
-        session.initialized = True
-        session.save()
-    # TODO: even/odd corrections
-    return count
+    with transaction.atomic():
+        if corrections_from is None:
+            source = _source_sections(eligible_sections(semester_list))
+        else:
+            source = _source_sections(eligible_sections(semester_list, session))
+            fill_in = _fill_in_sections(session, source, corrections_from)
+            if debug:
+                print("filling in", len(fill_in), "sections")
+            source.update(fill_in)
+        existing = set(
+            session.draftsection_set.values_list(
+                "course_id", "verbose_name", "semester"
+            )
+        )
+        new_keys = [key for key in source if key not in existing]
+        if debug:
+            print("skipping", len(source) - len(new_keys), "existing sections")
+        if new_keys:
+            revision = session.next_revision()
+            DraftSection.objects.bulk_create(
+                [_draft_section(session, k, source[k], revision) for k in new_keys],
+                batch_size=500,
+            )
+            session.initialized = True
+            session.save()
+            cache.sections_changed(session.pk)
+    if debug:
+        print("created", len(new_keys), "sections")
+    return len(new_keys)
+
+
+def preview_from_classes_app(session, semester_list, corrections_from=None):
+    """
+    What ``from_classes_app()`` would do, with two queries: the
+    numbers of sections of ``semester_list`` in ``total``, to
+    ``create``, skipped as ``existing`` in the session, and
+    ``rejected``, as a list of ``(reason, count)`` (each section
+    counted for the first test it fails).
+    With ``corrections_from``, also the number of sections to
+    ``fill_in`` from it (one more query).
+    """
+    run_session = None if corrections_from is None else session
+    checks = _checks(run_session)
+    in_session = DraftSection.objects.filter(
+        session=session,
+        course=OuterRef("course"),
+        verbose_name=OuterRef("section_name"),
+        semester=OuterRef("term__term"),
+    )
+    # the first test each section fails ("" when it passes them all).
+    # (One conditional aggregate per test would be simpler, but
+    #   Django 2.2 mixes up their parameters.)
+    reason = Case(
+        *[When(~q, then=Value(name)) for name, label, q in checks],
+        default=Value(""),
+        output_field=models.CharField()
+    )
+    counts = dict(
+        Section.objects.filter(term__in=semester_list)
+        .annotate(reason=reason)
+        .order_by()
+        .values("reason")
+        .annotate(count=Count("pk"))
+        .values_list("reason", "count")
+    )
+    # (the Exists is kept out of the aggregate, as Django 2.2 cannot
+    #   combine the two.)
+    existing = (
+        eligible_sections(semester_list, run_session)
+        .annotate(in_session=Exists(in_session))
+        .filter(in_session=True)
+        .count()
+    )
+    result = {
+        "total": sum(counts.values()),
+        "create": counts.get("", 0) - existing,
+        "existing": existing,
+        "rejected": [(label, counts.get(name, 0)) for name, label, q in checks],
+        "fill_in": 0,
+    }
+    if corrections_from is not None:
+        offered = eligible_sections(semester_list, session).filter(
+            course=OuterRef("course"), term__term=OuterRef("term__term")
+        )
+        fill_in_qs = (
+            eligible_sections(corrections_from, session)
+            .filter(_runs_q(session, True))
+            .annotate(offered=Exists(offered), in_session=Exists(in_session))
+        )
+        result["fill_in"] = fill_in_qs.filter(offered=False, in_session=False).count()
+    return result
+
+
+def merge_from_classes_app(session, semester_list, debug=False, dry_run=False):
+    """
+    Bring the (initialized) ``session`` up to date with the section
+    data given by ``semester_list``, keeping its instructors.
+    Sections are matched by course, name and semester; in the
+    semesters of ``semester_list``, missing sections are added (or
+    reactivated), those no longer offered are deactivated, and those
+    whose timeslot changed are given the new one (sections without
+    a timeslot in the section data keep theirs).  Unchanged sections
+    are not touched.
+
+    Returns the keys, ``(course_id, name, semester)``, of the
+    ``added``, ``reactivated``, ``retimed`` and ``deactivated``
+    sections, and the number ``unchanged``; with ``dry_run``, nothing
+    is changed.
+    """
+    semester_codes = {s.term for s in semester_list}
+    with transaction.atomic():
+        # lock the session first, as for every change to its sections.
+        DraftScheduleSession.objects.select_for_update().get(pk=session.pk)
+        source = _source_sections(eligible_sections(semester_list))
+        current = {
+            (s.course_id, s.verbose_name, s.semester): s
+            for s in session.draftsection_set.filter(
+                semester__in=semester_codes
+            ).select_for_update()
+        }
+        diff = {"added": [], "reactivated": [], "retimed": [], "deactivated": []}
+        changed = []
+        for key, timeslot in source.items():
+            obj = current.get(key, None)
+            if obj is None:
+                diff["added"].append(key)
+                continue
+            updated = False
+            if not obj.active:
+                obj.active = True
+                diff["reactivated"].append(key)
+                updated = True
+            if timeslot is not None and obj.timeslot_id != timeslot.pk:
+                obj.timeslot = timeslot
+                diff["retimed"].append(key)
+                updated = True
+            if updated:
+                changed.append(obj)
+        for key, obj in current.items():
+            if obj.active and key not in source:
+                obj.active = False
+                diff["deactivated"].append(key)
+                changed.append(obj)
+        diff["unchanged"] = len(current) - len(changed)
+        if debug:
+            for name in ["added", "reactivated", "retimed", "deactivated"]:
+                print(name, len(diff[name]), "sections")
+
+        if not dry_run and (diff["added"] or changed):
+            revision = session.next_revision()
+            DraftSection.objects.bulk_create(
+                [
+                    _draft_section(session, k, source[k], revision)
+                    for k in diff["added"]
+                ],
+                batch_size=500,
+            )
+            for obj in changed:
+                obj.revision = revision
+            DraftSection.objects.bulk_update(
+                changed, ["active", "timeslot", "revision"], batch_size=500
+            )
+            cache.sections_changed(session.pk)
+    return diff
 
 
 ################################################################
@@ -122,7 +381,9 @@ def from_classes_last_year(view_cls, session, debug=False):
     semester_list = get_semester_list_2(section_qs)
     if debug:
         print("semester list", semester_list)
-    result = from_classes_app(session, semester_list, debug)
+    # last year's odd/even courses are in the wrong years.
+    corrections_from = get_semester_list_2(session.two_years_ago_actual_sections())
+    result = from_classes_app(session, semester_list, debug, corrections_from)
     if debug:
         print("result", result)
     return result
@@ -145,3 +406,36 @@ def from_classes_two_years_ago(view_cls, session, debug=False):
 
 
 ################################################################
+
+
+def merge_from_classes_current(view_cls, session, debug=False, dry_run=False):
+    """
+    As for ``merge_from_classes_app()``, from the actual course data
+    for the session's time period.
+    """
+    semester_list = get_semester_list_2(session.current_actual_sections())
+    return merge_from_classes_app(session, semester_list, debug, dry_run)
+
+
+################################################################
+
+
+def preview_from_classes_current(view_cls, session):
+    section_qs = session.current_actual_sections()
+    return preview_from_classes_app(session, get_semester_list_2(section_qs))
+
+
+def preview_from_classes_last_year(view_cls, session):
+    section_qs = session.prev_actual_sections()
+    corrections_from = get_semester_list_2(session.two_years_ago_actual_sections())
+    return preview_from_classes_app(
+        session, get_semester_list_2(section_qs), corrections_from
+    )
+
+
+def preview_from_classes_two_years_ago(view_cls, session):
+    section_qs = session.two_years_ago_actual_sections()
+    return preview_from_classes_app(session, get_semester_list_2(section_qs))
+
+
+################################################################
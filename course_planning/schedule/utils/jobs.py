@@ -0,0 +1,167 @@
+"""
+Background execution of the auto-scheduler.
+
+Jobs run in a local thread pool inside the web server process; there
+is no external broker.  The ``AutoScheduleJob`` record is the only
+shared state, so progress can be polled from any process.
+A running job updates its record as it makes progress; a job that
+has not for the ``auto_schedule:stale_seconds`` setting (e.g., as the
+server process exited while it ran) is marked failed.
+"""
+################################################################
+
+import datetime
+import json
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.db import connection
+from django.utils import timezone
+
+from ... import conf
+from ...models import AutoScheduleJob
+
+################################################################
+
+_executor = None
+_executor_lock = Lock()
+
+################################################################
+
+
+def get_executor():
+    """
+    The (lazily created) shared executor.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=conf.get("auto_schedule:workers")
+            )
+        return _executor
+
+
+################################################################
+
+
+def expire_stale_jobs(session=None):
+    """
+    Mark the queued or running jobs (of ``session``, or of every
+    session) that have made no progress for too long as failed.
+    Returns the number of jobs so marked.
+    """
+    cutoff = timezone.now() - datetime.timedelta(
+        seconds=conf.get("auto_schedule:stale_seconds")
+    )
+    qs = AutoScheduleJob.objects.filter(status__in=["q", "r"], modified__lt=cutoff)
+    if session is not None:
+        qs = qs.filter(session=session)
+    return qs.update(
+        status="f",
+        modified=timezone.now(),
+        message="No progress since {}; abandoned.".format(cutoff.isoformat()),
+    )
+
+
+def pending_job(session, dry_run=None):
+    """
+    Return the queued or running job for ``session`` (a dry run or
+    not, if ``dry_run`` is given), if any.
+    """
+    expire_stale_jobs(session)
+    qs = AutoScheduleJob.objects.filter(session=session, status__in=["q", "r"])
+    if dry_run is not None:
+        qs = qs.filter(dry_run=dry_run)
+    return qs.order_by("-created").first()
+
+
+################################################################
+
+
+def submit(session, engine="imsvm", dry_run=False, attempts=None, seed=None, **options):
+    """
+    Queue an auto-schedule run for ``session``.
+    A ``dry_run`` job only records the proposed changes.
+    ``attempts`` and ``seed`` are as for ``auto.schedule()``.
+    If there is already one pending for this session (of the same
+    kind: a dry run or not), that job is returned instead.
+    """
+    job = pending_job(session, dry_run=dry_run)
+    if job is not None:
+        return job
+    if attempts is None:
+        attempts = conf.get("auto_schedule:attempts")
+    job = AutoScheduleJob.objects.create(
+        session=session, engine=engine, dry_run=dry_run, attempts=attempts, seed=seed
+    )
+    get_executor().submit(run_job, job.pk, **options)
+    return job
+
+
+################################################################
+
+
+def run_job(job_pk, **options):
+    """
+    Run the job given by ``job_pk``, recording progress as it goes.
+    """
+    from . import auto
+
+    try:
+        job = AutoScheduleJob.objects.select_related("session").get(pk=job_pk)
+        start = time.time()
+        qs = AutoScheduleJob.objects.filter(pk=job_pk)
+        qs.update(status="r", modified=timezone.now())
+
+        # ``update()`` leaves ``modified`` alone: set it, as the sign
+        #   of life ``expire_stale_jobs()`` looks for.
+        def progress(iterations, matches):
+            qs.update(
+                iterations=iterations,
+                matches=matches,
+                elapsed=time.time() - start,
+                modified=timezone.now(),
+            )
+
+        try:
+            state, scores = auto.schedule(
+                job.session,
+                job.engine,
+                progress=progress,
+                attempts=job.attempts,
+                seed=job.seed,
+                **options
+            )
+            skipped = []
+            if job.dry_run:
+                changes = state.diff(scores)
+            else:
+                skipped = auto.flush(job.session, state)
+        except Exception:
+            qs.update(
+                status="f", elapsed=time.time() - start, message=traceback.format_exc()
+            )
+        else:
+            if job.dry_run:
+                qs.update(result=json.dumps(changes), matches=len(changes))
+            if skipped:
+                qs.update(
+                    message="Skipped {} section(s) edited during the run: {}".format(
+                        len(skipped), ", ".join(str(pk) for pk in skipped)
+                    )
+                )
+            qs.update(
+                status="d",
+                elapsed=time.time() - start,
+                seed=state.seed,
+                attempt_log=json.dumps(state.attempts),
+            )
+    finally:
+        # thread pool workers hold their own database connection.
+        connection.close()
+
+
+################################################################
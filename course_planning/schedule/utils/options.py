@@ -0,0 +1,159 @@
+"""
+Preloaded option lists for the worksheet's select2 widgets.
+
+The instructor and timeslot choices are small and rarely change, so
+rather than a (joined) ``icontains`` search for every keystroke, each
+list is loaded once into an ``OptionIndex``.  Indexes are stored in
+the worksheet cache under a version that is bumped whenever profiles,
+people or timeslots change (see ``signals``), and kept in memory by
+each process for as long as that version is current.  (Without a
+cache, changes are only noticed by the process that made them; the
+``select2_options:timeout`` bounds how stale the e-mail addresses,
+which are not watched, can get.)
+"""
+################################################################
+
+import re
+import threading
+import time
+
+from classes.models import Timeslot
+from django.db import transaction
+
+from ... import conf
+from ...models import TeachingProfile
+from .cache import _bump_version, _get_cache, _get_version
+
+################################################################
+
+VERSION_KEY = "course_planning:options:version"
+INDEX_KEY = "course_planning:options:{}:{}"
+
+# process-local indexes, by name: ``(version, expiry time, index)``.
+_local = {}
+_local_lock = threading.Lock()
+# the version used without a cache.
+_local_version = [0]
+
+################################################################
+
+
+def _tokens(text):
+    return [t for t in re.split(r"[^\w:]+", text.lower()) if t]
+
+
+class OptionIndex(object):
+    """
+    A searchable list of ``(pk, label)`` options, each with some
+    search text.
+    """
+
+    def __init__(self, rows):
+        """
+        ``rows`` are ``(pk, label, text)``, in display order.
+        """
+        self.options = []
+        self.labels = {}
+        for pk, label, text in rows:
+            text = "{} {}".format(label, text).lower()
+            self.options.append((pk, label, text, _tokens(text)))
+            self.labels[pk] = label
+
+    def label(self, pk):
+        return self.labels.get(pk, None)
+
+    def search(self, term, offset=0, limit=None):
+        """
+        The ``(pk, label)`` options matching every word of ``term``
+        (as for ``icontains``); options where each word starts a word
+        come first.  Returns ``options, more``.
+        """
+        words = _tokens(term)
+        prefix_matches = []
+        other_matches = []
+        for pk, label, text, tokens in self.options:
+            if not all(w in text for w in words):
+                continue
+            if all(any(t.startswith(w) for t in tokens) for w in words):
+                prefix_matches.append((pk, label))
+            else:
+                other_matches.append((pk, label))
+        matches = prefix_matches + other_matches
+        if limit is None:
+            return matches[offset:], False
+        return matches[offset : offset + limit], len(matches) > offset + limit
+
+
+################################################################
+
+
+def _instructor_rows():
+    profile_qs = TeachingProfile.objects.filter(active=True).select_related("person")
+    text = {}
+    for pk, cn, username, address in profile_qs.values_list(
+        "pk", "person__cn", "person__username", "person__emailaddress__address"
+    ):
+        text.setdefault(pk, {cn or "", username or ""}).add(address or "")
+    return [(p.pk, "{}".format(p), " ".join(sorted(text[p.pk]))) for p in profile_qs]
+
+
+def _timeslot_rows():
+    return [
+        (t.pk, t.display(), "{} {}".format(t.day, t.start_time))
+        for t in Timeslot.objects.filter(active=True, scheduled=True)
+    ]
+
+
+LOADERS = {"instructor": _instructor_rows, "timeslot": _timeslot_rows}
+
+################################################################
+
+
+def get_index(name):
+    """
+    The current ``OptionIndex`` for ``name`` (one of ``LOADERS``).
+    """
+    cache = _get_cache()
+    if cache is None:
+        version = _local_version[0]
+    else:
+        version = _get_version(cache, VERSION_KEY)
+    with _local_lock:
+        current = _local.get(name, None)
+    if current is not None and current[0] == version and current[1] > time.time():
+        return current[2]
+
+    index = None
+    if cache is not None:
+        index = cache.get(INDEX_KEY.format(name, version))
+    if index is None:
+        index = OptionIndex(LOADERS[name]())
+        if cache is not None:
+            cache.set(
+                INDEX_KEY.format(name, version),
+                index,
+                conf.get("select2_options:timeout"),
+            )
+    expires = time.time() + conf.get("select2_options:timeout")
+    with _local_lock:
+        _local[name] = (version, expires, index)
+    return index
+
+
+def invalidate():
+    """
+    Invalidate every option index, when the current transaction
+    commits.
+    """
+    transaction.on_commit(_invalidate)
+
+
+def _invalidate():
+    cache = _get_cache()
+    if cache is None:
+        _local_version[0] += 1
+    else:
+        _bump_version(cache, VERSION_KEY)
+
+
+################################################################
@@ -0,0 +1,137 @@
+"""
+Bulk loaded teaching preference scores.
+"""
+################################################################
+
+import numpy as np
+
+from ...models import CourseTeachingPreference, TimeslotTeachingPreference
+
+################################################################
+
+
+class PreferenceScores(object):
+    """
+    Dense course and timeslot preference score arrays.
+
+    Rows of ``course_scores`` and ``timeslot_scores`` are indexed by
+    teaching profile; columns by course and timeslot respectively.
+    Each array carries one extra trailing column of zeros which is used
+    for any course or timeslot (including ``None``) that no profile has
+    a preference for.
+    """
+
+    def __init__(
+        self, profile_ids, course_ids, timeslot_ids, course_rows, timeslot_rows
+    ):
+        """
+        ``course_rows`` and ``timeslot_rows`` are iterables of
+        ``(profile_id, object_id, score)`` triples.
+        """
+        self.profile_ids = list(profile_ids)
+        self.course_ids = list(course_ids)
+        self.timeslot_ids = list(timeslot_ids)
+        self._profile_map = {pk: i for i, pk in enumerate(self.profile_ids)}
+        self._course_map = {pk: i for i, pk in enumerate(self.course_ids)}
+        self._timeslot_map = {pk: i for i, pk in enumerate(self.timeslot_ids)}
+        self.course_scores = self._dense(course_rows, self._course_map)
+        self.timeslot_scores = self._dense(timeslot_rows, self._timeslot_map)
+
+    def _dense(self, rows, column_map):
+        result = np.zeros((len(self.profile_ids), len(column_map) + 1))
+        rows = [r for r in rows if r[0] in self._profile_map]
+        if rows:
+            profile_id_list, object_id_list, score_list = zip(*rows)
+            result[
+                self.profile_index(profile_id_list),
+                self._index(column_map, object_id_list),
+            ] = score_list
+        return result
+
+    @classmethod
+    def load(cls, profile_ids=None):
+        """
+        Load all active preferences with exactly two queries.
+        When ``profile_ids`` is not given, every active teaching profile
+        with an active preference is included.
+        """
+        course_qs = CourseTeachingPreference.objects.filter(
+            active=True, profile__active=True
+        )
+        timeslot_qs = TimeslotTeachingPreference.objects.filter(
+            active=True, profile__active=True
+        )
+        if profile_ids is not None:
+            profile_ids = list(profile_ids)
+            course_qs = course_qs.filter(profile_id__in=profile_ids)
+            timeslot_qs = timeslot_qs.filter(profile_id__in=profile_ids)
+        course_rows = list(course_qs.values_list("profile_id", "course_id", "score"))
+        timeslot_rows = list(
+            timeslot_qs.values_list("profile_id", "timeslot_id", "score")
+        )
+        if profile_ids is None:
+            profile_ids = sorted(
+                {r[0] for r in course_rows} | {r[0] for r in timeslot_rows}
+            )
+        course_ids = sorted({r[1] for r in course_rows})
+        timeslot_ids = sorted({r[1] for r in timeslot_rows})
+        return cls(profile_ids, course_ids, timeslot_ids, course_rows, timeslot_rows)
+
+    @staticmethod
+    def _index(column_map, id_list):
+        missing = len(column_map)
+        return np.array([column_map.get(pk, missing) for pk in id_list], dtype=int)
+
+    def profile_index(self, profile_ids):
+        """
+        Row indices for the given profile ids.  Unknown profiles raise
+        ``KeyError``; they should have been part of the load.
+        """
+        return np.array([self._profile_map[pk] for pk in profile_ids], dtype=int)
+
+    def course_index(self, course_ids):
+        return self._index(self._course_map, course_ids)
+
+    def timeslot_index(self, timeslot_ids):
+        return self._index(self._timeslot_map, timeslot_ids)
+
+    def extend_profiles(self, profile_ids):
+        """
+        Add zero rows for any profiles without preferences,
+        so they can still be indexed.
+        """
+        new_ids = [pk for pk in profile_ids if pk not in self._profile_map]
+        if not new_ids:
+            return
+        for pk in new_ids:
+            self._profile_map[pk] = len(self.profile_ids)
+            self.profile_ids.append(pk)
+        pad = np.zeros((len(new_ids), self.course_scores.shape[1]))
+        self.course_scores = np.vstack([self.course_scores, pad])
+        pad = np.zeros((len(new_ids), self.timeslot_scores.shape[1]))
+        self.timeslot_scores = np.vstack([self.timeslot_scores, pad])
+
+    def score_matrix(self, profile_ids, course_ids, timeslot_ids):
+        """
+        Return the pair of ``(course_score, timeslot_score)`` matrices
+        for the given profiles (rows) against the sections
+        described by ``course_ids`` and ``timeslot_ids`` (columns).
+        """
+        rows = self.profile_index(profile_ids)[:, np.newaxis]
+        c_score = self.course_scores[rows, self.course_index(course_ids)]
+        t_score = self.timeslot_scores[rows, self.timeslot_index(timeslot_ids)]
+        return c_score, t_score
+
+
+################################################################
+
+
+def combine_scores(c_score, t_score, jitter=0):
+    """
+    The scoring formula; see ``TeachingProfile.get_score``.
+    Works equally well on scalars and (broadcastable) arrays.
+    """
+    return c_score * (t_score * c_score + jitter)
+
+
+################################################################
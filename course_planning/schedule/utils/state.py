@@ -0,0 +1,439 @@
+"""
+In-memory scheduling state for the auto-scheduler.
+"""
+################################################################
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from ...models import (
+    DraftScheduleSession,
+    DraftSection,
+    SemesterTeachingPreference,
+    TeachingProfile,
+)
+from ...utils.timeslots import TimeslotIndex
+from .scores import combine_scores
+
+################################################################
+
+SEMESTER_LIST = [e[0] for e in SemesterTeachingPreference.SEMESTER_CHOICES]
+
+# sentinel for a missing timeslot or instructor in the integer arrays.
+NONE = -1
+
+
+def _pk(value):
+    return None if value == NONE else int(value)
+
+
+################################################################
+
+
+class ScheduleState(object):
+    """
+    A compact snapshot of everything the auto-scheduler needs for
+    one session: the active sections, the active teaching profiles with
+    their remaining total and term loads, and which timeslots each
+    instructor already occupies.
+
+    Load it once with ``ScheduleState.load(session)``, update it with
+    ``assign()``, and write the changes back with ``flush()``.
+
+    Section arrays (indexed by section position):
+        ``section_pk``, ``section_course``, ``section_timeslot``,
+        ``section_semester`` (index into ``SEMESTER_LIST``),
+        ``section_instructor`` (a TeachingProfile pk, or ``NONE``).
+    Timeslots:
+        ``timeslots`` (a ``TimeslotIndex``) and ``timeslot_pk``
+        (the active and scheduled timeslots, except Online).
+    Profile arrays (indexed by profile position):
+        ``profile_pk``, ``agreed_load``, ``term_load`` (profile x semester),
+        ``remaining_load``, ``remaining_term_load``,
+        ``preference_same_day``, ``preference_no_back_to_back``.
+    Auto-scheduling:
+        ``seed`` (the random seed that produced the current assignments,
+        if any) and ``attempts`` (the ``evaluate()`` results of every
+        attempt, with their ``seed``).
+    Writing back:
+        ``revision`` (the session revision when loaded, if any) and
+        ``skipped`` (the pks of the sections the last ``flush()`` left
+        alone, as they had been edited since).
+    """
+
+    def __init__(
+        self, section_rows, profile_rows, semester_rows, timeslots, online_pk=None
+    ):
+        """
+        ``section_rows`` are ``(pk, course_id, timeslot_id, semester,
+        instructor_id)`` tuples;
+        ``profile_rows`` are ``(pk, agreed_load, preference_same_day,
+        preference_no_back_to_back)`` tuples;
+        ``semester_rows`` are ``(profile_id, semester, preferred_load)``
+        tuples;
+        ``timeslots`` is a ``TimeslotIndex`` of the active, scheduled
+        timeslots.
+        """
+        self.online_pk = online_pk
+        self.seed = None
+        self.attempts = []
+        self.revision = None
+        self.skipped = []
+        self.timeslots = timeslots
+        self.timeslot_pk = timeslots.pk
+        self._semester_map = {code: i for i, code in enumerate(SEMESTER_LIST)}
+        section_rows = [r for r in section_rows if r[3] in self._semester_map]
+        self.section_pk = np.array([r[0] for r in section_rows], dtype=int)
+        self.section_course = np.array([r[1] for r in section_rows], dtype=int)
+        self.section_timeslot = np.array(
+            [NONE if r[2] is None else r[2] for r in section_rows], dtype=int
+        )
+        self.section_semester = np.array(
+            [self._semester_map[r[3]] for r in section_rows], dtype=int
+        )
+        self.section_instructor = np.array(
+            [NONE if r[4] is None else r[4] for r in section_rows], dtype=int
+        )
+        self.original_instructor = self.section_instructor.copy()
+
+        p = len(profile_rows)
+        self.profile_pk = np.array([r[0] for r in profile_rows], dtype=int)
+        self._profile_map = {pk: i for i, pk in enumerate(self.profile_pk.tolist())}
+        self.agreed_load = np.array([r[1] for r in profile_rows], dtype=float)
+        self.preference_same_day = np.array([r[2] for r in profile_rows], dtype=bool)
+        self.preference_no_back_to_back = np.array(
+            [r[3] for r in profile_rows], dtype=bool
+        )
+        self.term_load = np.zeros((p, len(SEMESTER_LIST)))
+        self.term_preference = np.zeros((p, len(SEMESTER_LIST)), dtype=bool)
+        for profile_id, semester, preferred_load in semester_rows:
+            if profile_id in self._profile_map and semester in self._semester_map:
+                idx = (self._profile_map[profile_id], self._semester_map[semester])
+                self.term_load[idx] = preferred_load
+                self.term_preference[idx] = True
+        self._recount_loads()
+
+    @classmethod
+    def load(cls, session):
+        """
+        Load the state for ``session`` with a fixed number of queries.
+        """
+        # before the sections, so any change made meanwhile is newer.
+        revision = (
+            DraftScheduleSession.objects.filter(pk=session.pk)
+            .values_list("revision", flat=True)
+            .get()
+        )
+        section_rows = list(
+            session.draftsection_set.filter(active=True).values_list(
+                "pk", "course_id", "timeslot_id", "semester", "instructor_id"
+            )
+        )
+        profile_rows = list(
+            TeachingProfile.objects.filter(active=True).values_list(
+                "pk", "agreed_load", "preference_same_day", "preference_no_back_to_back"
+            )
+        )
+        semester_rows = list(
+            SemesterTeachingPreference.objects.filter(
+                active=True, profile__active=True
+            ).values_list("profile_id", "semester", "preferred_load")
+        )
+        timeslots = TimeslotIndex.load()
+        state = cls(
+            section_rows,
+            profile_rows,
+            semester_rows,
+            timeslots,
+            online_pk=timeslots.online_pk,
+        )
+        state.revision = revision
+        return state
+
+    ############################################################
+
+    def _recount_loads(self):
+        """
+        Full recount of the remaining loads from the section arrays.
+        """
+        p = len(self.profile_pk)
+        assigned = self.profile_index(self.section_instructor)
+        mask = assigned != NONE
+        self.remaining_load = self.agreed_load - np.bincount(
+            assigned[mask], minlength=p
+        )
+        self.remaining_term_load = self.term_load.copy()
+        np.subtract.at(
+            self.remaining_term_load,
+            (assigned[mask], self.section_semester[mask]),
+            1,
+        )
+
+    def semester_index(self, semester):
+        return self._semester_map[semester]
+
+    def profile_index(self, profile_ids):
+        """
+        Map TeachingProfile pks to profile positions; anything
+        that is not an active profile maps to ``NONE``.
+        """
+        get = self._profile_map.get
+        return np.array(
+            [get(pk, NONE) for pk in np.asarray(profile_ids).tolist()], dtype=int
+        ).reshape(np.shape(profile_ids))
+
+    def section_index(self, section_ids):
+        lookup = {pk: i for i, pk in enumerate(self.section_pk.tolist())}
+        return np.array([lookup[pk] for pk in section_ids], dtype=int)
+
+    ############################################################
+
+    def unassigned(self, semester=None):
+        """
+        Indices of the sections without an instructor,
+        optionally only for the given ``semester`` code.
+        """
+        mask = self.section_instructor == NONE
+        if semester is not None:
+            mask &= self.section_semester == self.semester_index(semester)
+        return np.nonzero(mask)[0]
+
+    def available_profiles(self):
+        """
+        Indices of the profiles that have not reached their total load.
+        """
+        return np.nonzero(self.remaining_load > 0)[0]
+
+    def occupied_mask(self, semester, profiles, sections):
+        """
+        Boolean (profiles x sections) matrix which is ``True`` when
+        the profile already teaches in the section's timeslot this
+        ``semester``.
+        """
+        sem = self.semester_index(semester)
+        assigned = (
+            (self.section_instructor != NONE)
+            & (self.section_timeslot != NONE)
+            & (self.section_semester == sem)
+        )
+        width = max(int(self.section_timeslot.max(initial=0)), 0) + 2
+        occupied_keys = (
+            self.profile_index(self.section_instructor[assigned]) * width
+            + self.section_timeslot[assigned]
+        )
+        rows = np.asarray(profiles, dtype=int).reshape(-1, 1)
+        timeslots = self.section_timeslot[sections].reshape(1, -1)
+        return np.isin(rows * width + timeslots, occupied_keys) & (timeslots != NONE)
+
+    def timeslot_occupancy(self, semester, profiles):
+        """
+        Boolean (profiles x ``timeslots``) matrix of the timeslots
+        each profile teaches in this ``semester``;
+        see ``TimeslotIndex.occupancy()``.
+        """
+        sem = self.semester_index(semester)
+        assigned = (self.section_instructor != NONE) & (self.section_semester == sem)
+        rows = self.profile_index(self.section_instructor[assigned])
+        cols = self.timeslots.index(self.section_timeslot[assigned].tolist())
+        valid = (rows != NONE) & (cols >= 0)
+        result = np.zeros((len(self.profile_pk), len(self.timeslot_pk)), dtype=bool)
+        result[rows[valid], cols[valid]] = True
+        return result[np.asarray(profiles, dtype=int)]
+
+    ############################################################
+
+    def assign(self, section_idx, profile_idx):
+        """
+        Assign the profile (by position) to the section (by position),
+        or clear the section when ``profile_idx`` is ``NONE``.
+        """
+        sem = self.section_semester[section_idx]
+        old = self._profile_map.get(int(self.section_instructor[section_idx]), NONE)
+        if old != NONE:
+            self.remaining_load[old] += 1
+            self.remaining_term_load[old, sem] += 1
+        if profile_idx == NONE:
+            self.section_instructor[section_idx] = NONE
+            return
+        self.section_instructor[section_idx] = self.profile_pk[profile_idx]
+        self.remaining_load[profile_idx] -= 1
+        self.remaining_term_load[profile_idx, sem] -= 1
+
+    def changed(self):
+        """
+        Indices of the sections whose instructor differs from the
+        database.
+        """
+        return np.nonzero(self.section_instructor != self.original_instructor)[0]
+
+    def section_scores(self, scores, sections):
+        """
+        The (jitter free) preference score of each given section
+        (by position) for its current instructor;
+        ``scores`` is a ``PreferenceScores`` instance.
+        Unassigned sections score ``0``.
+        """
+        sections = np.asarray(sections, dtype=int)
+        result = np.zeros(len(sections))
+        instructors = self.section_instructor[sections]
+        mask = instructors != NONE
+        if mask.any():
+            profile_ids = instructors[mask].tolist()
+            scores.extend_profiles(profile_ids)
+            rows = scores.profile_index(profile_ids)
+            c_score = scores.course_scores[
+                rows, scores.course_index(self.section_course[sections][mask].tolist())
+            ]
+            t_score = scores.timeslot_scores[
+                rows,
+                scores.timeslot_index(self.section_timeslot[sections][mask].tolist()),
+            ]
+            result[mask] = combine_scores(c_score, t_score)
+        return result
+
+    def diff(self, scores):
+        """
+        The proposed changes, as a list of dictionaries with
+        ``section_id``, ``old_instructor_id``, ``new_instructor_id``
+        and ``score`` keys.
+        """
+        changed = self.changed()
+        section_scores = self.section_scores(scores, changed)
+        return [
+            {
+                "section_id": int(self.section_pk[i]),
+                "old_instructor_id": _pk(self.original_instructor[i]),
+                "new_instructor_id": _pk(self.section_instructor[i]),
+                "score": float(score),
+            }
+            for i, score in zip(changed, section_scores)
+        ]
+
+    def evaluate(self, scores):
+        """
+        Summarize the quality of the current assignments:
+        ``score`` (the total preference score of every assigned section),
+        ``unfilled`` (the number of sections without an instructor) and
+        ``load_violations`` (the number of total and term loads exceeded;
+        term loads as flagged on the worksheet).
+        """
+        assigned = np.nonzero(self.section_instructor != NONE)[0]
+        over_total = self.remaining_load < 0
+        over_term = (self.remaining_term_load < -0.5) & self.term_preference
+        return {
+            "score": float(self.section_scores(scores, assigned).sum()),
+            "unfilled": int(self.unassigned().size),
+            "load_violations": int(over_total.sum() + over_term.sum()),
+        }
+
+    def flush(self, session=None):
+        """
+        Write all changed instructors back with a single ``bulk_update``.
+        With the ``session``, the session and the sections are locked
+        first (as for ``auto.apply_changes()``), any section edited
+        since the state was loaded (its instructor or revision changed)
+        is skipped (see ``skipped``), and the rest are stamped with the
+        session's next revision.
+        Returns the number of sections changed.
+        """
+        changed = self.changed()
+        self.skipped = []
+        if changed.size == 0:
+            return 0
+        now = timezone.now()
+        with transaction.atomic():
+            if session is not None:
+                DraftScheduleSession.objects.select_for_update().get(pk=session.pk)
+                current = {
+                    r[0]: r[1:]
+                    for r in DraftSection.objects.select_for_update()
+                    .filter(
+                        session=session,
+                        active=True,
+                        pk__in=self.section_pk[changed].tolist(),
+                    )
+                    .values_list("pk", "instructor_id", "revision")
+                }
+                unchanged = [
+                    i
+                    for i in changed
+                    if self._is_unchanged(i, current.get(int(self.section_pk[i])))
+                ]
+                self.skipped = sorted(
+                    set(self.section_pk[changed].tolist())
+                    - set(self.section_pk[unchanged].tolist())
+                )
+                changed = np.array(unchanged, dtype=int)
+                if changed.size == 0:
+                    return 0
+            objs = [
+                DraftSection(
+                    pk=int(self.section_pk[i]),
+                    instructor_id=_pk(self.section_instructor[i]),
+                    modified=now,
+                )
+                for i in changed
+            ]
+            fields = ["instructor", "modified"]
+            if session is not None:
+                revision = session.next_revision()
+                for obj in objs:
+                    obj.revision = revision
+                fields.append("revision")
+            DraftSection.objects.bulk_update(objs, fields)
+        self.original_instructor[changed] = self.section_instructor[changed]
+        return len(objs)
+
+    def _is_unchanged(self, section_idx, current):
+        """
+        Is the database's ``(instructor_id, revision)`` of the section
+        (by position) still as loaded?
+        """
+        if current is None:
+            return False
+        instructor_id, revision = current
+        if instructor_id != _pk(self.original_instructor[section_idx]):
+            return False
+        return self.revision is None or revision <= self.revision
+
+    ############################################################
+
+    def instructor_data(self):
+        """
+        The per-instructor dictionary view of this state, for profiles
+        with load remaining.  Term information is only given for the
+        semesters the instructor has a preference for.
+        """
+        results = {}
+        for idx in self.available_profiles():
+            pk = int(self.profile_pk[idx])
+            semesters = [
+                (code, i)
+                for code, i in self._semester_map.items()
+                if self.term_preference[idx, i]
+            ]
+            mine = (self.section_instructor == pk) & (self.section_timeslot != NONE)
+            results[pk] = {
+                "pk": pk,
+                "agreed_load": self.agreed_load[idx],
+                "preference_same_day": bool(self.preference_same_day[idx]),
+                "preference_no_back_to_back": bool(
+                    self.preference_no_back_to_back[idx]
+                ),
+                "term_load": {c: self.term_load[idx, i] for c, i in semesters},
+                "remaining_load": self.remaining_load[idx],
+                "remaining_term_load": {
+                    c: self.remaining_term_load[idx, i] for c, i in semesters
+                },
+                "occupied_timeslots": {
+                    c: self.section_timeslot[
+                        mine & (self.section_semester == i)
+                    ].tolist()
+                    for c, i in semesters
+                },
+            }
+        return results
+
+
+################################################################
@@ -0,0 +1,264 @@
+"""
+Synthetic departments for benchmarking the auto-scheduler.
+
+``synthetic_department()`` builds the data directly as the rows
+``ScheduleState`` and ``PreferenceScores`` are loaded from, so no
+database (or production data) is needed.  ``create_department()``
+writes the same data to the database instead (a test database, or a
+transaction that is rolled back), to measure the loads as well.
+"""
+################################################################
+
+import datetime
+
+import numpy as np
+from classes.models import Course, Department, Timeslot
+from people.models import Person
+
+from ...models import (
+    CourseTeachingPreference,
+    DraftScheduleSession,
+    DraftSection,
+    SemesterTeachingPreference,
+    TeachingProfile,
+    TimeslotTeachingPreference,
+)
+from ...utils.timeslots import TimeslotIndex
+from .scores import PreferenceScores
+from .state import SEMESTER_LIST, ScheduleState
+
+################################################################
+
+ONLINE_PK = 1000
+
+################################################################
+
+
+def synthetic_timeslot_rows():
+    """
+    A typical week: MWF 50 minute and TR 75 minute day slots,
+    and one evening slot per weekday.
+    Rows are ``(pk, day, start_time, stop_time)``.
+    """
+    rows = []
+
+    def _add(day, hour, minute, length):
+        start = datetime.datetime(2000, 1, 1, hour, minute)
+        stop = start + datetime.timedelta(minutes=length)
+        rows.append((len(rows) + 1, day, start.time(), stop.time()))
+
+    for hour in range(8, 17):
+        _add("MWF", hour, 30, 50)
+    for hour, minute in [(8, 30), (10, 0), (11, 30), (13, 0), (14, 30), (16, 0)]:
+        _add("TR", hour, minute, 75)
+    for day in "MTWR":
+        _add(day, 18, 0, 170)
+    return rows
+
+
+################################################################
+
+
+def _synthetic_rows(n_sections, seed, assigned, online):
+    """
+    The rows of a synthetic department, as loaded by
+    ``ScheduleState`` and ``PreferenceScores``; see
+    ``synthetic_department()``.
+    """
+    rng = np.random.RandomState(seed)
+    timeslot_rows = synthetic_timeslot_rows()
+    timeslot_ids = [r[0] for r in timeslot_rows]
+    n_courses = max(n_sections // 2, 1)
+    n_profiles = max(int(np.ceil(n_sections * 1.1 / 5)), 1)
+    course_ids = list(range(1, n_courses + 1))
+    profile_ids = list(range(1, n_profiles + 1))
+
+    profile_rows = []
+    semester_rows = []
+    for pk in profile_ids:
+        load = int(rng.randint(4, 7))
+        profile_rows.append(
+            (pk, load, rng.random_sample() < 0.2, rng.random_sample() < 0.3)
+        )
+        split = rng.dirichlet(np.ones(len(SEMESTER_LIST))) * load
+        for code, preferred in zip(SEMESTER_LIST, split):
+            semester_rows.append((pk, code, round(float(preferred) * 2) / 2))
+
+    course_rows = []
+    timeslot_pref_rows = []
+    for pk in profile_ids:
+        n_prefs = min(int(rng.randint(5, 20)), n_courses)
+        for course_id in rng.choice(course_ids, n_prefs, replace=False).tolist():
+            course_rows.append((pk, course_id, int(rng.randint(1, 10))))
+        for timeslot_id in timeslot_ids:
+            timeslot_pref_rows.append((pk, timeslot_id, int(rng.randint(0, 10))))
+
+    section_rows = []
+    for pk in range(1, n_sections + 1):
+        timeslot_id = int(rng.choice(timeslot_ids))
+        if rng.random_sample() < online:
+            timeslot_id = ONLINE_PK
+        instructor_id = None
+        if rng.random_sample() < assigned:
+            instructor_id = int(rng.choice(profile_ids))
+        section_rows.append(
+            (
+                pk,
+                int(rng.choice(course_ids)),
+                timeslot_id,
+                SEMESTER_LIST[rng.randint(len(SEMESTER_LIST))],
+                instructor_id,
+            )
+        )
+
+    return {
+        "timeslot_rows": timeslot_rows,
+        "course_ids": course_ids,
+        "profile_rows": profile_rows,
+        "semester_rows": semester_rows,
+        "course_rows": course_rows,
+        "timeslot_pref_rows": timeslot_pref_rows,
+        "section_rows": section_rows,
+    }
+
+
+def synthetic_department(n_sections, seed=None, assigned=0.2, online=0.05):
+    """
+    Return a ``(state, scores)`` pair for a department with
+    ``n_sections`` active sections, split over the semesters.
+    About ``assigned`` of the sections already have an instructor,
+    and ``online`` of them are online.
+
+    Instructors teach 4-6 sections, and have (sparse) course
+    preferences concentrated on a few courses each, as well as
+    timeslot preferences and the occasional same day or back to back
+    preference.
+    """
+    rows = _synthetic_rows(n_sections, seed, assigned, online)
+    state = ScheduleState(
+        rows["section_rows"],
+        rows["profile_rows"],
+        rows["semester_rows"],
+        TimeslotIndex(rows["timeslot_rows"]),
+        online_pk=ONLINE_PK,
+    )
+    scores = PreferenceScores(
+        [r[0] for r in rows["profile_rows"]],
+        sorted({r[1] for r in rows["course_rows"]}),
+        [r[0] for r in rows["timeslot_rows"]],
+        rows["course_rows"],
+        rows["timeslot_pref_rows"],
+    )
+    return state, scores
+
+
+################################################################
+
+
+def create_department(n_sections, seed=None, assigned=0.2, online=0.05):
+    """
+    Write a synthetic department (as for ``synthetic_department()``)
+    to the database: a new session with its sections, and the courses,
+    timeslots, people and teaching profiles (with preferences) they
+    need.  Returns the session.
+    """
+    rows = _synthetic_rows(n_sections, seed, assigned, online)
+    session = DraftScheduleSession.objects.create(
+        verbose_name="Synthetic Session {}".format(n_sections),
+        start_date=datetime.date(2019, 9, 1),
+        end_date=datetime.date(2020, 4, 30),
+    )
+    prefix = "synthetic-{}-".format(session.pk)
+
+    department = Department.objects.create(code="SYN", name=prefix + "department")
+    Course.objects.bulk_create(
+        [
+            Course(department=department, code=str(pk), name=prefix + str(pk))
+            for pk in rows["course_ids"]
+        ]
+    )
+    course_map = {
+        int(code): pk
+        for code, pk in Course.objects.filter(department=department).values_list(
+            "code", "pk"
+        )
+    }
+
+    timeslot_map = {ONLINE_PK: Timeslot.objects.Online().pk}
+    for pk, day, start_time, stop_time in rows["timeslot_rows"]:
+        timeslot_map[pk] = Timeslot.objects.create(
+            day=day, start_time=start_time, stop_time=stop_time
+        ).pk
+
+    Person.objects.bulk_create(
+        [
+            Person(username=prefix + str(r[0]), cn="Synthetic Person {}".format(r[0]))
+            for r in rows["profile_rows"]
+        ]
+    )
+    person_map = dict(
+        Person.objects.filter(username__startswith=prefix).values_list("username", "pk")
+    )
+    TeachingProfile.objects.bulk_create(
+        [
+            TeachingProfile(
+                person_id=person_map[prefix + str(pk)],
+                agreed_load=load,
+                preference_same_day=same_day,
+                preference_no_back_to_back=no_back_to_back,
+            )
+            for pk, load, same_day, no_back_to_back in rows["profile_rows"]
+        ]
+    )
+    profile_map = {
+        int(username[len(prefix) :]): pk
+        for pk, username in TeachingProfile.objects.filter(
+            person__username__startswith=prefix
+        ).values_list("pk", "person__username")
+    }
+
+    SemesterTeachingPreference.objects.bulk_create(
+        [
+            SemesterTeachingPreference(
+                profile_id=profile_map[pk], semester=code, preferred_load=preferred
+            )
+            for pk, code, preferred in rows["semester_rows"]
+        ]
+    )
+    CourseTeachingPreference.objects.bulk_create(
+        [
+            CourseTeachingPreference(
+                profile_id=profile_map[pk], course_id=course_map[course_id], score=score
+            )
+            for pk, course_id, score in rows["course_rows"]
+        ]
+    )
+    TimeslotTeachingPreference.objects.bulk_create(
+        [
+            TimeslotTeachingPreference(
+                profile_id=profile_map[pk],
+                timeslot_id=timeslot_map[timeslot_id],
+                score=score,
+            )
+            for pk, timeslot_id, score in rows["timeslot_pref_rows"]
+        ]
+    )
+    DraftSection.objects.bulk_create(
+        [
+            DraftSection(
+                session=session,
+                course_id=course_map[course_id],
+                verbose_name="S{:04}".format(pk),
+                semester=semester,
+                timeslot_id=timeslot_map[timeslot_id],
+                instructor_id=profile_map.get(instructor_id, None),
+            )
+            for pk, course_id, timeslot_id, semester, instructor_id in rows[
+                "section_rows"
+            ]
+        ]
+    )
+    return session
+
+
+################################################################
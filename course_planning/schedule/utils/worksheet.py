@@ -0,0 +1,302 @@
+"""
+Bulk computation of the scheduling worksheet's data and per-section
+extras.
+"""
+################################################################
+
+from collections import Counter, defaultdict
+
+from classes.models import Course, Timeslot
+from django.db.models import Exists, OuterRef, Q
+
+from ...models import (
+    CourseTeachingPreference,
+    DraftSection,
+    SemesterTeachingPreference,
+    TeachingProfile,
+    TimeslotTeachingPreference,
+)
+from ...utils.timeslots import TimeslotIndex
+from .scores import combine_scores
+
+################################################################
+
+
+class WorksheetSnapshot(object):
+    """
+    An in-memory snapshot of one session, for computing the score,
+    notes and remaining loads of many worksheet rows with a fixed
+    number of queries.  It can be kept up to date with
+    ``update_sections()``, and pickled; see ``cache``.
+
+    The results match ``TeachingProfile.get_score`` and
+    ``session_summary`` (``get_remaining_loads``, ``has_back_to_back``,
+    ``has_different_days`` and ``get_timeslot_conflicts``).
+    """
+
+    SECTION_FIELDS = ("pk", "course_id", "timeslot_id", "semester", "instructor_id")
+
+    def __init__(self, session, timeslot_index=None):
+        self.session_pk = session.pk
+        self.sections = {}
+        # section pks by instructor and by timeslot.
+        self.by_instructor = defaultdict(set)
+        self.by_timeslot = defaultdict(set)
+        section_rows = session.draftsection_set.filter(active=True).values_list(
+            *self.SECTION_FIELDS
+        )
+        for row in section_rows:
+            self._add(row)
+        # every active profile, so sections can be (re)assigned to them
+        #   without reloading.
+        profile_q = Q(active=True) | Q(pk__in=list(self.by_instructor))
+        self.profiles = {
+            r[0]: r
+            for r in TeachingProfile.objects.filter(profile_q).values_list(
+                "pk", "agreed_load", "preference_same_day", "preference_no_back_to_back"
+            )
+        }
+        profile_ids = list(self.profiles)
+        # (semester, preferred_load) pairs by profile
+        self.term_loads = defaultdict(list)
+        semester_qs = SemesterTeachingPreference.objects.filter(
+            active=True, profile_id__in=profile_ids
+        )
+        for profile_id, semester, preferred_load in semester_qs.values_list(
+            "profile_id", "semester", "preferred_load"
+        ):
+            self.term_loads[profile_id].append((semester, preferred_load))
+        self.course_scores = {
+            (r[0], r[1]): r[2]
+            for r in CourseTeachingPreference.objects.filter(
+                profile_id__in=profile_ids
+            ).values_list("profile_id", "course_id", "score")
+        }
+        self.timeslot_scores = {
+            (r[0], r[1]): r[2]
+            for r in TimeslotTeachingPreference.objects.filter(
+                profile_id__in=profile_ids
+            ).values_list("profile_id", "timeslot_id", "score")
+        }
+        if timeslot_index is None:
+            timeslot_index = TimeslotIndex.load()
+        self.timeslots = timeslot_index
+
+    def _add(self, row):
+        pk, course_id, timeslot_id, semester, instructor_id = row
+        self.sections[pk] = row
+        if instructor_id is not None:
+            self.by_instructor[instructor_id].add(pk)
+        if timeslot_id is not None:
+            self.by_timeslot[timeslot_id].add(pk)
+
+    def _remove(self, pk):
+        row = self.sections.pop(pk, None)
+        if row is None:
+            return
+        self.by_instructor[row[4]].discard(pk)
+        self.by_timeslot[row[2]].discard(pk)
+
+    def update_sections(self, section_pks):
+        """
+        Reload the given sections (one query), e.g., after they have
+        been saved or deleted.
+        Returns ``False`` when the snapshot can no longer be kept
+        up to date this way (a section was given an instructor that
+        it knows nothing about), and it should be rebuilt instead.
+        """
+        section_pks = list(section_pks)
+        rows = DraftSection.objects.filter(
+            pk__in=section_pks, session_id=self.session_pk, active=True
+        ).values_list(*self.SECTION_FIELDS)
+        for pk in section_pks:
+            self._remove(pk)
+        for row in rows:
+            if row[4] is not None and row[4] not in self.profiles:
+                return False
+            self._add(row)
+        return True
+
+    def related_sections(self, instructor_ids=(), timeslot_ids=()):
+        """
+        The set of section pks taught by any of the instructors,
+        or in any of the timeslots.
+        """
+        result = set()
+        for pk in instructor_ids:
+            result |= self.by_instructor.get(pk, set())
+        for pk in timeslot_ids:
+            result |= self.by_timeslot.get(pk, set())
+        return result
+
+    def _teaching(self, profile_id, semester):
+        # the timeslot ids of the instructor's sections this semester.
+        return [
+            self.sections[pk][2]
+            for pk in self.by_instructor[profile_id]
+            if self.sections[pk][3] == semester
+        ]
+
+    ############################################################
+
+    def get_score(self, profile_id, course_id, timeslot_id):
+        return combine_scores(
+            self.course_scores.get((profile_id, course_id), 0),
+            self.timeslot_scores.get((profile_id, timeslot_id), 0),
+        )
+
+    def get_remaining_loads(self, profile_id):
+        """
+        As for ``TeachingProfile.get_remaining_loads``.
+        """
+        counts = defaultdict(int)
+        for pk in self.by_instructor[profile_id]:
+            counts[self.sections[pk][3]] += 1
+        total_load = self.profiles[profile_id][1] - sum(counts.values())
+        term_data = {
+            semester: preferred_load - counts.get(semester, 0)
+            for semester, preferred_load in self.term_loads[profile_id]
+        }
+        code_display = dict(SemesterTeachingPreference.SEMESTER_CHOICES)
+        term_data["display"] = " / ".join(
+            [
+                "{}:{:.1f}".format(code_display[c][0], term_data[c])
+                for c, _ in self.term_loads[profile_id]
+            ]
+        )
+        return total_load, term_data
+
+    def get_timeslot_conflicts(self, profile_id, semester):
+        """
+        As for ``TeachingProfile.get_timeslot_conflicts``.
+        """
+        counts = Counter(
+            t for t in self._teaching(profile_id, semester) if t is not None
+        )
+        return sorted(
+            t for t, n in counts.items() if n > 1 and t != self.timeslots.online_pk
+        )
+
+    def get_notes(self, profile_id, semester):
+        """
+        Returns ``notes, timeslot_conflicts, total_load, term_loads``.
+        """
+        pk, agreed_load, same_day, no_back_to_back = self.profiles[profile_id]
+        total_load, term_loads = self.get_remaining_loads(profile_id)
+        semester_load = term_loads.get(semester, 0)
+        timeslot_ids = self._teaching(profile_id, semester)
+        timeslot_conflicts = self.get_timeslot_conflicts(profile_id, semester)
+        notes = ""
+        if timeslot_conflicts:
+            notes += "Timeslot conflict. "
+        if total_load < 0:
+            notes += "Over total load. "
+        if semester_load < -0.5:
+            notes += "Over term load. "
+        if no_back_to_back and self.timeslots.has_adjacent(timeslot_ids):
+            notes += "Back to back. "
+        if same_day and self.timeslots.has_different_days(timeslot_ids):
+            notes += "Has different days. "
+        return notes, timeslot_conflicts, total_load, term_loads
+
+    ############################################################
+
+    def section_data(self, section_pk):
+        """
+        The worksheet extras for one (active) section of the session.
+        """
+        pk, course_id, timeslot_id, semester, instructor_id = self.sections[section_pk]
+        data = {
+            "status": True,
+            "message": "",
+            "score": "",
+            "notes": "",
+            "section_id": pk,
+            "timeslot_conflicts": None,
+            "additional_sections": [],
+            "remaining_load": None,
+            "remaining_term_loads": None,
+            "instructor_id": None,
+        }
+        if instructor_id is not None:
+            if timeslot_id is not None:
+                data["score"] = self.get_score(instructor_id, course_id, timeslot_id)
+            n, tc, rl, tl = self.get_notes(instructor_id, semester)
+            data["instructor_id"] = instructor_id
+            data["notes"] = n
+            data["timeslot_conflicts"] = tc
+            data["remaining_load"] = rl
+            data["remaining_term_loads"] = tl.get("display", None)
+        return data
+
+    def sections_data(self, section_pks=None):
+        """
+        The extras for the given sections (default: all of them);
+        unknown or inactive sections are skipped.
+        """
+        if section_pks is None:
+            section_pks = sorted(self.sections)
+        return [self.section_data(pk) for pk in section_pks if pk in self.sections]
+
+
+################################################################
+
+
+SECTION_DATA_FIELDS = (
+    "pk",
+    "course_id",
+    "verbose_name",
+    "semester",
+    "instructor_id",
+    "timeslot_id",
+    "revision",
+)
+
+
+def worksheet_data(session):
+    """
+    Everything the compact worksheet renders, in a handful of queries:
+    the active sections (as lists of ``SECTION_DATA_FIELDS``), with
+    their courses (whether they have any teaching preferences), and
+    the instructor and timeslot choices, as ``[pk, label]`` lists.
+    The extras and loads are loaded separately (see ``cache``).
+    """
+    sections = list(
+        session.draftsection_set.filter(active=True)
+        .order_by("-semester", "course", "verbose_name")
+        .values_list(*SECTION_DATA_FIELDS)
+    )
+    course_qs = (
+        Course.objects.filter(pk__in={s[1] for s in sections})
+        .select_related("department")
+        .annotate(
+            has_preferences=Exists(
+                CourseTeachingPreference.objects.filter(course=OuterRef("pk"))
+            )
+        )
+    )
+    courses = [
+        [c.pk, "{}".format(c.label), c.name, c.slug, c.has_preferences]
+        for c in course_qs
+    ]
+    profile_qs = TeachingProfile.objects.filter(
+        Q(active=True) | Q(pk__in={s[4] for s in sections if s[4] is not None})
+    ).select_related("person")
+    instructors = [[p.pk, "{}".format(p), p.active] for p in profile_qs]
+    timeslot_qs = Timeslot.objects.filter(
+        Q(active=True, scheduled=True)
+        | Q(pk__in={s[5] for s in sections if s[5] is not None})
+    )
+    timeslots = [[t.pk, t.display()] for t in timeslot_qs]
+    return {
+        "revision": session.revision,
+        "section_fields": SECTION_DATA_FIELDS,
+        "sections": sections,
+        "courses": courses,
+        "instructors": instructors,
+        "timeslots": timeslots,
+        "semesters": SemesterTeachingPreference.SEMESTER_CHOICES,
+    }
+
+
+################################################################
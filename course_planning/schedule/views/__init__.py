@@ -4,19 +4,28 @@ Schedule related views
 ###############################################################
 
 from classes.models import Course
+from django.contrib import messages
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.views.generic import RedirectView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import UpdateView
 
+from ... import conf
 from ...mixins.cbv_admin import AdminFormMixin, AdminSiteViewMixin
 from ...mixins.formset import UpdateViewWithFormset
-from ...models import DraftScheduleSession, TeachingProfile
+from ...models import (
+    AutoScheduleJob,
+    DraftScheduleSession,
+    DraftSection,
+    TeachingProfile,
+)
 from ...utils import preference_by_course
 from ..forms import get_draftsection_formset
-from ..utils import auto, initialize
+from ..utils import auto, initialize, jobs
 
 ###############################################################
 
@@ -54,16 +63,67 @@ class AdminScheduleView(
 
     def get_formset_kwargs(self, *args, **kwargs):
         kwargs = super().get_formset_kwargs(*args, **kwargs)
-        kwargs["queryset"] = self.object.draftsection_set.filter(active=True).order_by(
-            "-semester", "course", "verbose_name"
+        kwargs["queryset"] = (
+            self.object.draftsection_set.filter(active=True)
+            .worksheet()
+            .order_by("-semester", "course", "verbose_name")
         )
         return kwargs
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        context["teachingprofile_list"] = TeachingProfile.objects.filter(
-            active=True
-        ).order_by("person")
+        context["teachingprofile_list"] = (
+            TeachingProfile.objects.filter(active=True)
+            .select_related("person")
+            .order_by("person")
+        )
+        context["poll_seconds"] = conf.get("worksheet:poll_seconds")
+        context["long_poll_seconds"] = conf.get("worksheet:long_poll_seconds")
+        return context
+
+    def form_valid(self, form, formset):
+        with transaction.atomic():
+            # also locks the session, so the sections cannot change
+            #   between the check and the save.
+            revision = self.object.next_revision()
+            changed = [f for f in formset.forms if f.instance.pk and f.has_changed()]
+            current = dict(
+                DraftSection.objects.filter(
+                    pk__in=[f.instance.pk for f in changed]
+                ).values_list("pk", "revision")
+            )
+            stale = [
+                f for f in changed if not f.check_revision(current.get(f.instance.pk))
+            ]
+            if stale:
+                transaction.set_rollback(True)
+                return self.form_invalid(form, formset)
+            for section_form in formset.forms:
+                section_form.instance.revision = revision
+            return super().form_valid(form, formset)
+
+
+###############################################################
+
+
+class AdminCompactScheduleView(
+    DraftScheduleSessionObjectMixin, AdminSiteViewMixin, DetailView
+):
+    """
+    The scheduling worksheet, rendered in the browser from the
+    ``ajax.load_worksheet`` data: much faster than the formset for
+    large sessions.
+    """
+
+    model = DraftScheduleSession
+    template_name = "admin/course_planning/draftschedulesession/worksheet_compact.html"
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        context["original"] = self.object
+        context["bulk_max"] = conf.get("worksheet:bulk_max")
+        context["poll_seconds"] = conf.get("worksheet:poll_seconds")
+        context["long_poll_seconds"] = conf.get("worksheet:long_poll_seconds")
         return context
 
 
@@ -108,17 +168,232 @@ class AdminInitializeFromTwoYearsAgoCourseData(AdminInitializer):
 ###############################################################
 
 
-class AdminAutoSchedule(
-    DraftScheduleSessionObjectMixin, AdminSiteViewMixin, RedirectView
+class AdminInitializePreview(
+    DraftScheduleSessionObjectMixin, AdminSiteViewMixin, DetailView
 ):
+    """
+    How many sections an initializer would create, skip and reject
+    (see ``initialize.preview_from_classes_app``), with a link to run it.
+    """
+
+    model = DraftScheduleSession
+    template_name = "admin/course_planning/draftschedulesession/initialize_preview.html"
+    previewer = None
+    initializer_url_name = None
+    description = None
+
+    def get_context_data(self, *args, **kwargs):
+        if self.previewer is None:
+            raise ImproperlyConfigured(
+                "Child classes must set the previewer class attribute"
+            )
+        context = super().get_context_data(*args, **kwargs)
+        context["original"] = self.object
+        context["preview"] = self.previewer(self.object)
+        context["description"] = self.description
+        context["initializer_url"] = reverse(
+            self.initializer_url_name, args=[self.object.pk]
+        )
+        return context
+
+
+class AdminInitializePreviewCurrent(AdminInitializePreview):
+    previewer = initialize.preview_from_classes_current
+    initializer_url_name = "admin:draftschedulesession_init_current"
+    description = "actual course data for this time period"
+
+
+class AdminInitializePreviewPrev(AdminInitializePreview):
+    previewer = initialize.preview_from_classes_last_year
+    initializer_url_name = "admin:draftschedulesession_init_prev"
+    description = "actual course data for this time period one year previous"
+
+
+class AdminInitializePreviewTwoYearsAgo(AdminInitializePreview):
+    previewer = initialize.preview_from_classes_two_years_ago
+    initializer_url_name = "admin:draftschedulesession_init_twoyears"
+    description = "actual course data for this time period two years previous"
+
+
+###############################################################
+
+
+class AdminMerger(DraftScheduleSessionObjectMixin, AdminSiteViewMixin, RedirectView):
+    """
+    Update an initialized session from course data (see
+    ``initialize.merge_from_classes_app``); with ``?dry_run=1``, only
+    report what would change.
+    """
+
+    merger = None
+    MESSAGE = (
+        "{verb} {added} added, {reactivated} reactivated, {retimed} retimed "
+        "and {deactivated} deactivated section(s); {unchanged} unchanged."
+    )
+
     def get_redirect_url(self, pk, **kwargs):
+        if self.merger is None:
+            raise ImproperlyConfigured(
+                "Child classes must set the merger class attribute"
+            )
         obj = self.get_object(pk=pk)
-        auto.main(obj)
+        dry_run = bool(self.request.GET.get("dry_run", ""))
+        diff = self.merger(obj, dry_run=dry_run)
+        counts = {k: len(v) for k, v in diff.items() if k != "unchanged"}
+        messages.info(
+            self.request,
+            self.MESSAGE.format(
+                verb="Would update:" if dry_run else "Updated:",
+                unchanged=diff["unchanged"],
+                **counts
+            ),
+        )
         return reverse(
             "admin:course_planning_draftschedulesession_change", args=[obj.pk]
         )
 
 
+class AdminMergeCurrentCourseData(AdminMerger):
+    merger = initialize.merge_from_classes_current
+
+
+###############################################################
+
+
+class AdminAutoSchedule(
+    DraftScheduleSessionObjectMixin, AdminSiteViewMixin, RedirectView
+):
+    """
+    Start a background auto-schedule job, and go to its progress page.
+    """
+
+    max_attempts = 100
+
+    def get_engine(self):
+        engine = self.request.GET.get("engine", None)
+        if engine not in auto.ENGINES:
+            engine = "imsvm"
+        return engine
+
+    def get_dry_run(self):
+        return bool(self.request.GET.get("dry_run", False))
+
+    def _get_int(self, name):
+        try:
+            return int(self.request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+    def get_attempts(self):
+        attempts = self._get_int("attempts")
+        if attempts is not None:
+            attempts = min(max(attempts, 1), self.max_attempts)
+        return attempts
+
+    def get_seed(self):
+        return self._get_int("seed")
+
+    def get_redirect_url(self, pk, **kwargs):
+        obj = self.get_object(pk=pk)
+        job = jobs.submit(
+            obj,
+            engine=self.get_engine(),
+            dry_run=self.get_dry_run(),
+            attempts=self.get_attempts(),
+            seed=self.get_seed(),
+        )
+        return reverse("admin:draftschedulesession_auto_schedule_job", args=[job.pk])
+
+
+###############################################################
+
+
+class AdminAutoScheduleJobView(AdminSiteViewMixin, DetailView):
+    """
+    Progress of an auto-schedule job; the page polls for updates.
+    """
+
+    model = AutoScheduleJob
+    template_name = "admin/course_planning/draftschedulesession/autoschedule_job.html"
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("session")
+
+
+###############################################################
+
+
+class AdminAutoSchedulePreviewView(AdminSiteViewMixin, DetailView):
+    """
+    Review the proposed changes of a dry run auto-schedule job,
+    and accept all or some of them.
+    """
+
+    model = AutoScheduleJob
+    template_name = (
+        "admin/course_planning/draftschedulesession/autoschedule_preview.html"
+    )
+
+    def get_queryset(self):
+        return (
+            super()
+            .get_queryset()
+            .filter(dry_run=True, status="d")
+            .select_related("session")
+        )
+
+    def get_change_list(self):
+        """
+        The proposed changes, with the objects they refer to.
+        """
+        changes = self.object.get_changes()
+        section_map = DraftSection.objects.select_related(
+            "course", "course__department", "timeslot"
+        ).in_bulk([c["section_id"] for c in changes])
+        profile_ids = {c["old_instructor_id"] for c in changes}
+        profile_ids |= {c["new_instructor_id"] for c in changes}
+        profile_map = TeachingProfile.objects.select_related("person").in_bulk(
+            [pk for pk in profile_ids if pk is not None]
+        )
+        results = []
+        for change in changes:
+            section = section_map.get(change["section_id"], None)
+            if section is None:
+                continue
+            results.append(
+                dict(
+                    change,
+                    section=section,
+                    old_instructor=profile_map.get(change["old_instructor_id"]),
+                    new_instructor=profile_map.get(change["new_instructor_id"]),
+                    current=section.instructor_id == change["old_instructor_id"],
+                )
+            )
+        return results
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        context["change_list"] = self.get_change_list()
+        return context
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        selected = set(request.POST.getlist("section"))
+        changes = [
+            c for c in self.object.get_changes() if str(c["section_id"]) in selected
+        ]
+        applied = auto.apply_changes(self.object.session, changes)
+        messages.info(
+            request,
+            "Applied {} of {} selected change(s).".format(len(applied), len(changes)),
+        )
+        return HttpResponseRedirect(
+            reverse(
+                "admin:draftschedulesession_worksheet", args=[self.object.session_id]
+            )
+        )
+
+
 ###############################################################
 
 
@@ -3,9 +3,30 @@ Ajax endpoint views for scheduling.
 """
 ###############################################################
 
+import json
+
+from classes.models import Timeslot
+from django.db import transaction
 from django.http import Http404, JsonResponse
+from django.utils import timezone
+
+from ... import conf
+from ...models import (
+    AutoScheduleJob,
+    DraftScheduleSession,
+    DraftSection,
+    TeachingProfile,
+)
+from ..utils import cache, options
+from ..utils.broker import get_broker
+from ..utils.cache import get_snapshot
+from ..utils.worksheet import WorksheetSnapshot, worksheet_data
+
+###############################################################
 
-from ...models import DraftScheduleSession, DraftSection, TeachingProfile
+# a ``save_sections`` change without an instructor or timeslot keeps
+#   the current one.
+_KEEP = object()
 
 ###############################################################
 
@@ -49,168 +70,408 @@ def _load_object(request, model, pk_param):
     return obj
 
 
+def _check_exist(instructor_ids, timeslot_ids):
+    """
+    A 400 unless every (non-``None``) id is that of an instructor
+    (profile) or timeslot, as saving it would fail on the foreign key.
+    """
+    for model, ids in ((TeachingProfile, instructor_ids), (Timeslot, timeslot_ids)):
+        ids = set(ids) - {None}
+        if ids and model.objects.filter(pk__in=ids).count() != len(ids):
+            raise JsonError(
+                status=400,
+                data={"message": "No such {}".format(model._meta.verbose_name)},
+            )
+
+
+###############################################################
+
+
+def _section_snapshot(section, changed=False):
+    """
+    The session snapshot for ``section``; when it has just been
+    ``changed``, the (cached) snapshot may not have that yet.
+    """
+    snapshot = get_snapshot(section.session)
+    if changed and not snapshot.update_sections([section.pk]):
+        snapshot = WorksheetSnapshot(section.session)
+    if section.pk not in snapshot.sections:
+        raise JsonError(status=404, data={"message": "Section not active"})
+    return snapshot
+
+
+def _section_rows(queryset):
+    """
+    The current values of the sections, to merge into the worksheet.
+    """
+    rows = []
+    for section in queryset.select_related("instructor__person", "timeslot"):
+        rows.append(
+            {
+                "section_id": section.pk,
+                "revision": section.revision,
+                "active": section.active,
+                "instructor_id": section.instructor_id,
+                "instructor_label": (
+                    "" if section.instructor is None else str(section.instructor)
+                ),
+                "timeslot_id": section.timeslot_id,
+                "timeslot_label": (
+                    "" if section.timeslot is None else section.timeslot.display()
+                ),
+            }
+        )
+    return rows
+
+
+def _instructor_loads(snapshot, instructor_id):
+    rl, tl = snapshot.get_remaining_loads(instructor_id)
+    return {
+        "instructor_id": instructor_id,
+        "remaining_load": rl,
+        "remaining_term_loads": tl.get("display", None),
+        "term_loads": tl,
+    }
+
+
+def _affected(snapshot, changes):
+    """
+    Everything whose extras or loads may be changed by the
+    ``changes``, each ``(pk, old_instructor_id, instructor_id,
+    old_timeslot_id, timeslot_id)``: the instructors' sections may
+    have new notes; those in the same timeslots may have new
+    conflicts.
+    Returns ``section_pks, instructor_ids``.
+    """
+    instructor_ids = set()
+    timeslot_ids = set()
+    for pk, old_instr_id, instr_id, old_timeslot_id, timeslot_id in changes:
+        instructor_ids.add(instr_id)
+        if instr_id != old_instr_id:
+            instructor_ids.add(old_instr_id)
+        if timeslot_id != old_timeslot_id:
+            timeslot_ids |= {old_timeslot_id, timeslot_id}
+    instructor_ids.discard(None)
+    timeslot_ids.discard(None)
+    section_pks = snapshot.related_sections(instructor_ids, timeslot_ids)
+    return section_pks, instructor_ids
+
+
 ###############################################################
 
 
-def _build_notes(section):
-    total_load, term_loads = section.instructor.get_remaining_loads(section.session)
-    semester_load = term_loads.get(section.semester, 0)
-    back_to_back = section.instructor.has_back_to_back(
-        section.session, section.semester
-    )
-    has_different_days = section.instructor.has_different_days(
-        section.session, section.semester
-    )
-    timeslot_conflicts = section.instructor.get_timeslot_conflicts(
-        section.session, section.semester
-    )
-    notes = ""
-    # Notes:
-    #   - Timeslot conflict
-    if timeslot_conflicts:
-        notes += "Timeslot conflict. "
-        # data['timeslot_conflicts'] = timeslot_conflicts
-    #   - Total load at/over cap
-    if total_load < 0:
-        notes += "Over total load. "
-    #   - Term load at/over cap
-    if semester_load < -0.5:
-        notes += "Over term load. "
-    #   - Back to back teaching (vs prefs)
-    if back_to_back:
-        notes += "Back to back. "
-    #   - Multi day teaching (vs prefs)
-    if has_different_days:
-        notes += "Has different days. "
-    return notes, timeslot_conflicts, total_load, term_loads
+def load_section_extra(request):
+    try:
+        _ensure_method(request, "POST")
+        section = _load_object(request, DraftSection, "section_pk")
+        data = _section_snapshot(section).section_data(section.pk)
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
 
 
 ###############################################################
 
 
-def _build_additional_sections(section, old_instr_id, old_timeslot_id):
+def load_section_extras(request):
     """
-    During a save action, we need to indicate what else needs to be updated
+    The ``load_section_extra`` data for every active section of a
+    session (or only the given ``section_pk`` values), from a single
+    (cached) snapshot.
+    With ``changes`` (a JSON list of ``[pk, old_instructor_id,
+    instructor_id, old_timeslot_id, timeslot_id]``, e.g. from
+    ``get_section_changes``), only the extras of the changed sections
+    and of everything they affect, with the ``instructors`` loads.
     """
-    section_qs = section.session.draftsection_set.filter(active=True).exclude(
-        pk=section.pk
-    )
-    results = []
-    if section.instructor_id != old_instr_id:
-        # update old instructor, if any
-        if old_instr_id is not None:
-            results += list(
-                section_qs.filter(instructor_id=old_instr_id).values_list(
-                    "pk", flat=True
-                )
+    try:
+        _ensure_method(request, "POST")
+        session = _load_object(request, DraftScheduleSession, "session_id")
+        section_pks = request.POST.getlist("section_pk")
+        try:
+            section_pks = [int(pk) for pk in section_pks] or None
+            changes = [
+                tuple(None if v is None else int(v) for v in change)
+                for change in json.loads(request.POST.get("changes", None) or "[]")
+            ]
+            if any(len(change) != 5 for change in changes):
+                raise ValueError(changes)
+        except (TypeError, ValueError):
+            raise JsonError(status=400, data={"message": "Invalid request"})
+        snapshot = get_snapshot(session)
+        data = {"status": True, "message": "", "instructors": []}
+        if changes:
+            affected, instructor_ids = _affected(snapshot, changes)
+            section_pks = sorted(affected | {change[0] for change in changes})
+            data["instructors"] = [
+                _instructor_loads(snapshot, pk) for pk in sorted(instructor_ids)
+            ]
+        data["sections"] = snapshot.sections_data(section_pks)
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
+
+
+###############################################################
+
+
+def save_section(request):
+    """
+    Save the instructor and timeslot of a section.  The response has
+    the section's extras, as well as the ``sections`` extras and
+    ``instructors`` loads of everything else that the change affects
+    (pks in ``additional_sections``).
+
+    When a ``revision`` is given and someone else has changed the
+    section since, nothing is saved: the response is a 409 with the
+    section's current values (``row``) and extras.
+    """
+    try:
+        _ensure_method(request, "POST")
+        section = _load_object(request, DraftSection, "section_pk")
+
+        try:
+            timeslot_pk = int(request.POST.get("timeslot_pk", None) or 0) or None
+            instructor_pk = int(request.POST.get("instructor_pk", None) or 0) or None
+            revision = request.POST.get("revision", None)
+            revision = None if revision in (None, "") else int(revision)
+        except ValueError:
+            raise JsonError(status=400, data={"message": "Invalid request"})
+        _check_exist([instructor_pk], [timeslot_pk])
+
+        with transaction.atomic():
+            # lock the session first, as ``next_revision()`` does.
+            session = DraftScheduleSession.objects.select_for_update().get(
+                pk=section.session_id
             )
-        # update new instructor
-        if section.instructor_id is not None:
-            results += list(
-                section_qs.filter(instructor_id=section.instructor_id).values_list(
-                    "pk", flat=True
+            section = DraftSection.objects.select_for_update().get(pk=section.pk)
+            old_instr_id = section.instructor_id
+            old_timeslot_id = section.timeslot_id
+            changed = (instructor_pk, timeslot_pk) != (old_instr_id, old_timeslot_id)
+            if changed and revision is not None and revision != section.revision:
+                data = _section_snapshot(section).section_data(section.pk)
+                data.update(
+                    status=False,
+                    message="Someone else has changed this section; "
+                    "it now shows their changes.",
+                    row=_section_rows(DraftSection.objects.filter(pk=section.pk))[0],
                 )
-            )
-    if section.timeslot_id != old_timeslot_id:
-        # update old timeslots
-        if old_timeslot_id is not None:
-            results += list(
-                section_qs.filter(timeslot_id=old_timeslot_id).values_list(
-                    "pk", flat=True
+                raise JsonError(status=409, data=data)
+            if changed:
+                section.instructor_id = instructor_pk
+                section.timeslot_id = timeslot_pk
+                section.revision = session.next_revision()
+                section.save()
+
+        snapshot = _section_snapshot(section, changed=changed)
+        data = snapshot.section_data(section.pk)
+        data["revision"] = section.revision
+        if old_instr_id is not None:
+            data["old_instructor_id"] = old_instr_id
+
+        additional, instructor_ids = _affected(
+            snapshot,
+            [
+                (
+                    section.pk,
+                    old_instr_id,
+                    section.instructor_id,
+                    old_timeslot_id,
+                    section.timeslot_id,
                 )
+            ],
+        )
+        additional.discard(section.pk)
+        data["additional_sections"] = sorted(additional)
+        data["sections"] = snapshot.sections_data(data["additional_sections"])
+        data["instructors"] = [
+            _instructor_loads(snapshot, pk)
+            for pk in sorted(instructor_ids)
+            if pk in snapshot.profiles
+        ]
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
+
+
+###############################################################
+
+
+def save_sections(request):
+    """
+    Save the instructors and timeslots of many sections of a session
+    at once, with a single ``bulk_update``: ``changes`` is a JSON list
+    of ``{"section_id", "instructor_id", "timeslot_id", "revision"}``
+    (``revision`` is optional, as for ``save_section``).  A missing
+    ``instructor_id`` or ``timeslot_id`` keeps the current value;
+    ``null`` clears it.
+    Sections someone else has changed since are skipped, and listed
+    in ``conflicts``.  The response has the current ``rows`` of the
+    saved and conflicting sections, as well as the ``sections`` extras
+    and ``instructors`` loads of everything affected.
+    """
+    try:
+        _ensure_method(request, "POST")
+        session = _load_object(request, DraftScheduleSession, "session_id")
+        try:
+            changes = {}
+            for change in json.loads(request.POST.get("changes", None) or "[]"):
+                values = [
+                    int(change[key] or 0) or None if key in change else _KEEP
+                    for key in ["instructor_id", "timeslot_id"]
+                ]
+                revision = change.get("revision", None)
+                values.append(None if revision in (None, "") else int(revision))
+                changes[int(change["section_id"])] = tuple(values)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise JsonError(status=400, data={"message": "Invalid request"})
+        bulk_max = conf.get("worksheet:bulk_max")
+        if len(changes) > bulk_max:
+            raise JsonError(
+                status=400,
+                data={"message": "At most {} sections at a time".format(bulk_max)},
+            )
+        _check_exist(
+            [instr_id for instr_id, _, _ in changes.values() if instr_id is not _KEEP],
+            [t_id for _, t_id, _ in changes.values() if t_id is not _KEEP],
+        )
+
+        saved = []
+        conflicts = []
+        with transaction.atomic():
+            # lock the session first, as ``next_revision()`` does.
+            DraftScheduleSession.objects.select_for_update().get(pk=session.pk)
+            current = (
+                session.draftsection_set.select_for_update()
+                .filter(active=True, pk__in=list(changes))
+                .values_list("pk", "instructor_id", "timeslot_id", "revision")
             )
-        # update new timeslots
-        if section.timeslot_id is not None:
-            results += list(
-                section_qs.filter(timeslot_id=section.timeslot_id).values_list(
-                    "pk", flat=True
+            for pk, old_instr_id, old_timeslot_id, current_revision in current:
+                instr_id, timeslot_id, revision = changes[pk]
+                if instr_id is _KEEP:
+                    instr_id = old_instr_id
+                if timeslot_id is _KEEP:
+                    timeslot_id = old_timeslot_id
+                if (instr_id, timeslot_id) == (old_instr_id, old_timeslot_id):
+                    continue
+                if revision is not None and revision != current_revision:
+                    conflicts.append(pk)
+                    continue
+                saved.append((pk, old_instr_id, instr_id, old_timeslot_id, timeslot_id))
+            if saved:
+                now = timezone.now()
+                revision = session.next_revision()
+                objs = [
+                    DraftSection(
+                        pk=pk,
+                        instructor_id=instr_id,
+                        timeslot_id=timeslot_id,
+                        modified=now,
+                        revision=revision,
+                    )
+                    for pk, _, instr_id, _, timeslot_id in saved
+                ]
+                DraftSection.objects.bulk_update(
+                    objs, ["instructor", "timeslot", "modified", "revision"]
                 )
+                cache.sections_changed(session.pk, [c[0] for c in saved])
+
+        saved_pks = [c[0] for c in saved]
+        snapshot = get_snapshot(session)
+        if saved_pks and not snapshot.update_sections(saved_pks):
+            snapshot = WorksheetSnapshot(session)
+        section_pks, instructor_ids = _affected(snapshot, saved)
+        section_pks.update(saved_pks, conflicts)
+        data = {
+            "status": True,
+            "message": "",
+            "saved": saved_pks,
+            "conflicts": conflicts,
+            "rows": _section_rows(
+                DraftSection.objects.filter(pk__in=saved_pks + conflicts)
+            ),
+            "sections": snapshot.sections_data(sorted(section_pks)),
+            "instructors": [
+                _instructor_loads(snapshot, pk)
+                for pk in sorted(instructor_ids)
+                if pk in snapshot.profiles
+            ],
+        }
+        if conflicts:
+            data["message"] = (
+                "Someone else has changed {} of these sections; "
+                "they now show their changes.".format(len(conflicts))
             )
-
-    return list(set(results))
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
 
 
 ###############################################################
 
 
-def load_section_extra(request, section=None, old_instr_id=None, old_timeslot_id=None):
+def get_section_changes(request):
+    """
+    The sections of a session changed since its ``revision``: their
+    current values (``rows``), and the pks of the sections still
+    active (``section_pks``), so deleted ones can be dropped.
+    Their extras, and the loads of the instructors involved, are for
+    ``load_section_extras`` (with ``changes``), as only the page knows
+    what the values were before.
+    With ``wait`` (seconds, up to the ``worksheet:long_poll_seconds``
+    setting), this is a long-poll: when nothing has changed yet, the
+    answer waits until something does (or the time is up).
+    """
     try:
         _ensure_method(request, "POST")
-        from_save = section is not None
-        if section is None:
-            try:
-                section = _load_object(request, DraftSection, "section_pk")
-            except JsonError as e:
-                return e.as_response()
-
+        session = _load_object(request, DraftScheduleSession, "session_id")
+        try:
+            since = int(request.POST.get("revision", None) or 0)
+            wait = float(request.POST.get("wait", None) or 0)
+        except ValueError:
+            raise JsonError(status=400, data={"message": "Invalid request"})
+        wait = min(wait, conf.get("worksheet:long_poll_seconds"))
+        if wait > 0:
+            broker = get_broker()
+            token = broker.token(session.pk)
+            session.refresh_from_db(fields=["revision"])
+            if session.revision <= since and broker.wait(session.pk, token, wait):
+                session.refresh_from_db(fields=["revision"])
         data = {
             "status": True,
             "message": "",
-            "score": "",
-            "notes": "",
-            "section_id": section.pk,
-            "timeslot_conflicts": None,
-            "additional_sections": [],
-            "remaining_load": None,
-            "remaining_term_loads": None,
-            "instructor_id": None,
+            "revision": session.revision,
+            "rows": [],
+            "section_pks": None,
         }
-        if section.instructor is not None and section.timeslot is not None:
-            data["score"] = section.instructor.get_score(
-                section.course_id, section.timeslot_id
+        if session.revision > since:
+            data["rows"] = _section_rows(
+                session.draftsection_set.filter(revision__gt=since)
             )
-        if old_instr_id is not None:
-            data["old_instructor_id"] = old_instr_id
-        if section.instructor is not None:
-            data["instructor_id"] = section.instructor_id
-            n, tc, rl, tl = _build_notes(section)
-            data["notes"] = n
-            data["timeslot_conflicts"] = tc
-            data["remaining_load"] = rl
-            data["remaining_term_loads"] = tl.get("display", None)
-        if from_save:
-            data["additional_sections"] = _build_additional_sections(
-                section, old_instr_id, old_timeslot_id
+            data["section_pks"] = list(
+                session.draftsection_set.filter(active=True)
+                .order_by("pk")
+                .values_list("pk", flat=True)
             )
-
         return JsonResponse(data)
-    except Exception as e:
-        import traceback
-
-        traceback.print_exc()
-        raise e
+    except JsonError as e:
+        return e.as_response()
 
 
 ###############################################################
 
 
-def save_section(request):
+def load_worksheet(request):
+    """
+    The data of the compact worksheet; see ``worksheet_data()``.
+    """
     try:
         _ensure_method(request, "POST")
-        try:
-            section = _load_object(request, DraftSection, "section_pk")
-        except JsonError as e:
-            return e.as_response()
-
-        timeslot_pk = request.POST.get("timeslot_pk", None)
-        if not timeslot_pk:
-            timeslot_pk = None
-        instructor_pk = request.POST.get("instructor_pk", None)
-        if not instructor_pk:
-            instructor_pk = None
-
-        old_instr_id = section.instructor_id
-        section.instructor_id = instructor_pk
-        old_timeslot_id = section.timeslot_id
-        section.timeslot_id = timeslot_pk
-        section.save()
-
-        return load_section_extra(request, section, old_instr_id, old_timeslot_id)
-    except Exception as e:
-        import traceback
-
-        traceback.print_exc()
-        raise e
+        session = _load_object(request, DraftScheduleSession, "session_id")
+        data = {"status": True, "message": ""}
+        data.update(worksheet_data(session))
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
 
 
 ###############################################################
@@ -236,3 +497,84 @@ def get_instructor_loads(request):
 
 
 ###############################################################
+
+
+def get_session_instructor_loads(request):
+    """
+    The ``get_instructor_loads`` data for every active teaching
+    profile, from one grouped query.
+    """
+    try:
+        _ensure_method(request, "POST")
+        session = _load_object(request, DraftScheduleSession, "session_id")
+        results = []
+        for instructor in TeachingProfile.objects.filter(
+            active=True
+        ).with_session_loads(session):
+            rl, tl = instructor.get_annotated_remaining_loads()
+            results.append(
+                {
+                    "instructor_id": instructor.pk,
+                    "remaining_load": rl,
+                    "remaining_term_loads": tl.get("display", None),
+                    "term_loads": tl,
+                }
+            )
+        return JsonResponse({"status": True, "message": "", "instructors": results})
+    except JsonError as e:
+        return e.as_response()
+
+
+###############################################################
+
+
+def search_options(request, name):
+    """
+    The select2 search of the ``name`` option list (see ``options``):
+    GET ``term`` and ``page`` (from 1).
+    """
+    try:
+        _ensure_method(request, "GET")
+        if name not in options.LOADERS:
+            raise JsonError(status=404, data={"message": "Object not found"})
+        try:
+            page = max(int(request.GET.get("page", None) or 1), 1)
+        except ValueError:
+            raise JsonError(status=400, data={"message": "Invalid request"})
+        page_size = conf.get("select2_options:page_size")
+        results, more = options.get_index(name).search(
+            request.GET.get("term", ""), (page - 1) * page_size, page_size
+        )
+        return JsonResponse(
+            {
+                "results": [{"id": pk, "text": label} for pk, label in results],
+                "more": more,
+            }
+        )
+    except JsonError as e:
+        return e.as_response()
+
+
+###############################################################
+
+
+def auto_schedule_status(request):
+    try:
+        _ensure_method(request, "POST")
+        job = _load_object(request, AutoScheduleJob, "job_pk")
+        data = {
+            "job_id": job.pk,
+            "status": job.status,
+            "status_display": job.get_status_display(),
+            "finished": job.is_finished(),
+            "iterations": job.iterations,
+            "matches": job.matches,
+            "elapsed": job.elapsed,
+            "message": job.message,
+        }
+        return JsonResponse(data)
+    except JsonError as e:
+        return e.as_response()
+
+
+###############################################################
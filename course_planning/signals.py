@@ -0,0 +1,53 @@
+"""
+Signal handlers for the course_planning application.
+"""
+#######################################################################
+
+from django.db.models.signals import post_delete, post_save
+
+from .models import (
+    CourseTeachingPreference,
+    DraftSection,
+    SemesterTeachingPreference,
+    TeachingProfile,
+    TimeslotTeachingPreference,
+)
+from .schedule.utils import cache, options
+
+#######################################################################
+
+
+def draftsection_changed(sender, instance, **kwargs):
+    cache.sections_changed(instance.session_id, [instance.pk])
+
+
+def scheduling_data_changed(sender, **kwargs):
+    cache.invalidate_all()
+
+
+def options_changed(sender, **kwargs):
+    options.invalidate()
+
+
+#######################################################################
+
+
+def connect():
+    """
+    Connect the handlers; see ``CoursePlanningConfig.ready``.
+    """
+    for signal in [post_save, post_delete]:
+        signal.connect(draftsection_changed, sender=DraftSection)
+        for model in [
+            TeachingProfile,
+            CourseTeachingPreference,
+            TimeslotTeachingPreference,
+            SemesterTeachingPreference,
+            "classes.Timeslot",
+        ]:
+            signal.connect(scheduling_data_changed, sender=model)
+        for model in [TeachingProfile, "people.Person", "classes.Timeslot"]:
+            signal.connect(options_changed, sender=model)
+
+
+#######################################################################
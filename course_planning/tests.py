@@ -0,0 +1,787 @@
+"""
+Tests for the course_planning application.
+"""
+#######################################################################
+
+import datetime
+import json
+import threading
+import time
+
+import numpy as np
+from classes.models import (
+    Course,
+    Department,
+    Section,
+    SectionSchedule,
+    Semester,
+    Timeslot,
+)
+from django.contrib.auth.models import User
+from django.core.cache import cache as django_cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from people.models import Person
+
+from .models import (
+    AutoScheduleJob,
+    CourseInfo,
+    DraftScheduleSession,
+    DraftSection,
+    SemesterTeachingPreference,
+    TeachingProfile,
+)
+from .schedule.forms import SectionSchedulingForm
+from .schedule.utils import cache, initialize, jobs, options
+from .schedule.utils.benchmark import random_problem
+from .schedule.utils.broker import LocalBroker, get_broker
+from .schedule.utils.improve import LocalSearch, improve
+from .schedule.utils.imsvm import imsvm
+from .schedule.utils.options import OptionIndex
+from .schedule.utils.state import NONE
+from .schedule.utils.synthetic import ONLINE_PK, synthetic_department
+from .schedule.utils.worksheet import WorksheetSnapshot
+from .schedule.views import ajax
+
+#######################################################################
+
+
+def make_session():
+    return DraftScheduleSession.objects.create(
+        verbose_name="Regular Session 2019-2020",
+        start_date=datetime.date(2019, 9, 1),
+        end_date=datetime.date(2020, 4, 30),
+    )
+
+
+def make_course(code):
+    department, created = Department.objects.get_or_create(code="TEST", name="Test")
+    return Course.objects.create(department=department, code=code, name=code)
+
+
+def make_timeslot(day, hour):
+    return Timeslot.objects.create(
+        day=day, start_time=datetime.time(hour), stop_time=datetime.time(hour, 50)
+    )
+
+
+def make_profile(username):
+    return TeachingProfile.objects.create(
+        person=Person.objects.create(username=username, cn=username.title())
+    )
+
+
+def make_sections(session, count, instructors=(), timeslots=(), semester="1"):
+    """
+    ``count`` sections, each of a new course, assigned in turn to
+    ``instructors`` and ``timeslots``.
+    """
+    start = DraftSection.objects.count()
+    sections = []
+    for i in range(start, start + count):
+        sections.append(
+            DraftSection.objects.create(
+                session=session,
+                course=make_course("{}".format(100 + i)),
+                verbose_name="A01",
+                semester=semester,
+                instructor=instructors[i % len(instructors)] if instructors else None,
+                timeslot=timeslots[i % len(timeslots)] if timeslots else None,
+            )
+        )
+    return sections
+
+
+def make_class_section(course, semester, name="A01", timeslot=None, section_type="cl"):
+    """
+    A ``classes.Section``, scheduled in ``timeslot`` (if any).
+    """
+    section = Section.objects.create(
+        course=course, term=semester, section_name=name, section_type=section_type
+    )
+    if timeslot is not None:
+        SectionSchedule.objects.create(section=section, timeslot=timeslot)
+    return section
+
+
+#######################################################################
+
+
+class InitializePreviewTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+
+    def test_preview(self):
+        result = initialize.preview_from_classes_app(
+            self.session, Semester.objects.all()
+        )
+        self.assertEqual(result["total"], 0)
+        self.assertEqual(result["create"], 0)
+        self.assertEqual(result["existing"], 0)
+        self.assertEqual(
+            [reason for reason, count in result["rejected"]],
+            [reason for name, reason, q in initialize._checks()],
+        )
+
+    def test_preview_with_corrections(self):
+        result = initialize.preview_from_classes_app(
+            self.session, Semester.objects.all(), Semester.objects.all()
+        )
+        self.assertEqual(result["fill_in"], 0)
+        self.assertEqual(result["rejected"][-1], ("not offered this year", 0))
+
+
+#######################################################################
+
+
+class ClassesDataTestCase(TestCase):
+    """
+    A session to initialize, with courses and semesters.
+    """
+
+    def setUp(self):
+        self.session = make_session()
+        self.fall = Semester.objects.create(year=2019, term="3")
+        self.winter = Semester.objects.create(year=2020, term="1")
+        self.courses = [make_course(code) for code in ["101", "102", "103"]]
+        self.timeslot = make_timeslot("MWF", 10)
+
+    def drafts(self, session=None):
+        session = self.session if session is None else session
+        return set(
+            session.draftsection_set.filter(active=True).values_list(
+                "course_id", "verbose_name", "semester", "timeslot_id"
+            )
+        )
+
+
+class InitializeTests(ClassesDataTestCase):
+    def test_initialize(self):
+        c1, c2, c3 = self.courses
+        make_class_section(c1, self.fall, "A01", self.timeslot)
+        make_class_section(c1, self.fall, "A02")
+        make_class_section(c2, self.winter, "A01", section_type="on")
+        make_class_section(c3, self.winter, "X01", self.timeslot, section_type="la")
+        semester_list = Semester.objects.all()
+        preview = initialize.preview_from_classes_app(self.session, semester_list)
+        self.assertEqual((preview["total"], preview["create"]), (4, 3))
+
+        self.assertEqual(
+            initialize.from_classes_app(self.session, semester_list, False), 3
+        )
+        online = Timeslot.objects.Online()
+        self.assertEqual(
+            self.drafts(),
+            {
+                (c1.pk, "A01", "3", self.timeslot.pk),
+                (c1.pk, "A02", "3", None),
+                (c2.pk, "A01", "1", online.pk),
+            },
+        )
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.initialized)
+        self.assertEqual(
+            set(self.session.draftsection_set.values_list("revision", flat=True)),
+            {self.session.revision},
+        )
+        with self.assertRaises(initialize.AlreadyDone):
+            initialize.from_classes_app(self.session, semester_list, False)
+
+    def test_queries(self):
+        # the same number of queries, however many sections.
+        semester_list = Semester.objects.all()
+        make_class_section(self.courses[0], self.fall, "A01", self.timeslot)
+        with CaptureQueriesContext(connection) as context:
+            initialize.from_classes_app(self.session, semester_list, False)
+        for i in range(20):
+            make_class_section(self.courses[1], self.winter, "B{:02}".format(i))
+        session = make_session()
+        with self.assertNumQueries(len(context)):
+            self.assertEqual(
+                initialize.from_classes_app(session, semester_list, False), 21
+            )
+
+
+class EvenOddTests(ClassesDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # the session's fall is in an odd year, its winter in an even one.
+        fall_2017 = Semester.objects.create(year=2017, term="3")
+        winter_2018 = Semester.objects.create(year=2018, term="1")
+        fall_2018 = Semester.objects.create(year=2018, term="3")
+        winter_2019 = Semester.objects.create(year=2019, term="1")
+        self.last_year = Semester.objects.filter(pk__in=[fall_2018.pk, winter_2019.pk])
+        self.two_years_ago = Semester.objects.filter(
+            pk__in=[fall_2017.pk, winter_2018.pk]
+        )
+        self.every, self.odd, self.even, self.odd_offered = [
+            make_course(code) for code in ["201", "202", "203", "204"]
+        ]
+        for course, runs in [
+            (self.odd, "o"),
+            (self.even, "e"),
+            (self.odd_offered, "o"),
+        ]:
+            CourseInfo.objects.create(course=course, runs=runs)
+
+        make_class_section(self.every, fall_2018, "A01")
+        make_class_section(self.even, fall_2018, "A01")
+        make_class_section(self.odd, winter_2019, "A01")
+        make_class_section(self.odd_offered, fall_2018, "A01")
+        make_class_section(self.every, fall_2017, "B01")
+        make_class_section(self.odd, fall_2017, "A01", self.timeslot)
+        make_class_section(self.even, winter_2018, "A01")
+        make_class_section(self.odd_offered, fall_2017, "B01")
+
+    def test_preview(self):
+        result = initialize.preview_from_classes_app(
+            self.session, self.last_year, self.two_years_ago
+        )
+        self.assertEqual((result["total"], result["create"]), (4, 2))
+        self.assertEqual(result["rejected"][-1], ("not offered this year", 2))
+        self.assertEqual(result["fill_in"], 2)
+
+    def test_initialize(self):
+        created = initialize.from_classes_app(
+            self.session, self.last_year, False, self.two_years_ago
+        )
+        self.assertEqual(created, 4)
+        self.assertEqual(
+            self.drafts(),
+            {
+                (self.every.pk, "A01", "3", None),
+                (self.odd_offered.pk, "A01", "3", None),
+                # filled in from two years ago.
+                (self.odd.pk, "A01", "3", self.timeslot.pk),
+                (self.even.pk, "A01", "1", None),
+            },
+        )
+
+
+class MergeTests(ClassesDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instructor = make_profile("prof")
+        c1, c2, c3 = self.courses
+        self.kept = make_class_section(c1, self.fall, "A01", self.timeslot)
+        self.retimed = make_class_section(c2, self.fall, "A01", self.timeslot)
+        self.dropped = make_class_section(c3, self.winter, "A01")
+        self.semester_list = Semester.objects.all()
+        initialize.from_classes_app(self.session, self.semester_list, False)
+        self.session.draftsection_set.update(instructor=self.instructor)
+
+        self.new_timeslot = make_timeslot("TR", 10)
+        SectionSchedule.objects.filter(section=self.retimed).update(
+            timeslot=self.new_timeslot
+        )
+        Section.objects.filter(pk=self.dropped.pk).update(active=False)
+        make_class_section(c3, self.winter, "A02")
+        make_class_section(c1, self.winter, "A01")
+        DraftSection.objects.create(
+            session=self.session,
+            course=c1,
+            verbose_name="A01",
+            semester="1",
+            active=False,
+        )
+
+    def test_merge(self):
+        c1, c2, c3 = self.courses
+        revision = self.session.revision
+        diff = initialize.merge_from_classes_app(self.session, self.semester_list)
+        self.assertEqual(diff["added"], [(c3.pk, "A02", "1")])
+        self.assertEqual(diff["reactivated"], [(c1.pk, "A01", "1")])
+        self.assertEqual(diff["retimed"], [(c2.pk, "A01", "3")])
+        self.assertEqual(diff["deactivated"], [(c3.pk, "A01", "1")])
+        self.assertEqual(diff["unchanged"], 1)
+        self.assertEqual(
+            self.drafts(),
+            {
+                (c1.pk, "A01", "3", self.timeslot.pk),
+                (c2.pk, "A01", "3", self.new_timeslot.pk),
+                (c3.pk, "A02", "1", None),
+                (c1.pk, "A01", "1", None),
+            },
+        )
+        # instructors are kept; only the changed sections are touched.
+        retimed = self.session.draftsection_set.get(course=c2)
+        self.assertEqual(retimed.instructor, self.instructor)
+        self.assertGreater(retimed.revision, revision)
+        kept = self.session.draftsection_set.get(course=c1, semester="3")
+        self.assertEqual(kept.revision, revision)
+
+    def test_dry_run(self):
+        before = self.drafts()
+        diff = initialize.merge_from_classes_app(
+            self.session, self.semester_list, dry_run=True
+        )
+        self.assertEqual(len(diff["added"]), 1)
+        self.assertEqual(self.drafts(), before)
+        self.assertEqual(
+            initialize.merge_from_classes_app(self.session, self.semester_list), diff
+        )
+
+    def test_view(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "x")
+        self.client.force_login(user)
+        before = self.drafts()
+        response = self.client.get(
+            reverse(
+                "admin:draftschedulesession_merge_current",
+                kwargs={"pk": self.session.pk},
+            ),
+            {"dry_run": 1},
+            follow=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        message = [str(m) for m in response.context["messages"]][0]
+        self.assertTrue(message.startswith("Would update:"), message)
+        self.assertEqual(self.drafts(), before)
+
+
+class PendingJobTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.job = AutoScheduleJob.objects.create(session=self.session, status="r")
+
+    def test_dry_run(self):
+        self.assertEqual(jobs.pending_job(self.session), self.job)
+        self.assertEqual(jobs.pending_job(self.session, dry_run=False), self.job)
+        self.assertIsNone(jobs.pending_job(self.session, dry_run=True))
+
+    def test_stale(self):
+        AutoScheduleJob.objects.filter(pk=self.job.pk).update(
+            modified=timezone.now() - datetime.timedelta(days=1)
+        )
+        self.assertIsNone(jobs.pending_job(self.session))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "f")
+
+
+class SaveSectionTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.instructors = [make_profile("prof{}".format(i)) for i in range(2)]
+        self.section = make_sections(self.session, 1, self.instructors[:1])[0]
+
+    def save(self, instructor, revision):
+        request = RequestFactory().post(
+            "/",
+            {
+                "section_pk": self.section.pk,
+                "instructor_pk": instructor.pk,
+                "revision": revision,
+            },
+        )
+        return ajax.save_section(request)
+
+    def test_save(self):
+        response = self.save(self.instructors[1], self.section.revision)
+        self.assertEqual(response.status_code, 200)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.instructor, self.instructors[1])
+        self.assertEqual(json.loads(response.content)["revision"], 1)
+
+    def test_stale_revision(self):
+        self.save(self.instructors[1], self.section.revision)
+        response = self.save(self.instructors[0], self.section.revision)
+        self.assertEqual(response.status_code, 409)
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.instructor, self.instructors[1])
+        data = json.loads(response.content)
+        self.assertEqual(data["row"]["instructor_id"], self.instructors[1].pk)
+
+
+class SaveSectionsTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.instructor = make_profile("prof")
+        self.timeslots = [make_timeslot("MWF", 8), make_timeslot("TR", 10)]
+        self.sections = make_sections(
+            self.session, 3, [self.instructor], self.timeslots[:1]
+        )
+
+    def save(self, changes):
+        request = RequestFactory().post(
+            "/", {"session_id": self.session.pk, "changes": json.dumps(changes)}
+        )
+        return ajax.save_sections(request)
+
+    def current(self, section):
+        section.refresh_from_db()
+        return section.instructor_id, section.timeslot_id
+
+    def test_unknown_instructor(self):
+        response = self.save([{"section_id": 1, "instructor_id": 999999}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_keeps(self):
+        first, second, third = self.sections
+        response = self.save(
+            [
+                {"section_id": first.pk, "timeslot_id": self.timeslots[1].pk},
+                {"section_id": second.pk, "instructor_id": None},
+                {"section_id": third.pk},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["saved"], [first.pk, second.pk])
+        self.assertEqual(
+            self.current(first), (self.instructor.pk, self.timeslots[1].pk)
+        )
+        # an explicit null clears.
+        self.assertEqual(self.current(second), (None, self.timeslots[0].pk))
+        self.assertEqual(
+            self.current(third), (self.instructor.pk, self.timeslots[0].pk)
+        )
+
+    @override_settings(COURSE_PLANNING_CONFIG={"worksheet:bulk_max": 2})
+    def test_bulk_max(self):
+        response = self.save(
+            [{"section_id": s.pk, "instructor_id": None} for s in self.sections]
+        )
+        self.assertEqual(response.status_code, 400)
+        for section in self.sections:
+            self.assertEqual(self.current(section)[0], self.instructor.pk)
+        response = self.save(
+            [{"section_id": s.pk, "instructor_id": None} for s in self.sections[:2]]
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class SectionChangesTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.instructor = make_profile("prof")
+        self.sections = make_sections(self.session, 3)
+
+    def get_changes(self, revision, wait=0):
+        request = RequestFactory().post(
+            "/", {"session_id": self.session.pk, "revision": revision, "wait": wait}
+        )
+        return json.loads(ajax.get_section_changes(request).content)
+
+    def test_changes(self):
+        section = self.sections[0]
+        section.instructor = self.instructor
+        section.revision = self.session.next_revision()
+        section.save()
+        self.sections[1].delete()
+
+        data = self.get_changes(0)
+        self.assertEqual(data["revision"], 1)
+        self.assertEqual([row["section_id"] for row in data["rows"]], [section.pk])
+        self.assertEqual(data["rows"][0]["instructor_id"], self.instructor.pk)
+        self.assertEqual(
+            data["section_pks"], [self.sections[0].pk, self.sections[2].pk]
+        )
+
+        data = self.get_changes(1)
+        self.assertEqual(data["rows"], [])
+        self.assertIsNone(data["section_pks"])
+
+    @override_settings(COURSE_PLANNING_CONFIG={"worksheet:long_poll_seconds": 30})
+    def test_long_poll(self):
+        # woken by the publication, long before the wait is up.
+        timer = threading.Timer(0.1, get_broker().publish, [self.session.pk])
+        timer.start()
+        start = time.time()
+        data = self.get_changes(0, wait=30)
+        timer.join()
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(data["rows"], [])
+
+
+class LocalBrokerTests(SimpleTestCase):
+    def test_wait(self):
+        broker = LocalBroker()
+        token = broker.token("a")
+        self.assertFalse(broker.wait("a", token, 0.01))
+        threading.Timer(0.1, broker.publish, ["b"]).start()
+        threading.Timer(0.2, broker.publish, ["a"]).start()
+        self.assertTrue(broker.wait("a", token, 10))
+        self.assertEqual(broker.token("b"), 1)
+
+    def test_missed(self):
+        # a publication between the token and the wait is not missed.
+        broker = LocalBroker()
+        token = broker.token("a")
+        broker.publish("a")
+        self.assertTrue(broker.wait("a", token, 0))
+
+
+class WorksheetCacheTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.session = make_session()
+        self.instructors = [make_profile("prof{}".format(i)) for i in range(2)]
+        self.section, self.other = make_sections(self.session, 2, self.instructors[:1])
+
+    def change_instructor(self, instructor):
+        DraftSection.objects.filter(pk=self.section.pk).update(instructor=instructor)
+        # as ``sections_changed`` does when the transaction commits.
+        cache._sections_changed(self.session.pk, [self.section.pk])
+
+    def test_sections_changed(self):
+        snapshot = cache.get_snapshot(self.session)
+        self.assertEqual(snapshot.sections[self.section.pk][4], self.instructors[0].pk)
+        self.change_instructor(self.instructors[1])
+        # updated in place, not rebuilt.
+        with self.assertNumQueries(0):
+            snapshot = cache.get_snapshot(self.session)
+        self.assertEqual(snapshot.sections[self.section.pk][4], self.instructors[1].pk)
+        self.assertEqual(
+            snapshot.by_instructor[self.instructors[0].pk], {self.other.pk}
+        )
+
+    def test_unknown_instructor(self):
+        cache.get_snapshot(self.session)
+        instructor = make_profile("new")
+        self.change_instructor(instructor)
+        snapshot = cache.get_snapshot(self.session)
+        self.assertEqual(snapshot.sections[self.section.pk][4], instructor.pk)
+        self.assertIn(instructor.pk, snapshot.profiles)
+
+    def test_discard(self):
+        cache.get_snapshot(self.session)
+        DraftSection.objects.filter(pk=self.section.pk).delete()
+        cache.discard_snapshot(self.session.pk)
+        self.assertNotIn(self.section.pk, cache.get_snapshot(self.session).sections)
+
+    def test_load_worksheet(self):
+        make_sections(self.session, 10, self.instructors, [make_timeslot("TR", 10)])
+        request = RequestFactory().post("/", {"session_id": self.session.pk})
+        with CaptureQueriesContext(connection) as context:
+            ajax.load_worksheet(request)
+        make_sections(self.session, 10, self.instructors)
+        with self.assertNumQueries(len(context)):
+            response = ajax.load_worksheet(request)
+        data = json.loads(response.content)
+        self.assertEqual(len(data["sections"]), 22)
+        self.assertEqual(len(data["courses"]), 22)
+        self.assertEqual(
+            [row[0] for row in data["instructors"]],
+            [instructor.pk for instructor in self.instructors],
+        )
+
+
+class OptionIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = OptionIndex(
+            [(1, "Joan Smith", "jsmith"), (2, "Ann Lee", "alee"), (3, "Dean Ng", "")]
+        )
+
+    def test_search(self):
+        # prefix matches first, then the others in order.
+        self.assertEqual(
+            self.index.search("an"),
+            ([(2, "Ann Lee"), (1, "Joan Smith"), (3, "Dean Ng")], False),
+        )
+        self.assertEqual(self.index.search("AN SM"), ([(1, "Joan Smith")], False))
+        self.assertEqual(self.index.search("alee"), ([(2, "Ann Lee")], False))
+        self.assertEqual(self.index.search("xyz"), ([], False))
+
+    def test_pages(self):
+        self.assertEqual(self.index.search("an", 0, 2)[1], True)
+        self.assertEqual(self.index.search("an", 2, 2), ([(3, "Dean Ng")], False))
+
+    def test_label(self):
+        self.assertEqual(self.index.label(2), "Ann Lee")
+        self.assertIsNone(self.index.label(4))
+
+
+class OptionWidgetTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.active = make_profile("active")
+        self.inactive = make_profile("inactive")
+        TeachingProfile.objects.filter(pk=self.inactive.pk).update(active=False)
+        options._invalidate()
+
+    def render_instructor(self, section):
+        return str(SectionSchedulingForm(instance=section)["instructor"])
+
+    def test_label(self):
+        section = make_sections(self.session, 1, [self.active])[0]
+        self.render_instructor(section)
+        # labelled from the (loaded) index.
+        with self.assertNumQueries(0):
+            html = self.render_instructor(section)
+        self.assertInHTML(
+            '<option value="{}" selected>{}</option>'.format(
+                self.active.pk, self.active
+            ),
+            html,
+        )
+
+    def test_inactive(self):
+        # not in the index: labelled from the queryset instead.
+        section = make_sections(self.session, 1, [self.inactive])[0]
+        html = self.render_instructor(section)
+        self.assertInHTML(
+            '<option value="{}" selected>{}</option>'.format(
+                self.inactive.pk, self.inactive
+            ),
+            html,
+        )
+
+
+class SessionSummaryTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+        self.profile = make_profile("prof")
+        TeachingProfile.objects.filter(pk=self.profile.pk).update(
+            preference_same_day=True, preference_no_back_to_back=True
+        )
+        self.profile.refresh_from_db()
+        for semester, preferred_load in [("1", 2), ("3", 1)]:
+            SemesterTeachingPreference.objects.create(
+                profile=self.profile, semester=semester, preferred_load=preferred_load
+            )
+        self.t1, self.t2 = make_timeslot("MWF", 8), make_timeslot("MWF", 9)
+        self.t3 = make_timeslot("TR", 10)
+        online = Timeslot.objects.Online()
+        make_sections(
+            self.session, 5, [self.profile], [self.t1, self.t1, self.t2, online, online]
+        )
+        make_sections(self.session, 2, [self.profile], [self.t3, self.t1], "3")
+
+    def test_summary(self):
+        summary = self.profile.session_summary(self.session)
+        self.assertEqual(summary["remaining_load"], 3 - 7)
+        self.assertEqual(summary["remaining_term_loads"]["1"], 2 - 5)
+        self.assertEqual(summary["remaining_term_loads"]["3"], 1 - 2)
+        winter, fall = summary["semesters"]["1"], summary["semesters"]["3"]
+        self.assertEqual(winter["timeslot_conflicts"], [self.t1.pk])
+        self.assertTrue(winter["back_to_back"])
+        self.assertFalse(winter["different_days"])
+        self.assertEqual(fall["timeslot_conflicts"], [])
+        self.assertFalse(fall["back_to_back"])
+        self.assertTrue(fall["different_days"])
+
+    def test_consistent(self):
+        # the single checks, the annotated loads and the worksheet agree.
+        summary = self.profile.session_summary(self.session)
+        loads = self.profile.get_remaining_loads(self.session)
+        self.assertEqual(
+            loads, (summary["remaining_load"], summary["remaining_term_loads"])
+        )
+        annotated = TeachingProfile.objects.with_session_loads(self.session).get(
+            pk=self.profile.pk
+        )
+        self.assertEqual(annotated.get_annotated_remaining_loads(), loads)
+        snapshot = WorksheetSnapshot(self.session)
+        self.assertEqual(snapshot.get_remaining_loads(self.profile.pk), loads)
+        for semester in ["1", "3"]:
+            self.assertEqual(
+                snapshot.get_timeslot_conflicts(self.profile.pk, semester),
+                self.profile.get_timeslot_conflicts(self.session, semester),
+            )
+            self.assertEqual(
+                self.profile.has_back_to_back(self.session, semester),
+                summary["semesters"][semester]["back_to_back"],
+            )
+            self.assertEqual(
+                self.profile.has_different_days(self.session, semester),
+                summary["semesters"][semester]["different_days"],
+            )
+
+
+class ImproveTests(SimpleTestCase):
+    def test_online(self):
+        # as the engines do, local search leaves Online sections alone.
+        state, scores = synthetic_department(200, seed=0, assigned=0, online=0.3)
+        online = np.nonzero(state.section_timeslot == ONLINE_PK)[0]
+        sections = LocalSearch(state, scores).sections
+        self.assertEqual(len(sections) + len(online), 200)
+        self.assertFalse(np.isin(online, sections).any())
+        improve(state, scores, max_moves=2000, random_state=np.random.RandomState(0))
+        self.assertTrue((state.section_instructor[online] == NONE).all())
+
+
+class ImsvmTests(SimpleTestCase):
+    def assertSameMatches(self, rankings, seed):
+        svd_state = {}
+        self.assertEqual(
+            imsvm(rankings.copy(), rank_threshold=0.5),
+            imsvm(
+                rankings.copy(),
+                rank_threshold=0.5,
+                method="randomized",
+                random_state=np.random.RandomState(seed),
+                svd_state=svd_state,
+            ),
+        )
+        return svd_state
+
+    def test_randomized(self):
+        # many singular values close to the largest: the exact fallback.
+        for seed in range(10):
+            rankings, capacity = random_problem(80, 400, seed=seed)
+            self.assertSameMatches(rankings, seed)
+
+    def test_randomized_few_values(self):
+        # a few values stand out: the randomized decomposition is used.
+        for seed in range(10):
+            rng = np.random.RandomState(seed)
+            rankings = np.dot(
+                rng.random_sample((80, 4)) * [10, 6, 3, 1], rng.random_sample((4, 400))
+            ) + 0.3 * rng.random_sample((80, 400))
+            self.assertIn("k", self.assertSameMatches(rankings, seed))
+
+
+#######################################################################
+
+
+class QueryCountTests(TestCase):
+    """
+    The worksheet and the section changelist use a fixed number of
+    queries, however many sections there are.
+    """
+
+    def setUp(self):
+        self.session = make_session()
+        self.instructors = [make_profile("prof{}".format(i)) for i in range(3)]
+        self.timeslots = [make_timeslot("MWF", 8 + i) for i in range(3)]
+        options._invalidate()
+        user = User.objects.create_superuser("admin", "admin@example.com", "x")
+        self.client.force_login(user)
+
+    def assertConstantQueries(self, url):
+        make_sections(self.session, 2, self.instructors, self.timeslots)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        make_sections(self.session, 10, self.instructors, self.timeslots, "2")
+        with self.assertNumQueries(len(context)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_worksheet(self):
+        response = self.assertConstantQueries(
+            reverse(
+                "admin:draftschedulesession_worksheet", kwargs={"pk": self.session.pk}
+            )
+        )
+        self.assertEqual(len(response.context["formset"].forms), 12)
+
+    def test_worksheet_compact(self):
+        self.assertConstantQueries(
+            reverse(
+                "admin:draftschedulesession_worksheet_compact",
+                kwargs={"pk": self.session.pk},
+            )
+        )
+
+    def test_changelist(self):
+        response = self.assertConstantQueries(
+            reverse("admin:course_planning_draftsection_changelist")
+        )
+        self.assertEqual(response.context["cl"].result_count, 12)
+
+
+#######################################################################
@@ -15,7 +15,7 @@ def _timeslots_adjacent(t1, t2, near_minutes):
     if t2.start_time < t1.start_time:
         t1, t2 = t2, t1
     return (
-        t1.stop_time.hour * 60 + t1.stop_time.minute + 45
+        t1.stop_time.hour * 60 + t1.stop_time.minute + near_minutes
         > t2.start_time.hour * 60 + t2.start_time.minute
     )
 
@@ -0,0 +1,158 @@
+"""
+Precomputed relations between timeslots.
+"""
+#######################################################################
+
+import numpy as np
+
+#######################################################################
+
+DAY_BITS = {day: 1 << i for i, day in enumerate("MTWRFSU")}
+
+# timeslots which end less than this many minutes before another begins
+#   (on a shared day) are considered to be back to back.
+NEAR_MINUTES = 45
+
+#######################################################################
+
+
+def day_mask(day):
+    """
+    The bitmask for a day string, e.g., ``"MWF"``.
+    """
+    mask = 0
+    for d in day or "":
+        mask |= DAY_BITS.get(d.upper(), 0)
+    return mask
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+#######################################################################
+
+
+class TimeslotIndex(object):
+    """
+    Relation matrices for a set of timeslots, indexed by position:
+
+    ``adjacent``
+        the timeslots share a day and are back to back (or overlap);
+    ``overlap``
+        the timeslots share a day and overlap in time;
+    ``nested_days``
+        the days of one timeslot are a subset of the other's, e.g.,
+        ``MW`` and ``MWF``.  Teaching in timeslots that are not nested
+        means teaching on different days.
+
+    The diagonals are ``False`` for ``adjacent`` and ``overlap``.
+    Unknown timeslots (``None``, online, inactive...) are ignored by
+    every test.
+    """
+
+    def __init__(self, rows, near_minutes=None, online_pk=None):
+        """
+        ``rows`` are ``(pk, day, start_time, stop_time)`` tuples.
+        """
+        if near_minutes is None:
+            near_minutes = NEAR_MINUTES
+        self.online_pk = online_pk
+        rows = list(rows)
+        self.pk = np.array([r[0] for r in rows], dtype=int)
+        self._map = {pk: i for i, pk in enumerate(self.pk.tolist())}
+        self.days = np.array([day_mask(r[1]) for r in rows], dtype=int)
+        self.start = np.array([_minutes(r[2]) for r in rows], dtype=int)
+        self.stop = np.array([_minutes(r[3]) for r in rows], dtype=int)
+
+        common = self.days[:, None] & self.days[None, :]
+        shared_day = common != 0
+        self.nested_days = (common == self.days[:, None]) | (
+            common == self.days[None, :]
+        )
+        starts_first = self.start[:, None] <= self.start[None, :]
+        # for each pair, the gap from the end of the earlier to the
+        #   start of the later.
+        gap = np.where(
+            starts_first,
+            self.start[None, :] - self.stop[:, None],
+            self.start[:, None] - self.stop[None, :],
+        )
+        off_diagonal = ~np.eye(len(rows), dtype=bool)
+        self.adjacent = self.nested_days & (gap < near_minutes) & off_diagonal
+        self.overlap = shared_day & (gap < 0) & off_diagonal
+
+    @classmethod
+    def load(cls, near_minutes=None):
+        """
+        All active, scheduled timeslots (except Online) with one query.
+        """
+        from classes.models import Timeslot
+
+        online = Timeslot.objects.Online()
+        qs = Timeslot.objects.filter(active=True, scheduled=True).exclude(pk=online.pk)
+        rows = qs.values_list("pk", "day", "start_time", "stop_time")
+        return cls(rows, near_minutes=near_minutes, online_pk=online.pk)
+
+    def index(self, timeslot_ids):
+        """
+        Positions of the given timeslot ids; ``-1`` for unknown ones.
+        """
+        return np.array(
+            [self._map.get(pk, -1) for pk in timeslot_ids], dtype=int
+        ).reshape(-1)
+
+    def occupancy(self, timeslot_id_lists):
+        """
+        A boolean (rows x timeslots) matrix from a list of timeslot id
+        lists, e.g., the timeslots each instructor teaches in.
+        """
+        result = np.zeros((len(timeslot_id_lists), len(self.pk)), dtype=bool)
+        for row, id_list in enumerate(timeslot_id_lists):
+            idx = self.index(id_list)
+            result[row, idx[idx >= 0]] = True
+        return result
+
+    def _any_pair(self, matrix, timeslot_ids):
+        idx = self.index(timeslot_ids)
+        idx = idx[idx >= 0]
+        return bool(matrix[np.ix_(idx, idx)].any())
+
+    def has_adjacent(self, timeslot_ids):
+        """
+        Is any pair of the given timeslots back to back (or overlapping)?
+        """
+        return self._any_pair(self.adjacent, timeslot_ids)
+
+    def has_different_days(self, timeslot_ids):
+        """
+        Do the given timeslots fall on different days?
+        """
+        return self._any_pair(~self.nested_days, timeslot_ids)
+
+    def _mask(self, matrix, occupancy, timeslot_ids):
+        idx = self.index(timeslot_ids)
+        valid = idx >= 0
+        result = np.zeros((occupancy.shape[0], len(idx)), dtype=bool)
+        if valid.any():
+            hits = np.dot(occupancy.astype(int), matrix[:, idx[valid]].astype(int))
+            result[:, valid] = hits > 0
+        return result
+
+    def adjacent_mask(self, occupancy, timeslot_ids):
+        """
+        Boolean (rows x timeslot_ids) matrix: is the timeslot back to
+        back with any of the row's occupied timeslots?
+        ``occupancy`` is as returned by ``occupancy()``.
+        """
+        return self._mask(self.adjacent, occupancy, timeslot_ids)
+
+    def different_day_mask(self, occupancy, timeslot_ids):
+        """
+        Boolean (rows x timeslot_ids) matrix: would the timeslot put
+        the row's teaching on different days?
+        """
+        return self._mask(~self.nested_days, occupancy, timeslot_ids)
+
+
+#######################################################################